@@ -1,5 +1,9 @@
+# Start measuring the startup time first thing, if asked on the command line (see demo/startup_profiling.py)
+from demo.startup_profiling import profiler, start_if_requested
+start_if_requested()
 
-# Generate the code from .ui and .qrc files in case they are missing or outdated
-import os
-import pyqt5ac
-pyqt5ac.main(config=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'pyqt5ac.yml'))
\ No newline at end of file
+# The code generated from .ui and .qrc files is normally generated when the package is built: while developing,
+# set the DEMO_DEV_UI environment variable to regenerate it here when outdated (see demo/ui_generation.py)
+from demo.ui_generation import ensure_generated
+with profiler.span("Generate Qt Designer code"):
+    ensure_generated()
@@ -0,0 +1,24 @@
+"""
+Creation of the ``QApplication``, shared by all the entry points of the demo
+(``demo/main.py`` and the ``main.py`` of each example).
+"""
+import sys
+
+from PyQt5.QtWidgets import QApplication
+
+from demo.startup_profiling import profiler
+from demo import stall_watchdog
+
+
+def create_application() -> QApplication:
+    """
+    Instantiates the QApplication, then starts the tools requested on the command line that need it.
+    :return: the QApplication
+    """
+    with profiler.span("Create QApplication"):
+        app = QApplication(sys.argv)
+
+    # Log the GUI thread's stack whenever the event loop freezes, if requested with --watchdog.
+    # The watchdog is a child of the application, that keeps it alive until the application quits.
+    stall_watchdog.start_if_requested(parent=app)
+    return app
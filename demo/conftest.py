@@ -0,0 +1,58 @@
+"""
+Fixtures shared by the tests of all the examples.
+
+The simulated devices are created once per test session (once per worker process with pytest-xdist,
+so workers never share them), and set back to their initial state before each test.
+"""
+import pytest
+import pyjapc
+
+from demo.papc_setup.papc_devices import setup_papc_devices, reset_papc_devices, teardown_papc_devices
+from demo.papc_setup.papc_utils import tick_scheduler
+from demo.japc_setup.japc_connections import connection_pool
+from demo.japc_setup.japc_subscriptions import subscription_hub
+
+
+@pytest.fixture(scope="session")
+def papc_factory():
+    """
+    This fixture creates the simulated devices once for the whole test session.
+    Their timers don't tick in real time: tests make them tick with the 'tick_devices' fixture,
+    so they never have to wait for the clock.
+    """
+    tick_scheduler.set_manual(True)
+    yield setup_papc_devices()
+    teardown_papc_devices()
+    tick_scheduler.set_manual(False)
+
+
+@pytest.fixture()
+def tick_devices():
+    """
+    This fixture returns a function making the simulated devices tick right away:
+    call tick_devices(5) to simulate 5 ticks of all their timers. See ``TickScheduler.step`` for the other arguments.
+    """
+    return tick_scheduler.step
+
+
+@pytest.fixture(autouse=True)
+def mock_pyjapc(papc_factory):
+    """
+    This fixture intercepts PyJapc calls and redirects them to a papc instance.
+    Make sure you setup papc to simulate the same devices your GUI usually
+    connects to.
+    This fixture will make an object called 'mock_pyjapc' available in your tests
+    without the need to isntantiate it.
+    The devices are shared by all the tests: they are set back to their initial state before each one.
+    """
+    # Monkey-patch PyJapc
+    reset_papc_devices()
+    pyjapc.PyJapc = papc_factory
+    japc = pyjapc.PyJapc()
+    japc.setSelector("")
+    # Run test
+    yield japc
+    # Clean up
+    subscription_hub.clear()
+    connection_pool.clear()
+    pyjapc.PyJapc = None
@@ -1,8 +1,6 @@
 import pytest
-import pyjapc
 
 from demo.example_3_plot.widgets.main_widget import MainWidget
-from demo.papc_setup.papc_devices import setup_papc_devices
 
 
 @pytest.fixture()
@@ -16,24 +14,7 @@ def main_widget(qtbot):
     main_widget = MainWidget()
     main_widget.show()
     qtbot.addWidget(main_widget)
+    # Wait for the initial values of the spinboxes, that are read in the background:
+    # the future completes once they are shown
+    qtbot.waitUntil(main_widget.settings_future.done)
     yield main_widget
-
-
-@pytest.fixture(autouse=True)
-def mock_pyjapc(monkeypatch):
-    """
-    This fixture intercepts PyJapc calls and redirects them to a papc instance.
-    Make sure you setup papc to simulate the same devices your GUI usually
-    connects to.
-    This fixture will make an object called 'mock_pyjapc' available in your tests
-    without the need to isntantiate it.
-    """
-    # Monkey-patch PyJapc
-    pyjapc.PyJapc = setup_papc_devices()
-    japc = pyjapc.PyJapc()
-    japc.setSelector("")
-    # Run test
-    yield japc
-    # Clean up
-    pyjapc.PyJapc = None
-
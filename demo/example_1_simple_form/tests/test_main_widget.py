@@ -42,7 +42,7 @@ def test_spinbox_works(main_widget, mock_pyjapc, qtbot):
     # Does it set the right value on the right device?
     ampl_spinbox.clear()
     qtbot.keyClicks(ampl_spinbox, "50")
-    assert mock_pyjapc.getParam("TEST_DEVICE/Settings#amplitude_sin") == 50
+    qtbot.waitUntil(lambda: mock_pyjapc.getParam("TEST_DEVICE/Settings#amplitude_sin") == 50)
 
     # Does it contain a QSpinBox called 'period_sin'?
     per_spinbox = main_widget.findChild(QSpinBox, "period_sin")
@@ -51,4 +51,4 @@ def test_spinbox_works(main_widget, mock_pyjapc, qtbot):
     # Does it set the right value on the right device?
     per_spinbox.clear()
     qtbot.keyClicks(per_spinbox, "30")
-    assert mock_pyjapc.getParam("TEST_DEVICE/Settings#period_sin") == 30
+    qtbot.waitUntil(lambda: mock_pyjapc.getParam("TEST_DEVICE/Settings#period_sin") == 30)
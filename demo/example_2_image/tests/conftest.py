@@ -1,8 +1,6 @@
 import pytest
-import pyjapc
 
 from demo.example_2_image.widgets.main_widget import MainWidget
-from demo.papc_setup.papc_devices import setup_papc_devices
 
 
 @pytest.fixture()
@@ -17,23 +15,3 @@ def main_widget(qtbot):
     main_widget.show()
     qtbot.addWidget(main_widget)
     yield main_widget
-
-
-@pytest.fixture(autouse=True)
-def mock_pyjapc(monkeypatch):
-    """
-    This fixture intercepts PyJapc calls and redirects them to a papc instance.
-    Make sure you setup papc to simulate the same devices your GUI usually
-    connects to.
-    This fixture will make an object called 'mock_pyjapc' available in your tests
-    without the need to isntantiate it.
-    """
-    # Monkey-patch PyJapc
-    pyjapc.PyJapc = setup_papc_devices()
-    japc = pyjapc.PyJapc()
-    japc.setSelector("")
-    # Run test
-    yield japc
-    # Clean up
-    pyjapc.PyJapc = None
-
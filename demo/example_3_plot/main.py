@@ -3,11 +3,13 @@ import sys
 import logging
 
 from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import QApplication, QMessageBox, QWidget
+from PyQt5.QtWidgets import QMessageBox, QWidget
 
 # Import the Presenter from the widgets folder
 from demo.example_3_plot.widgets.main_widget import MainWidget
 from demo.constants import APPLICATION_NAME, AUTHOR, EMAIL
+from demo.startup_profiling import profiler
+from demo.application import create_application
 
 
 def main():
@@ -16,14 +18,17 @@ def main():
         and the ApplicationFrame widgets, that will contain your GUI.
         Then loads your widgets into the main windows and shows it, entering the event loop.
     """
+    # Everything imported until now is part of the package import (see demo/startup_profiling.py)
+    profiler.end("Package import")
     logging.info("Starting up {}...".format(APPLICATION_NAME))
 
-    # Instantiate the QApplication
-    app = QApplication(sys.argv)
+    # Instantiate the QApplication (see demo/application.py)
+    app = create_application()
 
     try:
         # Instantiate your GUI
-        widget = MainWidget()
+        with profiler.span("Create MainWidget"):
+            widget = MainWidget()
 
         # Set window icon
         icon_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../window_icon.png')
@@ -41,7 +46,10 @@ def main():
         return
 
     # Enter the event loop by showing the window
-    widget.show()
+    with profiler.span("Show the window"):
+        widget.show()
+    # Report the startup time, if requested with --profile-startup
+    profiler.finish()
 
     # Once left the event loop, terminates the application
     sys.exit(app.exec_())
@@ -0,0 +1,180 @@
+import os
+import re
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+# Every sample takes one fixed-size record: its timestamp and its value
+RECORD_DTYPE = np.dtype([("stamp", "<f8"), ("value", "<f8")])
+
+# Capture files start with a header: a magic string, then the number of records written so far
+_MAGIC = b"DEMOCAP1"
+_HEADER_DTYPE = np.dtype([("magic", "S8"), ("count", "<u8")])
+# Records start after the header, aligned to 64 bytes
+_HEADER_SIZE = 64
+
+
+class CaptureWriter:
+    """
+    Appends samples to a capture file, through a memory map.
+
+    The file grows by ``chunk_records`` records at a time, so appending never copies the samples
+    already written, and the operating system decides which pages stay in memory: a capture
+    of a whole fill takes almost no RAM.
+
+    Timestamps must be increasing (as acquisition stamps are), so that ``CaptureReader``
+    can find time ranges with a binary search.
+    """
+    def __init__(self, path: str, chunk_records: int = 1 << 20):
+        """
+        :param path: the capture file. If it exists, new samples are appended to it.
+        :param chunk_records: by how many records the file grows when it's full
+        """
+        self.path = path
+        self.chunk_records = chunk_records
+        if not os.path.exists(path):
+            with open(path, "wb") as capture_file:
+                capture_file.write(np.array([(_MAGIC, 0)], dtype=_HEADER_DTYPE).tobytes().ljust(_HEADER_SIZE, b"\0"))
+        self._header = np.memmap(path, dtype=_HEADER_DTYPE, mode="r+", shape=(1, ))
+        if self._header["magic"][0] != _MAGIC:
+            raise ValueError("{} is not a capture file".format(path))
+        self._count = int(self._header["count"][0])
+        self._records: Optional[np.memmap] = None
+        self._map_records(max(self._count, chunk_records))
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _map_records(self, capacity: int) -> None:
+        """ Grows the file to hold ``capacity`` records, and maps them. """
+        if self._records is not None:
+            self._records.flush()
+        self._records = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r+", offset=_HEADER_SIZE, shape=(capacity, ))
+
+    def extend(self, stamps: np.ndarray, values: np.ndarray) -> None:
+        """
+        Appends many samples at once.
+        :param stamps: the timestamps of the samples
+        :param values: the values of the samples
+        :return: None
+        """
+        count = len(stamps)
+        with self._lock:
+            end = self._count + count
+            if end > len(self._records):
+                self._map_records(max(end, len(self._records) + self.chunk_records))
+            self._records["stamp"][self._count:end] = stamps
+            self._records["value"][self._count:end] = values
+            self._count = end
+            # Readers only look at the records counted in the header
+            self._header["count"][0] = end
+
+    def append(self, stamp: float, value: float) -> None:
+        """ Appends one sample. """
+        self.extend((stamp, ), (value, ))
+
+    def flush(self) -> None:
+        """ Writes the changes to disk. """
+        with self._lock:
+            self._records.flush()
+            self._header.flush()
+
+    def close(self) -> None:
+        """ Writes the changes to disk and releases the file. """
+        self.flush()
+        self._records = self._header = None
+
+
+class CaptureReader:
+    """
+    Reads a capture file written by ``CaptureWriter``, even while it is being written.
+
+    The file is memory-mapped too: reading a time range only loads the pages
+    holding the samples of that range, not the whole file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        header = np.memmap(path, dtype=_HEADER_DTYPE, mode="r", shape=(1, ))
+        if header["magic"][0] != _MAGIC:
+            raise ValueError("{} is not a capture file".format(path))
+
+    def records(self) -> np.ndarray:
+        """ Returns a read-only memory map of all the records written so far. """
+        count = int(np.memmap(self.path, dtype=_HEADER_DTYPE, mode="r", shape=(1, ))["count"][0])
+        if count == 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(self.path, dtype=RECORD_DTYPE, mode="r", offset=_HEADER_SIZE, shape=(count, ))
+
+    def __len__(self) -> int:
+        return len(self.records())
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        """ Returns the timestamps of the first and last samples, or None if the file is empty. """
+        records = self.records()
+        if len(records) == 0:
+            return None
+        return float(records["stamp"][0]), float(records["stamp"][-1])
+
+    def slice(self, start: float, end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads the samples taken in the given time range.
+        :param start: the beginning of the range (included)
+        :param end: the end of the range (included). If None, the range goes until the newest sample.
+        :return: copies of the timestamps and of the values of the samples
+        """
+        records = self.records()
+        stamps = records["stamp"]
+        first = np.searchsorted(stamps, start, side="left")
+        last = np.searchsorted(stamps, end, side="right") if end is not None else len(records)
+        return np.array(stamps[first:last]), np.array(records["value"][first:last])
+
+
+class CaptureSink:
+    """
+    Stores the samples of any number of parameters, one capture file per parameter, in a directory.
+    Give it to the data sources (``sink`` argument) to keep everything they receive.
+    """
+    def __init__(self, directory: str, chunk_records: int = 1 << 20):
+        """
+        :param directory: where to write the capture files. It's created if needed.
+        :param chunk_records: by how many records the files grow when full (see ``CaptureWriter``)
+        """
+        self.directory = directory
+        self.chunk_records = chunk_records
+        os.makedirs(directory, exist_ok=True)
+        self._writers: Dict[str, CaptureWriter] = {}
+        self._lock = Lock()
+
+    def path(self, parameter_name: str) -> str:
+        """ Returns the capture file of the given parameter. """
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", parameter_name) + ".capture")
+
+    def writer(self, parameter_name: str) -> CaptureWriter:
+        """ Returns the writer of the given parameter, opening its capture file if needed. """
+        with self._lock:
+            writer = self._writers.get(parameter_name)
+            if writer is None:
+                writer = self._writers[parameter_name] = CaptureWriter(self.path(parameter_name), self.chunk_records)
+            return writer
+
+    def reader(self, parameter_name: str) -> CaptureReader:
+        """ Returns a reader for the capture file of the given parameter. """
+        return CaptureReader(self.path(parameter_name))
+
+    def extend(self, parameter_name: str, stamps: np.ndarray, values: np.ndarray) -> None:
+        """ Stores the given samples of a parameter. """
+        self.writer(parameter_name).extend(stamps, values)
+
+    def append(self, parameter_name: str, stamp: float, value: float) -> None:
+        """ Stores one sample of a parameter. """
+        self.writer(parameter_name).append(stamp, value)
+
+    def close(self) -> None:
+        """ Writes all the capture files to disk and releases them. """
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
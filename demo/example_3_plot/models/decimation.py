@@ -0,0 +1,232 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from demo.example_3_plot.models.ring_buffer import CurveRingBuffer
+
+
+def _finite(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Leaves out the points whose value is NaN or infinite: they have no minimum nor maximum. Returns new arrays. """
+    finite = np.isfinite(y)
+    return x[finite], y[finite]
+
+
+def _segment_extremes(y_min: np.ndarray, y_max: np.ndarray, starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the position of the minimum of ``y_min`` and of the maximum of ``y_max`` in each segment.
+    :param y_min: the values to take the minimum of
+    :param y_max: the values to take the maximum of (the same as ``y_min`` for raw points)
+    :param starts: the index where each segment starts, in increasing order, the first being 0
+    :return: the indexes of the minimum and of the maximum of each segment
+    """
+    counts = np.diff(np.append(starts, len(y_min)))
+    # First position of each segment where the value equals the extreme of the segment
+    min_positions = np.flatnonzero(y_min == np.repeat(np.minimum.reduceat(y_min, starts), counts))
+    max_positions = np.flatnonzero(y_max == np.repeat(np.maximum.reduceat(y_max, starts), counts))
+    return (min_positions[np.searchsorted(min_positions, starts)],
+            max_positions[np.searchsorted(max_positions, starts)])
+
+
+def _interleave(x_min: np.ndarray, y_min: np.ndarray, x_max: np.ndarray,
+                y_max: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Merges the minimum and maximum of each bucket into a single curve, keeping the points in time order. """
+    min_first = x_min <= x_max
+    x = np.empty(2 * len(x_min))
+    y = np.empty(2 * len(x_min))
+    x[0::2] = np.where(min_first, x_min, x_max)
+    y[0::2] = np.where(min_first, y_min, y_max)
+    x[1::2] = np.where(min_first, x_max, x_min)
+    y[1::2] = np.where(min_first, y_max, y_min)
+    return x, y
+
+
+def decimate_by_time(x: np.ndarray, y: np.ndarray, bucket_width: float,
+                     origin: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Replaces the points falling in each time bucket with the lowest and the highest of them,
+    so that peaks stay visible however many points are dropped.
+    :param x: the timestamps of the points, increasing
+    :param y: the values of the points
+    :param bucket_width: the width of the buckets, in the unit of ``x``. Use the time covered by one pixel.
+    :param origin: where the grid of buckets starts, so that consecutive calls use the same buckets
+    :return: two points per non-empty bucket (one if a bucket has a single point), in time order
+    """
+    x, y = _finite(x, y)
+    if len(x) == 0:
+        return x, y
+    buckets = np.floor((x - origin) / bucket_width)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    min_index, max_index = _segment_extremes(y, y, starts)
+    x, y = _interleave(x[min_index], y[min_index], x[max_index], y[max_index])
+    # Buckets with a single point would give it twice
+    keep = np.ones(len(x), dtype=bool)
+    keep[1::2] = min_index != max_index
+    return x[keep], y[keep]
+
+
+class _PyramidLevel:
+    """ One level of a ``MinMaxPyramid``: the lowest and highest point of each bucket, in two ring buffers. """
+    def __init__(self, capacity: int):
+        self.mins = CurveRingBuffer(capacity)
+        self.maxs = CurveRingBuffer(capacity)
+        # Input buckets that don't fill a bucket of this level yet: (x_min, y_min, x_max, y_max)
+        self.pending = tuple(np.zeros(0) for _ in range(4))
+
+    def window(self, x_min: float, x_max: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """ Returns the buckets whose lowest point falls in the given range. """
+        mins_x, mins_y = self.mins.data()
+        maxs_x, maxs_y = self.maxs.data()
+        first = np.searchsorted(mins_x, x_min, side="left")
+        last = np.searchsorted(mins_x, x_max, side="right")
+        return mins_x[first:last], mins_y[first:last], maxs_x[first:last], maxs_y[first:last]
+
+
+class MinMaxPyramid:
+    """
+    Multi-resolution summary of a curve, to draw any time range with a bounded number of points.
+
+    The newest ``capacity`` points are kept as they are. On top of them, each level of the pyramid keeps
+    the lowest and the highest point of every ``factor`` buckets of the level below, so level ``k`` summarizes
+    ``factor ** (k + 1)`` points per bucket. All levels hold ``capacity // factor`` buckets, so coarser levels
+    go further back in time: with the defaults and data at 1 kHz, the last level covers more than a day.
+
+    ``query()`` picks the finest resolution giving at most the requested number of points. As each bucket
+    keeps its extremes, peaks stay visible at every resolution.
+
+    Points must be added in order of increasing X coordinate. A caller already storing the points in a
+    ``CurveRingBuffer`` can share it as ``raw`` and add the points with ``summarize()``, so they are not
+    stored twice.
+    """
+    def __init__(self, capacity: int = 65536, factor: int = 4, levels: int = 8, raw: Optional[CurveRingBuffer] = None):
+        """
+        :param capacity: how many raw points are kept. Ignored if ``raw`` is given.
+        :param factor: how many buckets of a level are summarized in one bucket of the next level
+        :param levels: how many levels of summaries are kept
+        :param raw: where the raw points are kept, if the caller already stores them
+        """
+        if factor < 2:
+            raise ValueError("The factor must be at least 2, got {}".format(factor))
+        self.factor = factor
+        self.raw = raw if raw is not None else CurveRingBuffer(capacity)
+        self.levels: List[_PyramidLevel] = [_PyramidLevel(max(self.raw.capacity // factor, 1))
+                                            for _ in range(levels)]
+        # X coordinate of the first point ever added: nothing exists before it
+        self._first_x: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def extend(self, x: np.ndarray, y: np.ndarray) -> None:
+        """
+        Adds new points to the curve.
+        :param x: the X coordinates of the points, increasing and greater than the ones already added
+        :param y: the Y coordinates of the points
+        :return: None
+        """
+        self.raw.extend(x, y)
+        self.summarize(x, y)
+
+    def append(self, x: float, y: float) -> None:
+        """ Adds one point to the curve. """
+        self.extend(np.array([x]), np.array([y]))
+
+    def summarize(self, x: np.ndarray, y: np.ndarray) -> None:
+        """
+        Adds new points to the summaries only: use it when they were already stored in ``raw`` by the caller.
+        :param x: the X coordinates of the points, increasing and greater than the ones already added
+        :param y: the Y coordinates of the points
+        :return: None
+        """
+        x, y = _finite(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        if len(x) == 0:
+            return
+        if self._first_x is None:
+            self._first_x = float(x[0])
+        # Raw points are buckets whose lowest and highest points are the same
+        self._push(0, x, y, x, y)
+
+    def clear(self) -> None:
+        """ Forgets all the points. """
+        self._first_x = None
+        self.raw.clear()
+        for level in self.levels:
+            level.mins.clear()
+            level.maxs.clear()
+            level.pending = tuple(np.zeros(0) for _ in range(4))
+
+    def _push(self, index: int, x_min: np.ndarray, y_min: np.ndarray, x_max: np.ndarray, y_max: np.ndarray) -> None:
+        """ Summarizes the given buckets into the level ``index``, and the new buckets of that level into the next. """
+        if index == len(self.levels) or len(x_min) == 0:
+            return
+        level = self.levels[index]
+        x_min, y_min, x_max, y_max = (np.concatenate((pending, new)) for pending, new
+                                      in zip(level.pending, (x_min, y_min, x_max, y_max)))
+        complete = len(x_min) // self.factor * self.factor
+        level.pending = tuple(column[complete:] for column in (x_min, y_min, x_max, y_max))
+        if complete == 0:
+            return
+        starts = np.arange(0, complete, self.factor)
+        min_index, max_index = _segment_extremes(y_min[:complete], y_max[:complete], starts)
+        new_buckets = x_min[min_index], y_min[min_index], x_max[max_index], y_max[max_index]
+        level.mins.extend(new_buckets[0], new_buckets[1])
+        level.maxs.extend(new_buckets[2], new_buckets[3])
+        self._push(index + 1, *new_buckets)
+
+    def _covered_from(self, mins: CurveRingBuffer, maxs: CurveRingBuffer) -> float:
+        """
+        Returns the X coordinate from which the points (or the buckets of a level) are all still there:
+        the first point ever added, until the oldest ones start to be overwritten.
+        """
+        if len(mins) < mins.capacity:
+            return self._first_x
+        return min(mins.data()[0][0], maxs.data()[0][0])
+
+    def query(self, x_min: float, x_max: float, max_points: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the curve in the given range, with at most about ``max_points`` points.
+        For a plot, ask for twice its width in pixels.
+        :param x_min: the beginning of the range
+        :param x_max: the end of the range
+        :param max_points: how many points to return at most
+        :return: the X and Y coordinates of the points, new arrays
+        """
+        if self._first_x is None:
+            return np.zeros(0), np.zeros(0)
+        # Nothing exists before the first point: a range starting earlier is covered from there
+        start = max(x_min, self._first_x)
+        x, y = _finite(*self.raw.window(x_min, x_max))
+        if len(x) <= max_points and self._covered_from(self.raw, self.raw) <= start:
+            return x, y
+
+        # The finest level covering the whole range with few enough points. If none covers it,
+        # the last level goes furthest back in time.
+        buckets = self.levels[-1].window(x_min, x_max)
+        for level in self.levels:
+            level_buckets = level.window(x_min, x_max)
+            if 2 * len(level_buckets[0]) <= max_points and self._covered_from(level.mins, level.maxs) <= start:
+                buckets = level_buckets
+                break
+        x, y = _interleave(*buckets)
+
+        # The newest points are not summarized in the level yet: decimate them on the fly
+        tail_x, tail_y = _finite(*self.raw.window(x_min, x_max))
+        if len(x) > 0:
+            tail_x, tail_y = tail_x[tail_x > x[-1]], tail_y[tail_x > x[-1]]
+        if len(tail_x) > 0:
+            bucket_count = max((max_points - len(x)) // 2, 1)
+            bucket_size = int(np.ceil(len(tail_x) / bucket_count))
+            if bucket_size > 1:
+                starts = np.arange(0, len(tail_x), bucket_size)
+                min_index, max_index = _segment_extremes(tail_y, tail_y, starts)
+                tail_x, tail_y = _interleave(tail_x[min_index], tail_y[min_index],
+                                             tail_x[max_index], tail_y[max_index])
+            x, y = np.concatenate((x, tail_x)), np.concatenate((y, tail_y))
+        return x, y
+
+    def span(self) -> Optional[Tuple[float, float]]:
+        """ Returns the X coordinates of the oldest point still summarized and of the newest point. """
+        raw_x, _ = self.raw.data()
+        if len(raw_x) == 0:
+            return None
+        oldest = [level.mins.data()[0] for level in self.levels if len(level.mins)]
+        return float(min([raw_x[0]] + [x[0] for x in oldest])), float(raw_x[-1])
@@ -0,0 +1,189 @@
+"""
+Opt-in measurements of the hot paths of the plot sources: the JAPC callbacks and the delivery of their values
+to the plot. Enable them by setting the environment variable ``DEMO_SOURCE_STATS=1``, or by calling
+``source_statistics.enable()``, then look at the ``SourceStatsWidget`` or call ``source_statistics.export()``.
+
+For each source (named after its parameter and its class, see ``JapcSource.stats_name``) it records:
+- how many callbacks were received
+- the callback-to-emit latency: how long a value waits in the source before being emitted
+- the emit-to-paint latency: how long an emitted value waits before the plot is painted
+- the backlog: how many values were received but not painted yet
+"""
+import os
+import time
+import logging
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+from PyQt5.QtCore import QObject, QEvent
+
+# Environment variable enabling the statistics at startup
+ENABLE_FLAG = "DEMO_SOURCE_STATS"
+
+
+class _Latency:
+    """ Running mean and maximum of a latency, in seconds. """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency: float) -> None:
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class ParameterStatistics:
+    """ The measurements of one parameter. """
+    def __init__(self, parameter_name: str):
+        self.parameter_name = parameter_name
+        self.started = time.perf_counter()
+        self.callbacks = 0
+        self.emitted = 0
+        self.painted = 0
+        self.max_backlog = 0
+        self.callback_to_emit = _Latency()
+        self.emit_to_paint = _Latency()
+        # When the oldest value emitted but not painted yet was emitted
+        self.oldest_unpainted: Optional[float] = None
+
+    @property
+    def backlog(self) -> int:
+        """ How many values were received but not painted yet. """
+        return self.callbacks - self.painted
+
+    def snapshot(self) -> dict:
+        """ Returns the measurements as a dictionary, with latencies in milliseconds. """
+        elapsed = time.perf_counter() - self.started
+        return {
+            "parameter": self.parameter_name,
+            "callbacks": self.callbacks,
+            "rate": self.callbacks / elapsed if elapsed > 0 else 0.0,
+            "callback_to_emit_mean_ms": self.callback_to_emit.mean * 1000,
+            "callback_to_emit_max_ms": self.callback_to_emit.max * 1000,
+            "emit_to_paint_mean_ms": self.emit_to_paint.mean * 1000,
+            "emit_to_paint_max_ms": self.emit_to_paint.max * 1000,
+            "backlog": self.backlog,
+            "max_backlog": self.max_backlog,
+        }
+
+
+class SourceStatistics:
+    """
+    Collects the measurements of all the sources. Every method returns immediately when disabled,
+    so the sources can call them unconditionally.
+    """
+    def __init__(self):
+        self.enabled = bool(os.environ.get(ENABLE_FLAG))
+        self._parameters: Dict[str, ParameterStatistics] = {}
+        self._lock = Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        """ Forgets all the measurements. """
+        with self._lock:
+            self._parameters.clear()
+
+    def _statistics(self, parameter_name: str) -> ParameterStatistics:
+        """ Returns the measurements of a parameter, creating them if needed. Call it holding the lock. """
+        statistics = self._parameters.get(parameter_name)
+        if statistics is None:
+            statistics = self._parameters[parameter_name] = ParameterStatistics(parameter_name)
+        return statistics
+
+    def callback(self, parameter_name: str) -> Optional[float]:
+        """
+        Records a JAPC callback. Call it first thing in the callback.
+        :param parameter_name: the parameter the value belongs to
+        :return: the time the value was received, to give to ``emitted()``, or None if disabled
+        """
+        if not self.enabled:
+            return None
+        received = time.perf_counter()
+        with self._lock:
+            statistics = self._statistics(parameter_name)
+            statistics.callbacks += 1
+            statistics.max_backlog = max(statistics.max_backlog, statistics.backlog)
+        return received
+
+    def emitted(self, parameter_name: str, received: Optional[float], count: int = 1) -> None:
+        """
+        Records the emission of values to the plot. Call it just before emitting.
+        :param parameter_name: the parameter the values belong to
+        :param received: when the oldest of the values was received, as returned by ``callback()``
+        :param count: how many values are emitted
+        :return: None
+        """
+        if not self.enabled or received is None:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            statistics = self._statistics(parameter_name)
+            statistics.emitted += count
+            statistics.callback_to_emit.add(now - received)
+            if statistics.oldest_unpainted is None:
+                statistics.oldest_unpainted = now
+
+    def painted(self, parameter_names: Iterable[str]) -> None:
+        """
+        Records that a plot showing the given parameters was painted: everything emitted so far is on screen.
+        :param parameter_names: the parameters shown by the plot
+        :return: None
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            for parameter_name in parameter_names:
+                statistics = self._parameters.get(parameter_name)
+                if statistics is None or statistics.oldest_unpainted is None:
+                    continue
+                statistics.emit_to_paint.add(now - statistics.oldest_unpainted)
+                statistics.oldest_unpainted = None
+                statistics.painted = statistics.emitted
+
+    def snapshot(self) -> List[dict]:
+        """ Returns the measurements of all the parameters (see ``ParameterStatistics.snapshot``). """
+        with self._lock:
+            return [statistics.snapshot() for statistics in self._parameters.values()]
+
+    def export(self, logger: logging.Logger = logging.getLogger()) -> None:
+        """ Writes the measurements to the log, one line per parameter. """
+        for snapshot in self.snapshot():
+            logger.info("{parameter}: {callbacks} callbacks ({rate:.1f}/s), "
+                        "callback->emit {callback_to_emit_mean_ms:.2f} ms (max {callback_to_emit_max_ms:.2f}), "
+                        "emit->paint {emit_to_paint_mean_ms:.2f} ms (max {emit_to_paint_max_ms:.2f}), "
+                        "backlog {backlog} (max {max_backlog})".format(**snapshot))
+
+
+# The statistics of all the sources of the application
+source_statistics = SourceStatistics()
+
+
+class PaintProbe(QObject):
+    """
+    Event filter telling ``source_statistics`` when a plot gets painted.
+    Install it on the widget that paints the plot (the viewport, for pyqtgraph-based plots).
+    """
+    def __init__(self, parameter_names: Iterable[str], parent: Optional[QObject] = None):
+        """
+        :param parameter_names: the names of the sources shown by the plot (their ``stats_name``)
+        :param parent: the parent QObject
+        """
+        super().__init__(parent)
+        self.parameter_names = list(parameter_names)
+
+    def eventFilter(self, watched: QObject, event: QEvent) -> bool:
+        if event.type() == QEvent.Paint:
+            source_statistics.painted(self.parameter_names)
+        return False
@@ -1,15 +1,29 @@
-from datetime import datetime
+from concurrent.futures import CancelledError, Future
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Union
 
-from PyQt5.QtCore import QObject, pyqtSlot
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
 
 import pyjapc
-from accwidgets.graph import UpdateSource, PointData
+from accwidgets.graph import UpdateSource, PointData, CurveData
+
+from demo.japc_setup.japc_async import AsyncJapc
+from demo.japc_setup.japc_connections import connection_pool
+from demo.japc_setup.japc_subscriptions import acquisition_stamp, subscription_hub
+from demo.japc_setup.japc_writes import CoalescingWriter
+from demo.example_3_plot.models.ring_buffer import CurveRingBuffer
+from demo.example_3_plot.models.capture import CaptureSink
+from demo.example_3_plot.models.decimation import MinMaxPyramid, decimate_by_time
+from demo.example_3_plot.models.instrumentation import source_statistics
+from demo.startup_profiling import profiler
 
 #########################################################################################
 # Monkey-patch PyJAPC with papc - connect to simulated devices instead of real devices
 # COMMENT OUT THESE LINES TO CONNECT WITH REAL DEVICES
 from demo.papc_setup.papc_devices import setup_papc_devices
-pyjapc.PyJapc = setup_papc_devices()
+with profiler.span("Set up papc"):
+    pyjapc.PyJapc = setup_papc_devices()
 #########################################################################################
 
 
@@ -23,13 +37,19 @@ class JapcModel(QObject):
     In general, **no direct call from the View to the Model, or from the Model to the View, should ever happen**.
 
     You can see how the signals and the slots are connected in the ``ExampleWidget`` class.
+
+    SETs go through a ``CoalescingWriter``: rapid edits are merged and written from a worker thread,
+    and their outcome is reported by the ``writer.sig_set_done`` and ``writer.sig_set_failed`` signals.
     """
-    def __init__(self):
+    def __init__(self, set_window: int = 100):
+        """
+        :param set_window: How long (in milliseconds) edits are collected before being SET
+        """
         super(QObject, self).__init__()
-        # Create the PyJAPC connector
-        self.japc = pyjapc.PyJapc()
-        # Use the "LHC.USER.ALL" selector
-        self.japc.setSelector("LHC.USER.ALL")
+        # Take the shared PyJAPC connector using the "LHC.USER.ALL" selector
+        self.japc = connection_pool.acquire("LHC.USER.ALL")
+        # Create the pipeline that merges the SETs and performs them off the GUI thread
+        self.writer = CoalescingWriter(self.japc, window=set_window, parent=self)
 
     def get_amplitude_sin(self) -> int:
         """
@@ -59,44 +79,190 @@ class JapcModel(QObject):
         """
         return self.japc.getParam("TEST_DEVICE/Settings#period_cos")
 
+    def get_settings(self, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        GETs the whole Settings property from the control system through PyJAPC, in a single round trip.
+        Prefer this over calling the single getters one by one when you need more than one value.
+        :param fields: the names of the fields to return. If None, all the fields of the property are returned.
+        :return: a dictionary mapping the field names to their values
+        """
+        settings = self.japc.getParam("TEST_DEVICE/Settings")
+        if fields is None:
+            return settings
+        return {field: settings[field] for field in fields}
+
     @pyqtSlot(int)
     def set_amplitude_sin(self, value: int) -> None:
         """
-        SETs the amplitude of the sinus plot to the control system through PyJAPC.
+        SETs the amplitude of the sinus plot to the control system through the write pipeline.
         :param value: the amplitude (int)
         :returns: None
         """
-        self.japc.setParam("TEST_DEVICE/Settings#amplitude_sin", value)
+        self.writer.set("TEST_DEVICE/Settings#amplitude_sin", value)
 
     @pyqtSlot(int)
     def set_period_sin(self, value: int) -> None:
         """
-        SETs the period of the sinus plot to the control system through PyJAPC.
+        SETs the period of the sinus plot to the control system through the write pipeline.
         :param value: the period (int)
         :returns: None
         """
-        self.japc.setParam("TEST_DEVICE/Settings#period_sin", value)
+        self.writer.set("TEST_DEVICE/Settings#period_sin", value)
 
     @pyqtSlot(int)
     def set_amplitude_cos(self, value: int) -> None:
         """
-        SETs the amplitude of the cosine plot to the control system through PyJAPC.
+        SETs the amplitude of the cosine plot to the control system through the write pipeline.
         :param value: the amplitude (int)
         :returns: None
         """
-        self.japc.setParam("TEST_DEVICE/Settings#amplitude_cos", value)
+        self.writer.set("TEST_DEVICE/Settings#amplitude_cos", value)
 
     @pyqtSlot(int)
     def set_period_cos(self, value: int) -> None:
         """
-        SETs the period of the sinus plot to the control system through PyJAPC.
+        SETs the period of the sinus plot to the control system through the write pipeline.
         :param value: the period (int)
         :returns: None
         """
-        self.japc.setParam("TEST_DEVICE/Settings#period_cos", value)
+        self.writer.set("TEST_DEVICE/Settings#period_cos", value)
+
+    def close(self) -> None:
+        """
+        Gives the PyJAPC connector back to the shared pool. The model can't be used anymore afterwards.
+        :returns: None
+        """
+        if self.japc is not None:
+            # Don't lose the edits still waiting in the pipeline
+            self.writer.close()
+            connection_pool.release(self.japc)
+            self.japc = None
+
+
+class AsyncJapcModel(JapcModel):
+    """
+    Variant of ``JapcModel`` that never blocks the caller while waiting for the control system.
+
+    GETs run on a worker thread: they return a ``Future`` immediately, and the values read
+    are emitted with the ``sig_settings_received`` signal, that the Presenter can connect to
+    the View. SETs are already performed off the GUI thread by ``JapcModel``'s write pipeline.
+    """
+    # Emitted with a dictionary mapping field names to values, every time settings are read
+    sig_settings_received = pyqtSignal(object)
+    # Emitted with the parameter name and the error message when a GET fails
+    sig_get_failed = pyqtSignal(str, str)
+    # Emitted by the worker thread with the future and the settings read, to complete it on the model's thread
+    _sig_settings_read = pyqtSignal(object, object)
+
+    def __init__(self, set_window: int = 100):
+        """
+        :param set_window: How long (in milliseconds) edits are collected before being SET
+        """
+        super().__init__(set_window=set_window)
+        # GETs of this model run one at a time, on their own worker thread
+        self.async_japc = AsyncJapc(self.japc, max_threads=1, parent=self)
+        self.async_japc.sig_failed.connect(self.sig_get_failed)
+        self._sig_settings_read.connect(self._settings_read)
+
+    def fetch_settings(self, fields: Optional[List[str]] = None) -> Future:
+        """
+        GETs the whole Settings property in the background, in a single round trip.
+        The result is emitted with the ``sig_settings_received`` signal.
+        :param fields: the names of the fields to return. If None, all the fields of the property are returned.
+        :return: a Future that will hold the dictionary mapping the field names to their values.
+            It completes on the model's thread, after the slots connected to ``sig_settings_received`` ran.
+        """
+        future = Future()
+
+        def settings_received(settings_future: Future) -> None:
+            # Runs on the worker thread
+            if settings_future.cancelled():
+                settings = CancelledError()
+            elif settings_future.exception() is not None:
+                settings = settings_future.exception()
+            else:
+                settings = settings_future.result()
+                if fields is not None:
+                    settings = {field: settings[field] for field in fields}
+            self._sig_settings_read.emit(future, settings)
+
+        self.async_japc.get("TEST_DEVICE/Settings").add_done_callback(settings_received)
+        return future
+
+    @pyqtSlot(object, object)
+    def _settings_read(self, future: Future, settings: Union[dict, BaseException]) -> None:
+        """
+        Emits the settings read by ``fetch_settings``, then completes its future, on the model's thread:
+        whoever waits on the future finds the slots of ``sig_settings_received`` already executed.
+        :param future: the future returned by ``fetch_settings``
+        :param settings: the settings read, or the exception raised while reading them
+        :return: None
+        """
+        # Nothing to do if the caller cancelled the returned future in the meantime
+        if not future.set_running_or_notify_cancel():
+            return
+        if isinstance(settings, BaseException):
+            future.set_exception(settings)
+            return
+        self.sig_settings_received.emit(settings)
+        future.set_result(settings)
+
+    def close(self) -> None:
+        """
+        Waits for the pending GETs, then gives the PyJAPC connector back to the shared pool.
+        :returns: None
+        """
+        if self.japc is not None:
+            self.async_japc.wait_for_done()
+        super().close()
+
+
+class JapcSource(UpdateSource):
+    """
+        Base class for the plot sources that receive their values through the shared ``SubscriptionHub``,
+        so that sources listening to the same parameter share a single JAPC subscription.
+
+        Sources can be paused, for example while their plot is hidden, and resumed later: while paused
+        they don't receive any value, and the JAPC subscription is removed if no other source uses it.
+        Subclasses must call ``resume()`` at the end of their ``__init__`` to start receiving values.
+
+        Sources given a ``CaptureSink`` also store every point they emit in a capture file,
+        so that the whole acquisition can be looked at later, not only the part shown by the plot.
+    """
+    def __init__(self, parameter_name, selector, callback: Callable, sink: Optional[CaptureSink] = None):
+        """
+        :param parameter_name: The JAPC parameter to take data from
+        :param selector: The JAPC selector to use
+        :param callback: The function called as ``callback(name, value, header)`` for every new value
+        :param sink: Where to store the points emitted, if anywhere
+        """
+        super().__init__()
+        self.parameter_name = parameter_name
+        self.selector = selector
+        self.sink = sink
+        # Name of the source in the statistics (see instrumentation.py)
+        self.stats_name = "{} ({})".format(parameter_name, type(self).__name__)
+        self.paused = True
+        self._callback = callback
+
+    def pause(self) -> None:
+        """ Stops receiving updates. The JAPC subscription is removed if no other source uses it. """
+        if not self.paused:
+            subscription_hub.unsubscribe(self.parameter_name, self.selector, self._callback)
+            self.paused = True
 
+    def resume(self) -> None:
+        """ Starts receiving updates again, subscribing to JAPC if needed. """
+        if self.paused:
+            subscription_hub.subscribe(self.parameter_name, self.selector, self._callback)
+            self.paused = False
 
-class DeviceTimingSource(UpdateSource):
+    def close(self) -> None:
+        """ Stops receiving updates for good. """
+        self.pause()
+
+
+class DeviceTimingSource(JapcSource):
     """
         This class acts as a Timing model for a plot.
 
@@ -109,35 +275,33 @@ class DeviceTimingSource(UpdateSource):
     """
     def __init__(self, parameter_name, selector):
         """
-        Instantiate the object, creates its own PyJAPC connector and subscribes to the requested value.
+        Instantiate the object and subscribes to the requested value through the shared ``SubscriptionHub``,
+        so that sources listening to the same parameter share a single JAPC subscription.
         :param parameter_name:
         :param selector:
         """
-        super().__init__()
-        # Create the PyJAPC connector
-        self.japc = pyjapc.PyJapc()
-        # Use the given selector
-        self.japc.setSelector(timingSelector=selector)
+        super().__init__(parameter_name, selector, self._new_value_received)
         # Subscribe to the requested Device/Property#field
-        self.japc.subscribeParam(parameter_name, self._new_value_received)
-        # Start receiving data
-        self.japc.startSubscriptions()
+        self.resume()
 
-    def _new_value_received(self, name: str, value: int) -> None:
+    def _new_value_received(self, name: str, value: int, header: dict) -> None:
         """
         Function called every time PyJAPC receives a new value.
         It emits the signal ``sig_new_timestamp``, that carries a timestamp.
         :param name: Always equal to parameter_name - uninteresting, it never changes in this case.
         :param value: The new value received - uninteresting, because we need to emit only its timestamp.
+        :param header: The header of the value, carrying its acquisition stamp.
         :return: None.
         """
-        # Emit a signal containing the timestamp of the execution time of this function
-        self.sig_new_timestamp.emit(datetime.now().timestamp())
-        # NOTE: any timestamp can be emitted here: if the JAPC value carries a more meaningful timestamp,
-        #   you can extract it and emit it instead.
+        received = source_statistics.callback(self.stats_name)
+        # Emit a signal containing the time the device acquired the value, so that the plot stays correct
+        # even when callbacks are delayed. If the device provides no stamp, the reception time is used.
+        timestamp = acquisition_stamp(header)
+        source_statistics.emitted(self.stats_name, received)
+        self.sig_new_timestamp.emit(timestamp)
 
 
-class SinglePointSource(UpdateSource):
+class SinglePointSource(JapcSource):
     """
         This class acts as a Data model for a plot.
 
@@ -148,31 +312,213 @@ class SinglePointSource(UpdateSource):
         In this specific case, the ``sig_new_data`` signal can be understood by accwidgets' ``PlotWidget`` classes.
         Always check the documentation to make sure which signal names are understood by which target classes.
     """
-    def __init__(self, parameter_name, selector):
-        super().__init__()
-        # Create the PyJAPC connector
-        self.japc = pyjapc.PyJapc()
-        # Use the given selector
-        self.japc.setSelector(timingSelector=selector)
-        # Subscribe to the requested Device/Property#field
-        self.japc.subscribeParam(parameter_name, self._create_new_value)
-        # Start receiving data
-        self.japc.startSubscriptions()
+    def __init__(self, parameter_name, selector, sink: Optional[CaptureSink] = None):
+        super().__init__(parameter_name, selector, self._create_new_value, sink)
+        # Subscribe to the requested Device/Property#field through the shared hub
+        self.resume()
 
-    def _create_new_value(self, name: str, value: float) -> None:
+    def _create_new_value(self, name: str, value: float, header: dict) -> None:
         """
         Function called every time PyJAPC receives a new value.
         It emits the signal ``sig_new_data``, that carries a ``PointData`` instance.
 
-        The ``PointData`` instance contains the new value as Y coordinate and the timestamp of reception
+        The ``PointData`` instance contains the new value as Y coordinate and its acquisition stamp
         as the X coordinate.  It will be added to the plot as part of a curve.
 
         :param name: Always equal to parameter_name - uninteresting, it never changes in this case.
         :param value: The new value received, to be emitted as the Y coordinate of the output ``PointData``
+        :param header: The header of the value, carrying its acquisition stamp.
         :return: None
         """
+        received = source_statistics.callback(self.stats_name)
         new_data = PointData(
-            x=datetime.now().timestamp(),
+            x=acquisition_stamp(header),
             y=float(value/10)
         )
-        self.sig_new_data[PointData].emit(new_data)
\ No newline at end of file
+        if self.sink is not None:
+            self.sink.append(self.parameter_name, new_data.x, new_data.y)
+        source_statistics.emitted(self.stats_name, received)
+        self.sig_new_data[PointData].emit(new_data)
+
+
+class BatchedPointSource(JapcSource):
+    """
+        This class acts as a Data model for a plot receiving data at a high rate.
+
+        Like ``SinglePointSource``, it subscribes to JAPC, but instead of emitting one ``PointData`` per update
+        it collects the values in NumPy arrays, and emits them all together as a ``CurveData`` instance.
+        This way the plot receives one signal per frame instead of one signal per value.
+
+        The values are emitted every ``flush_interval`` milliseconds, or as soon as ``batch_size`` values
+        are collected, whichever comes first.
+
+        The newest ``capacity`` values are kept in a ``CurveRingBuffer``, so memory usage stays constant
+        however long the source runs, and receiving a value allocates no memory. Each batch is copied out
+        of the buffer when emitted: the ``CurveData`` may be delivered after the buffer has overwritten
+        the values, and the plot keeps its own copy of them anyway.
+    """
+    def __init__(self, parameter_name, selector, batch_size: int = 256, flush_interval: int = 16,
+                 capacity: int = 65536, sink: Optional[CaptureSink] = None, buffer: Optional[CurveRingBuffer] = None):
+        """
+        :param parameter_name: The JAPC parameter to take data from
+        :param selector: The JAPC selector to use
+        :param batch_size: The maximum number of values emitted in a single ``CurveData``
+        :param flush_interval: How often (in milliseconds) the collected values are emitted. The default
+            (16 ms) flushes about once per frame on a 60 Hz display.
+        :param capacity: How many values are kept in memory. Must not be smaller than ``batch_size``.
+        :param sink: Where to store all the values, including the ones that don't fit in memory anymore
+        :param buffer: Where to keep the values in memory, if not in a new buffer. ``capacity`` is then ignored.
+        """
+        super().__init__(parameter_name, selector, self._create_new_value, sink)
+        # Preallocate the storage, so that no memory is allocated when a new value is received
+        self.buffer = buffer if buffer is not None else CurveRingBuffer(capacity)
+        if self.buffer.capacity < batch_size:
+            raise ValueError("The capacity ({}) can't be smaller than the batch size ({})".format(
+                self.buffer.capacity, batch_size))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # How many of the newest values in the buffer were not emitted yet
+        self._count = 0
+        # When the oldest of them was received, if measured (see instrumentation.py)
+        self._received: Optional[float] = None
+        # JAPC callbacks and the flush timer run on different threads
+        self._lock = Lock()
+        # Emit the collected values at regular intervals
+        self._flush_timer = QTimer(self)
+        self._flush_timer.timeout.connect(self.flush)
+        # Subscribe to the requested Device/Property#field through the shared hub
+        self.resume()
+
+    def pause(self) -> None:
+        """ Stops receiving updates and emits the values still waiting in the batch. """
+        super().pause()
+        self._flush_timer.stop()
+        self.flush()
+
+    def resume(self) -> None:
+        """ Starts receiving and emitting updates again. """
+        super().resume()
+        self._flush_timer.start(self.flush_interval)
+
+    def _create_new_value(self, name: str, value: float, header: dict) -> None:
+        """
+        Function called every time PyJAPC receives a new value.
+        It stores the new value and its acquisition stamp in the batch, and emits the batch if full.
+        :param name: Always equal to parameter_name - uninteresting, it never changes in this case.
+        :param value: The new value received, to be used as the Y coordinate of the point
+        :param header: The header of the value, carrying its acquisition stamp.
+        :return: None
+        """
+        received = source_statistics.callback(self.stats_name)
+        with self._lock:
+            self.buffer.append(acquisition_stamp(header), value / 10)
+            if self._count == 0:
+                self._received = received
+            self._count += 1
+            if self._count == self.batch_size:
+                self._emit_batch()
+
+    @pyqtSlot()
+    def flush(self) -> None:
+        """
+        Emits the signal ``sig_new_data`` with a ``CurveData`` instance holding all the values collected
+        since the last flush. Does nothing if no value was collected.
+        :return: None
+        """
+        with self._lock:
+            self._emit_batch()
+
+    def _emit_batch(self) -> None:
+        """ Emits the collected values and empties the batch. Call it holding the lock, to keep the order. """
+        if self._count == 0:
+            return
+        x, y = self.buffer.last(self._count)
+        # Copy the values out: the signal may be delivered after the buffer has overwritten them
+        x, y = x.copy(), y.copy()
+        source_statistics.emitted(self.stats_name, self._received, self._count)
+        self._count = 0
+        if self.sink is not None:
+            self.sink.extend(self.parameter_name, x, y)
+        self._send(x, y)
+
+    def _send(self, x: np.ndarray, y: np.ndarray) -> None:
+        """ Sends a batch of values to the plot. """
+        self.sig_new_data[CurveData].emit(CurveData(x=x, y=y))
+
+
+class DecimatedPointSource(BatchedPointSource):
+    """
+        This class acts as a Data model for a plot showing long time spans of data received at a high rate.
+
+        Like ``BatchedPointSource``, it collects the values and sends them once per frame, but instead of sending
+        all of them it sends only the lowest and the highest value received during the time covered by each pixel
+        of the plot. The plot then never draws more than two points per pixel, and peaks stay visible.
+
+        All the values are also summarized in a ``MinMaxPyramid``, that shares the source's buffer for the newest
+        values. Give the plot's view to ``set_view()`` whenever it changes: the resolution of the values sent
+        follows the zoom level. When the view goes further back in time than the oldest value ever sent,
+        for example to show the history of a pyramid filled before the source was created, the missing part
+        is sent from the pyramid, at the resolution of the view, even if it's hours long. Each time range
+        is sent once: the plot's data model keeps its values sorted by timestamp, so older values are
+        inserted before the ones it already has.
+    """
+    def __init__(self, parameter_name, selector, time_span: float = 10.0, pixel_width: int = 2000,
+                 pyramid: Optional[MinMaxPyramid] = None, **kwargs):
+        """
+        :param parameter_name: The JAPC parameter to take data from
+        :param selector: The JAPC selector to use
+        :param time_span: The time span shown by the plot, in seconds
+        :param pixel_width: The width of the plot, in pixels
+        :param pyramid: Where to keep all the values. By default, a ``MinMaxPyramid`` with default settings.
+            Its raw points are the source's buffer, so ``capacity`` and ``buffer`` can't be given.
+        :param kwargs: The other arguments of ``BatchedPointSource``
+        """
+        self.pyramid = pyramid if pyramid is not None else MinMaxPyramid()
+        self.bucket_width = time_span / pixel_width
+        # Values of the pixel being filled, sent once the pixel is complete
+        self._pending_x = np.zeros(0)
+        self._pending_y = np.zeros(0)
+        # Timestamp of the oldest value sent to the plot: it only moves back in time
+        self._sent_from: Optional[float] = None
+        super().__init__(parameter_name, selector, buffer=self.pyramid.raw, **kwargs)
+
+    def set_view(self, x_min: float, x_max: float, pixel_width: int) -> None:
+        """
+        Adapts the values sent to the plot to what it shows. Call it every time the view range or the size
+        of the plot change.
+        :param x_min: The timestamp at the left edge of the plot
+        :param x_max: The timestamp at the right edge of the plot
+        :param pixel_width: The width of the plot, in pixels
+        :return: None
+        """
+        if x_max <= x_min:
+            return
+        pixel_width = max(pixel_width, 1)
+        with self._lock:
+            self.bucket_width = (x_max - x_min) / pixel_width
+            if self._sent_from is None or x_min >= self._sent_from:
+                return
+            # The plot shows a time range it never received: send it from the pyramid, two points per pixel
+            pixels = max(int(pixel_width * (self._sent_from - x_min) / (x_max - x_min)), 1)
+            x, y = self.pyramid.query(x_min, self._sent_from, 2 * pixels)
+            older = x < self._sent_from
+            x, y = x[older], y[older]
+            self._sent_from = x_min
+        if len(x) > 0:
+            self.sig_new_data[CurveData].emit(CurveData(x=x, y=y))
+
+    def _send(self, x: np.ndarray, y: np.ndarray) -> None:
+        """ Summarizes the values in the pyramid, and sends the extremes of the completed pixels to the plot. """
+        # The values are already in the pyramid's raw points: they are the source's buffer
+        self.pyramid.summarize(x, y)
+        x = np.concatenate((self._pending_x, x))
+        y = np.concatenate((self._pending_y, y))
+        # The values after the start of the newest pixel wait for the pixel to be complete
+        complete = np.searchsorted(x, np.floor(x[-1] / self.bucket_width) * self.bucket_width, side="left")
+        self._pending_x, self._pending_y = x[complete:], y[complete:]
+        if complete == 0:
+            return
+        x, y = decimate_by_time(x[:complete], y[:complete], self.bucket_width)
+        if self._sent_from is None and len(x) > 0:
+            self._sent_from = float(x[0])
+        self.sig_new_data[CurveData].emit(CurveData(x=x, y=y))
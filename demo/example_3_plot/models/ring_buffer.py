@@ -0,0 +1,99 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class CurveRingBuffer:
+    """
+    Fixed-capacity store for the (x, y) points of a curve, backed by preallocated NumPy arrays.
+
+    Once full, each new point overwrites the oldest one, so the memory used never grows,
+    and appending a point never allocates memory.
+
+    Every point is written twice, at index ``i`` and ``i + capacity`` of arrays twice as long as
+    the capacity: this way the stored points are always available as one contiguous slice,
+    and ``data()``, ``last()`` and ``window()`` can return views instead of copies.
+
+    NOTE: views are not frozen: they show new values once the points they refer to get overwritten.
+    Copy them if you need to keep them for longer than ``capacity`` appends.
+    """
+    def __init__(self, capacity: int):
+        """
+        :param capacity: How many points the buffer can hold
+        """
+        if capacity <= 0:
+            raise ValueError("The capacity must be positive, got {}".format(capacity))
+        self.capacity = capacity
+        self._x = np.zeros(2 * capacity, dtype=float)
+        self._y = np.zeros(2 * capacity, dtype=float)
+        # Index of the slot the next point will be written in
+        self._end = 0
+        # How many points are stored
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, x: float, y: float) -> None:
+        """
+        Stores a new point, overwriting the oldest one if the buffer is full.
+        :param x: the X coordinate of the point
+        :param y: the Y coordinate of the point
+        :return: None
+        """
+        i = self._end
+        self._x[i] = self._x[i + self.capacity] = x
+        self._y[i] = self._y[i + self.capacity] = y
+        self._end = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def extend(self, x: np.ndarray, y: np.ndarray) -> None:
+        """
+        Stores many points at once. If they are more than the capacity, only the newest ones are kept.
+        :param x: the X coordinates of the points
+        :param y: the Y coordinates of the points
+        :return: None
+        """
+        x = np.asarray(x, dtype=float)[-self.capacity:]
+        y = np.asarray(y, dtype=float)[-self.capacity:]
+        count = len(x)
+        # Slots to write, possibly wrapping around the end of the first half
+        slots = (self._end + np.arange(count)) % self.capacity
+        self._x[slots] = self._x[slots + self.capacity] = x
+        self._y[slots] = self._y[slots + self.capacity] = y
+        self._end = (self._end + count) % self.capacity
+        self._size = min(self._size + count, self.capacity)
+
+    def clear(self) -> None:
+        """ Forgets all the stored points. """
+        self._end = 0
+        self._size = 0
+
+    def data(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: views on the X and Y coordinates of all the stored points, from the oldest to the newest
+        """
+        start = (self._end - self._size) % self.capacity
+        return self._x[start:start + self._size], self._y[start:start + self._size]
+
+    def last(self, count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param count: how many points to return
+        :return: views on the X and Y coordinates of the newest ``count`` points, from the oldest to the newest
+        """
+        x, y = self.data()
+        count = min(count, self._size)
+        return x[self._size - count:], y[self._size - count:]
+
+    def window(self, x_min: float, x_max: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the points whose X coordinate falls in the given range. X coordinates must be increasing,
+        as it happens for timestamps.
+        :param x_min: the lower bound of the range (included)
+        :param x_max: the upper bound of the range (included). If None, the range has no upper bound.
+        :return: views on the X and Y coordinates of the points in the range
+        """
+        x, y = self.data()
+        first = np.searchsorted(x, x_min, side="left")
+        last = np.searchsorted(x, x_max, side="right") if x_max is not None else self._size
+        return x[first:last], y[first:last]
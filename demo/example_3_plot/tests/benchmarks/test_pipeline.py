@@ -0,0 +1,133 @@
+"""
+Benchmarks of the data-source-to-plot pipeline of example 3.
+
+They need pytest-benchmark (``pip install .[benchmark]``), and are skipped without it. Run them with::
+
+    python -m pytest demo/example_3_plot/tests/benchmarks --benchmark-only --benchmark-autosave
+
+then compare a later run against the saved results with ``--benchmark-compare`` (add for example
+``--benchmark-compare-fail=mean:10%`` to fail on regressions). Set ``QT_QPA_PLATFORM=offscreen`` to run
+them without a display, as the CI does.
+
+Each benchmark feeds synthetic samples straight into the sources' JAPC callbacks, for a given number of curves
+and sampling rate, and lets the ``ScrollingPlotWidget`` repaint once per frame, as in the application.
+Besides the timing of pytest-benchmark, each result stores in its ``extra_info``:
+- ``samples_per_second``: samples (of all curves) processed per second of wall-clock time
+- ``cpu_per_sample_us``: CPU time per sample, in microseconds
+- ``memory_growth_kib_per_s``: memory allocated and not freed per second of data, in KiB
+- ``dropped_frames``: the share of frames that took longer than the frame interval
+"""
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+from PyQt5.QtWidgets import QApplication
+from accwidgets.graph import ScrollingPlotWidget, TimeSpan
+
+from demo.example_3_plot.models.models import DeviceTimingSource, SinglePointSource, DecimatedPointSource
+
+pytest.importorskip("pytest_benchmark")
+
+PARAMETER = "TEST_DEVICE/Acquisition#sin"
+SELECTOR = "LHC.USER.ALL"
+
+CURVES = [1, 10, 100]
+RATES = [10, 1000, 10000]
+# How often the plot is repainted, as in the application
+FRAME_RATE = 30
+# Upper bound to the samples fed in each round, so that the largest configurations stay quick.
+# The simulated time is shortened accordingly, but never below one frame.
+SAMPLES_PER_ROUND = 20000
+
+
+class Pipeline:
+    """ A plot fed by one timing source and ``curves`` data sources, all driven by hand. """
+    def __init__(self, qtbot, source_class, curves: int):
+        self.plot = ScrollingPlotWidget()
+        qtbot.addWidget(self.plot)
+        self.plot.time_span = TimeSpan(10.0, 0.0)
+        # Sources are closed right away: the benchmark calls their callbacks instead of JAPC
+        self.timing_source = DeviceTimingSource(PARAMETER, SELECTOR)
+        self.timing_source.close()
+        self.plot.timing_source = self.timing_source
+        self.sources = []
+        for _ in range(curves):
+            source = source_class(PARAMETER, SELECTOR)
+            source.close()
+            self.plot.addCurve(data_source=source)
+            self.sources.append(source)
+        self.plot.show()
+        self.stamp = time.time()
+
+    def drive(self, rate: int, duration: float) -> dict:
+        """
+        Feeds ``duration`` seconds of data at ``rate`` Hz to every curve, repainting once per frame.
+        :return: the number of samples fed and of frames drawn, and how many frames were late
+        """
+        app = QApplication.instance()
+        frame_interval = 1 / FRAME_RATE
+        frames = max(int(round(duration * FRAME_RATE)), 1)
+        samples = dropped = 0
+        owed = 0.0
+        for _ in range(frames):
+            started = time.perf_counter()
+            owed += rate * frame_interval
+            count, owed = int(owed), owed - int(owed)
+            for value in np.sin(np.arange(samples, samples + count)):
+                self.stamp += 1 / rate
+                header = {"acqStamp": self.stamp}
+                self.timing_source._new_value_received(PARAMETER, value, header)
+                for source in self.sources:
+                    source._create_new_value(PARAMETER, value, header)
+            samples += count
+            for source in self.sources:
+                if hasattr(source, "flush"):
+                    source.flush()
+            app.processEvents()
+            self.plot.viewport().repaint()
+            if time.perf_counter() - started > frame_interval:
+                dropped += 1
+        return {"samples": samples * len(self.sources), "frames": frames, "dropped": dropped}
+
+
+def _duration(curves: int, rate: int) -> float:
+    return max(min(1.0, SAMPLES_PER_ROUND / (curves * rate)), 1 / FRAME_RATE)
+
+
+@pytest.mark.parametrize("source_class", [SinglePointSource, DecimatedPointSource])
+@pytest.mark.parametrize("rate", RATES)
+@pytest.mark.parametrize("curves", CURVES)
+def test_pipeline_throughput(benchmark, qtbot, source_class, curves, rate):
+    """ Measures how fast ``curves`` curves fed at ``rate`` Hz reach the plot. """
+    pipeline = Pipeline(qtbot, source_class, curves)
+    duration = _duration(curves, rate)
+
+    # Memory growth, measured apart: tracing allocations slows everything down
+    tracemalloc.start()
+    pipeline.drive(rate, duration)
+    first = tracemalloc.get_traced_memory()[0]
+    pipeline.drive(rate, duration)
+    growth = tracemalloc.get_traced_memory()[0] - first
+    tracemalloc.stop()
+
+    results = []
+
+    def run():
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = pipeline.drive(rate, duration)
+        result["wall"], result["cpu"] = time.perf_counter() - wall, time.process_time() - cpu
+        results.append(result)
+
+    benchmark.pedantic(run, rounds=3, iterations=1, warmup_rounds=1)
+
+    samples = sum(result["samples"] for result in results)
+    benchmark.extra_info.update({
+        "curves": curves,
+        "rate_hz": rate,
+        "simulated_seconds": duration,
+        "samples_per_second": samples / sum(result["wall"] for result in results),
+        "cpu_per_sample_us": sum(result["cpu"] for result in results) / samples * 1e6,
+        "memory_growth_kib_per_s": growth / 1024 / duration,
+        "dropped_frames": sum(result["dropped"] for result in results) / sum(result["frames"] for result in results),
+    })
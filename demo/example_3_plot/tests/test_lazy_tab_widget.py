@@ -0,0 +1,63 @@
+from unittest import mock
+
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QLabel, QWidget
+
+from demo.lazy_tab_widget import LazyTabWidget
+
+
+class _Content(QWidget):
+    """ Tab content recording when it's paused and resumed. """
+    def __init__(self):
+        super(_Content, self).__init__()
+        self.pause_updates = mock.Mock()
+        self.resume_updates = mock.Mock()
+
+
+def _tabs(qtbot, *factories) -> LazyTabWidget:
+    tabs = LazyTabWidget()
+    qtbot.addWidget(tabs)
+    for index, factory in enumerate(factories):
+        tabs.addLazyTab(factory, QIcon(), "Tab {}".format(index))
+    return tabs
+
+
+def test_tab_content_is_created_once_when_first_shown(qtbot):
+    """ The content of a tab must be created only when the tab is selected for the first time. """
+    first, second = mock.Mock(side_effect=_Content), mock.Mock(side_effect=_Content)
+    tabs = _tabs(qtbot, first, second)
+    # Adding the first tab makes it current
+    assert first.call_count == 1 and second.call_count == 0
+    assert tabs.tabContent(1) is None
+
+    tabs.setCurrentIndex(1)
+    tabs.setCurrentIndex(0)
+    tabs.setCurrentIndex(1)
+    assert first.call_count == 1 and second.call_count == 1
+    assert isinstance(tabs.tabContent(1), _Content)
+
+
+def test_switching_tab_pauses_and_resumes_the_contents(qtbot):
+    """ The content of the tab being hidden must be paused, and the content of the tab being shown resumed. """
+    tabs = _tabs(qtbot, _Content, _Content)
+    tabs.setCurrentIndex(1)
+    first, second = tabs.tabContent(0), tabs.tabContent(1)
+    assert first.pause_updates.call_count == 1
+    # Newly created content is already running
+    assert second.resume_updates.call_count == 0
+
+    tabs.setCurrentIndex(0)
+    assert second.pause_updates.call_count == 1
+    assert first.resume_updates.call_count == 1
+
+
+def test_failing_tab_shows_the_error(qtbot):
+    """ A tab whose content can't be created must show the error, instead of raising it. """
+    def failing_factory():
+        raise ValueError("no device")
+
+    tabs = _tabs(qtbot, _Content, failing_factory)
+    tabs.setCurrentIndex(1)
+    content = tabs.tabContent(1)
+    assert isinstance(content, QLabel)
+    assert "no device" in content.text()
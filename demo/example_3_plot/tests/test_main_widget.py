@@ -1,7 +1,14 @@
+import time
+
 import PyQt5
-from PyQt5.QtWidgets import QPushButton, QSpinBox
-from accwidgets.graph import ScrollingPlotWidget
+import numpy as np
+from PyQt5.QtWidgets import QPushButton, QSpinBox, QWidget
+from accwidgets.graph import ScrollingPlotWidget, CurveData
+from demo.example_3_plot.models.models import BatchedPointSource
 from demo.example_3_plot.widgets.main_widget import MainWidget
+from demo.example_3_plot.widgets.render_governor import RenderGovernor
+from demo.japc_setup.japc_connections import connection_pool
+from demo.japc_setup.japc_subscriptions import subscription_hub
 
 
 def test_can_open_main_window(monkeypatch, mock_pyjapc, qtbot):
@@ -42,7 +49,7 @@ def test_spinbox_works(main_widget, mock_pyjapc, qtbot):
     # Does it set the right value on the right device?
     ampl_spinbox.clear()
     qtbot.keyClicks(ampl_spinbox, "50")
-    assert mock_pyjapc.getParam("TEST_DEVICE/Settings#amplitude_sin") == 50
+    qtbot.waitUntil(lambda: mock_pyjapc.getParam("TEST_DEVICE/Settings#amplitude_sin") == 50)
 
     # Does it contain a QSpinBox called 'period_sin'?
     per_spinbox = main_widget.findChild(QSpinBox, "period_sin")
@@ -51,4 +58,84 @@ def test_spinbox_works(main_widget, mock_pyjapc, qtbot):
     # Does it set the right value on the right device?
     per_spinbox.clear()
     qtbot.keyClicks(per_spinbox, "30")
-    assert mock_pyjapc.getParam("TEST_DEVICE/Settings#period_sin") == 30
+    qtbot.waitUntil(lambda: mock_pyjapc.getParam("TEST_DEVICE/Settings#period_sin") == 30)
+
+
+def test_sources_share_one_subscription(main_widget, mock_pyjapc, qtbot):
+    """ The timing source and the data source of the plot must share the same JAPC subscription. """
+    assert subscription_hub.consumer_count("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL") == 2
+
+
+def test_models_share_one_connector(main_widget, mock_pyjapc, qtbot):
+    """ The model and the plot sources use the same selector, so they must share one PyJAPC connector. """
+    assert connection_pool.connection_count() == 1
+
+
+def test_spinboxes_show_initial_settings(main_widget, mock_pyjapc, qtbot):
+    """ The spinboxes must be filled with the values read from the device. """
+    settings = main_widget.model.get_settings(["amplitude_sin", "period_sin"])
+    assert settings == {"amplitude_sin": mock_pyjapc.getParam("TEST_DEVICE/Settings#amplitude_sin"),
+                        "period_sin": mock_pyjapc.getParam("TEST_DEVICE/Settings#period_sin")}
+    qtbot.waitUntil(lambda: main_widget.findChild(QSpinBox, "amplitude_sin").value() == settings["amplitude_sin"])
+    assert main_widget.findChild(QSpinBox, "period_sin").value() == settings["period_sin"]
+
+
+def test_spinbox_edits_are_coalesced(main_widget, mock_pyjapc, qtbot, monkeypatch):
+    """ Typing a number digit by digit must result in a single SET of the last value. """
+    sets = []
+    japc = main_widget.model.japc
+    set_param = japc.setParam
+    monkeypatch.setattr(japc, "setParam", lambda name, value: sets.append((name, value)) or set_param(name, value))
+
+    ampl_spinbox = main_widget.findChild(QSpinBox, "amplitude_sin")
+    ampl_spinbox.clear()
+    qtbot.keyClicks(ampl_spinbox, "42")
+    qtbot.waitUntil(lambda: mock_pyjapc.getParam("TEST_DEVICE/Settings#amplitude_sin") == 42)
+    assert sets == [("TEST_DEVICE/Settings", {"amplitude_sin": 42})]
+
+
+def test_paused_widget_releases_subscription(main_widget, mock_pyjapc, qtbot):
+    """ A paused widget (for example in a hidden tab) must not keep its JAPC subscriptions. """
+    main_widget.pause_updates()
+    assert subscription_hub.consumer_count("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL") == 0
+    main_widget.resume_updates()
+    assert subscription_hub.consumer_count("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL") == 2
+
+
+def test_render_governor_merges_updates_into_one_frame(main_widget, qtbot):
+    """ Updates received between two frames must reach the plot together, as a single CurveData. """
+    governor = main_widget.render_governor
+    governor.pause()
+    source = BatchedPointSource("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL", flush_interval=60000)
+    source.close()
+    governed = governor.govern(source)
+    source.sig_new_data[CurveData].emit(CurveData(x=np.array([1.0, 2.0]), y=np.array([10.0, 20.0])))
+    source.sig_new_data[CurveData].emit(CurveData(x=np.array([3.0]), y=np.array([30.0])))
+
+    with qtbot.waitSignal(governed.sig_new_data[CurveData]) as blocker:
+        governor.render()
+    assert np.array_equal(blocker.args[0].x, [1.0, 2.0, 3.0])
+
+
+class _SlowPaintWidget(QWidget):
+    """ A widget taking 20 ms to paint, like a heavy plot. """
+    def paintEvent(self, event) -> None:
+        time.sleep(0.02)
+
+
+def test_render_governor_counts_the_painting_time(qtbot):
+    """ The frame time must include painting the plot, not only sending it the data. """
+    widget = _SlowPaintWidget()
+    qtbot.addWidget(widget)
+    widget.show()
+    qtbot.waitExposed(widget)
+    governor = RenderGovernor(max_fps=30)
+    governor.pause()
+    source = BatchedPointSource("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL", flush_interval=60000)
+    source.close()
+    governor.govern(source, widget)
+    source.sig_new_data[CurveData].emit(CurveData(x=np.array([1.0]), y=np.array([10.0])))
+
+    governor.render()
+    # The frame time is smoothed: the first frame counts for a fifth
+    assert governor.frame_time >= 0.2 * 0.02
@@ -0,0 +1,363 @@
+import time
+from typing import Tuple
+
+import numpy as np
+from accwidgets.graph import CurveData
+
+from demo.example_3_plot.models.models import BatchedPointSource, DecimatedPointSource
+from demo.example_3_plot.models.ring_buffer import CurveRingBuffer
+from demo.example_3_plot.models.capture import CaptureSink
+from demo.example_3_plot.models.decimation import MinMaxPyramid
+from demo.example_3_plot.models.instrumentation import source_statistics
+from demo.japc_setup.japc_recording import Recording, ReplayPyJapc, SubscriptionRecorder, replay_factory
+from demo.japc_setup.japc_subscriptions import acquisition_stamp, subscription_hub
+from demo.papc_setup import papc_devices
+from demo.papc_setup.papc_catalogue import DeviceCatalogue, setup_papc_catalogue
+from demo.papc_setup.papc_utils import CATCH_UP_MISSED_TICKS, SKIP_MISSED_TICKS, ScheduledTimer, TimerStatistics
+
+
+def test_batched_source_emits_values_together(mock_pyjapc, qtbot):
+    """ The values received between two flushes must be emitted in a single CurveData. """
+    source = BatchedPointSource("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL", flush_interval=60000)
+    source.close()
+    for stamp, value in enumerate((10.0, 20.0, 30.0)):
+        source._create_new_value("TEST_DEVICE/Acquisition#sin", value, {"acqStamp": 1000.0 + stamp})
+
+    with qtbot.waitSignal(source.sig_new_data[CurveData]) as blocker:
+        source.flush()
+    assert np.array_equal(blocker.args[0].x, [1000.0, 1001.0, 1002.0])
+    assert np.array_equal(blocker.args[0].y, [1.0, 2.0, 3.0])
+
+
+def test_batched_source_flushes_when_full(mock_pyjapc, qtbot):
+    """ A full batch must be emitted without waiting for the flush interval. """
+    source = BatchedPointSource("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL", batch_size=2, flush_interval=60000)
+    source.close()
+    with qtbot.waitSignal(source.sig_new_data[CurveData]) as blocker:
+        source._create_new_value("TEST_DEVICE/Acquisition#sin", 10.0, {})
+        source._create_new_value("TEST_DEVICE/Acquisition#sin", 20.0, {})
+    assert len(blocker.args[0].y) == 2
+
+
+def test_ring_buffer_keeps_newest_points():
+    """ Once full, the ring buffer must drop the oldest points and keep them contiguous. """
+    buffer = CurveRingBuffer(capacity=4)
+    for i in range(6):
+        buffer.append(float(i), float(i * 10))
+    x, y = buffer.data()
+    assert np.array_equal(x, [2.0, 3.0, 4.0, 5.0])
+    assert np.array_equal(y, [20.0, 30.0, 40.0, 50.0])
+    # Views, not copies
+    assert x.base is not None
+
+    x, y = buffer.window(3.0, 4.0)
+    assert np.array_equal(x, [3.0, 4.0])
+
+    buffer.extend(np.arange(6.0, 13.0), np.arange(60.0, 130.0, 10.0))
+    assert np.array_equal(buffer.data()[0], [9.0, 10.0, 11.0, 12.0])
+
+
+def test_acquisition_stamp_falls_back_to_current_time():
+    """ Values without an acquisition stamp must be timestamped with the current time. """
+    assert acquisition_stamp({"acqStamp": 1234.5}) == 1234.5
+    before = time.time()
+    assert before - 1 < acquisition_stamp({}) < before + 1
+
+
+def test_failing_consumer_does_not_block_the_others(mock_pyjapc, qtbot, tick_devices):
+    """ A consumer raising an exception must not prevent the next ones from receiving the update. """
+    def failing_consumer(name, value, header):
+        raise RuntimeError("Consumer failure")
+
+    received = []
+    subscription_hub.subscribe("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL", failing_consumer)
+    subscription_hub.subscribe("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL",
+                               lambda name, value, header: received.append(value))
+    tick_devices()
+    qtbot.waitUntil(lambda: len(received) > 0)
+
+
+def test_papc_devices_are_reset_by_setup(mock_pyjapc):
+    """ Setting up the devices again must bring their settings back to the initial values. """
+    mock_pyjapc.setParam("TEST_DEVICE/Settings#amplitude_sin", 10)
+    assert mock_pyjapc.getParam("TEST_DEVICE/Settings#amplitude_sin") == 10
+
+    japc = papc_devices.setup_papc_devices()()
+    japc.setSelector("")
+    assert japc.getParam("TEST_DEVICE/Settings#amplitude_sin") == 50
+
+
+def test_devices_tick_only_when_stepped(mock_pyjapc, tick_devices):
+    """ In the tests, the simulated time must advance only when the devices are ticked. """
+    mock_pyjapc.setSelector(timingSelector="LHC.USER.ALL")
+    theta = mock_pyjapc.getParam("TEST_DEVICE/Settings#theta")
+    tick_devices(0)
+    assert mock_pyjapc.getParam("TEST_DEVICE/Settings#theta") == theta
+
+    tick_devices()
+    assert mock_pyjapc.getParam("TEST_DEVICE/Settings#theta") > theta
+
+
+def _run_missed_ticks(tick_devices, missed_ticks: str) -> Tuple[int, dict]:
+    """ Ticks a 20 ms timer once after 5 missed deadlines, and returns its number of calls and its statistics. """
+    calls = []
+    timer = ScheduledTimer(0.02, lambda: calls.append(None), missed_ticks=missed_ticks)
+    try:
+        tick_devices(1, interval=0.02, missed=5)
+    finally:
+        timer.stop()
+    return len(calls), timer.statistics.snapshot()
+
+
+def test_timer_skips_missed_ticks(tick_devices):
+    """ Ticks missed during a slow callback must be dropped and counted as skipped. """
+    calls, statistics = _run_missed_ticks(tick_devices, SKIP_MISSED_TICKS)
+    assert calls == 1
+    assert statistics["ticks"] == 1 and statistics["skipped"] == 5
+    assert statistics["max_lateness"] >= 5 * 0.02
+
+
+def test_timer_catches_up_missed_ticks(tick_devices):
+    """ Ticks missed during a slow callback must run late, back-to-back, and none must be skipped. """
+    calls, statistics = _run_missed_ticks(tick_devices, CATCH_UP_MISSED_TICKS)
+    assert calls == 6
+    assert statistics["ticks"] == 6 and statistics["skipped"] == 0
+    assert statistics["max_lateness"] >= 5 * 0.02
+
+
+def test_timer_statistics_histogram():
+    """ Durations must be counted in the first bucket whose upper bound they don't exceed. """
+    statistics = TimerStatistics(interval=0.01)
+    statistics.record(lateness=0.001, duration=0.0015)
+    statistics.record(lateness=-0.001, duration=0.02, skipped=2)
+    snapshot = statistics.snapshot()
+    assert snapshot["ticks"] == 2 and snapshot["overruns"] == 1 and snapshot["skipped"] == 2
+    assert snapshot["duration_histogram"][0.002] == 1 and snapshot["duration_histogram"][0.02] == 1
+    assert snapshot["max_lateness"] == 0.001
+
+
+def test_catalogue_creates_devices_when_used(tmp_path):
+    """ Devices of a catalogue must be created only when a connector uses them. """
+    catalogue_file = tmp_path / "devices.csv"
+    catalogue_file.write_text("device,property,kind,field,type,initial_value,equation,frequency,selector\n"
+                              "DEVICE_A,Settings,setting,gain,float,2.0,,,\n"
+                              "DEVICE_B,Settings,setting,gain,float,3.0,,,\n")
+    catalogue = DeviceCatalogue.from_file(str(catalogue_file))
+    japc = catalogue.pyjapc_factory()()
+    japc.setSelector("")
+    assert catalogue.created_devices() == []
+
+    assert japc.getParam("DEVICE_B/Settings#gain") == 3.0
+    assert [device.name for device in catalogue.created_devices()] == ["DEVICE_B"]
+    catalogue.stop()
+
+
+def test_catalogue_rebuild_creates_new_devices(tmp_path):
+    """ Rebuilding a catalogue must create its devices again, from the file. """
+    catalogue_file = tmp_path / "devices.csv"
+    catalogue_file.write_text("device,property,kind,field,type,initial_value,equation,frequency,selector\n"
+                              "DEVICE_A,Settings,setting,gain,float,2.0,,,\n")
+    japc = setup_papc_catalogue(str(catalogue_file))()
+    japc.setSelector("")
+    japc.setParam("DEVICE_A/Settings#gain", 5.0)
+
+    japc = setup_papc_catalogue(str(catalogue_file), rebuild=True)()
+    japc.setSelector("")
+    assert japc.getParam("DEVICE_A/Settings#gain") == 2.0
+
+
+def test_recorded_subscription_is_replayed(mock_pyjapc, qtbot, tmp_path, tick_devices):
+    """ A recording must replay the same values, in the same order. """
+    recorder = SubscriptionRecorder()
+    recorder.record("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL")
+    tick_devices(5)
+    qtbot.waitUntil(lambda: len(recorder) >= 5)
+    recorder.stop()
+    recording = recorder.to_recording()
+    recording.save(str(tmp_path / "recording.npz"))
+
+    japc = replay_factory(str(tmp_path / "recording.npz"), speed=None)()
+    japc.setSelector(timingSelector="LHC.USER.ALL")
+    replayed = []
+    japc.subscribeParam("TEST_DEVICE/Acquisition#sin", lambda name, value: replayed.append(value))
+    japc.startSubscriptions()
+    assert japc.wait_for_done(timeout=5000)
+    assert replayed == [recording.sample(i)[3] for i in range(len(recording))]
+
+    # Starting again replays the whole recording again
+    replayed.clear()
+    japc.startSubscriptions()
+    assert japc.wait_for_done(timeout=5000)
+    assert len(replayed) == len(recording)
+
+
+def test_replayed_stamps_follow_the_speed():
+    """ With live stamps, samples replayed 10 times faster must be stamped 10 times closer to each other. """
+    recording = Recording(["DEVICE/Acquisition#value"], ["LHC.USER.ALL"], stamps=[100.0, 101.0, 102.0],
+                          parameter_ids=[0, 0, 0], selector_ids=[0, 0, 0], shapes=[(-1, -1)] * 3,
+                          values=[1.0, 2.0, 3.0])
+    japc = ReplayPyJapc(recording, speed=10)
+    japc.setSelector(timingSelector="LHC.USER.ALL")
+    stamps = []
+    japc.subscribeParam("DEVICE/Acquisition#value", lambda name, value, header: stamps.append(header["acqStamp"]),
+                        getHeader=True, unixtime=True)
+    started = time.time()
+    japc.startSubscriptions()
+    assert japc.wait_for_done(timeout=5000)
+    assert np.allclose(np.diff(stamps), 0.1)
+    assert abs(stamps[0] - started) < 0.05
+
+
+def test_replay_subscriptions_are_kept_per_selector():
+    """ Subscribing to a parameter with two selectors must replay each selector to its own callback. """
+    recording = Recording(["DEVICE/Acquisition#value"], ["SEL.A", "SEL.B"], stamps=[100.0, 101.0, 102.0],
+                          parameter_ids=[0, 0, 0], selector_ids=[0, 1, 0], shapes=[(-1, -1)] * 3,
+                          values=[1.0, 2.0, 3.0])
+    japc = ReplayPyJapc(recording, speed=None)
+    replayed = {"SEL.A": [], "SEL.B": []}
+    for selector, values in replayed.items():
+        japc.subscribeParam("DEVICE/Acquisition#value", lambda name, value, values=values: values.append(value),
+                            timingSelectorOverride=selector)
+    japc.startSubscriptions()
+    assert japc.wait_for_done(timeout=5000)
+    assert replayed == {"SEL.A": [1.0, 3.0], "SEL.B": [2.0]}
+
+
+def test_replay_callback_can_clear_the_subscriptions():
+    """ Clearing the subscriptions from a replayed callback must stop the playback, not raise. """
+    recording = Recording(["DEVICE/Acquisition#value"], [""], stamps=[100.0, 101.0, 102.0],
+                          parameter_ids=[0, 0, 0], selector_ids=[0, 0, 0], shapes=[(-1, -1)] * 3,
+                          values=[1.0, 2.0, 3.0])
+    japc = ReplayPyJapc(recording, speed=None)
+    replayed = []
+
+    def callback(name, value):
+        replayed.append(value)
+        japc.clearSubscriptions()
+
+    japc.subscribeParam("DEVICE/Acquisition#value", callback)
+    japc.startSubscriptions()
+    assert japc.wait_for_done(timeout=5000)
+    assert replayed == [1.0]
+
+
+def test_recorder_drops_updates_when_full():
+    """ The recorder must stop storing updates once it holds its maximum number of values. """
+    recorder = SubscriptionRecorder(max_values=5)
+    for stamp, value in enumerate((1.0, np.zeros(3), np.zeros(2), np.zeros(2))):
+        recorder._add("DEVICE/Acquisition#value", "", value, {"acqStamp": 100.0 + stamp})
+    assert len(recorder) == 2 and recorder.dropped == 2
+    assert len(recorder.to_recording().values) == 4
+
+
+def test_batched_source_writes_to_sink(mock_pyjapc, qtbot, tmp_path):
+    """ Values emitted by a source with a sink must be readable by time range from the capture file. """
+    sink = CaptureSink(str(tmp_path), chunk_records=2)
+    source = BatchedPointSource("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL", flush_interval=60000, sink=sink)
+    source.close()
+    for stamp, value in enumerate((10.0, 20.0, 30.0, 40.0)):
+        source._create_new_value("TEST_DEVICE/Acquisition#sin", value, {"acqStamp": 1000.0 + stamp})
+    source.flush()
+
+    reader = sink.reader("TEST_DEVICE/Acquisition#sin")
+    assert reader.time_range() == (1000.0, 1003.0)
+    x, y = reader.slice(1001.0, 1002.0)
+    assert np.array_equal(x, [1001.0, 1002.0])
+    assert np.array_equal(y, [2.0, 3.0])
+    sink.close()
+
+
+def test_pyramid_keeps_peaks_with_few_points():
+    """ A long range must be returned with a bounded number of points, including its extremes. """
+    pyramid = MinMaxPyramid(capacity=1024, factor=4, levels=6)
+    x = np.arange(100000) * 0.001
+    y = np.sin(x)
+    y[12345], y[67890] = 50.0, -50.0
+    for start in range(0, len(x), 1000):
+        pyramid.extend(x[start:start + 1000], y[start:start + 1000])
+
+    view_x, view_y = pyramid.query(0.0, 100.0, 1000)
+    assert len(view_x) <= 1000
+    assert view_y.max() == 50.0 and view_y.min() == -50.0
+    assert np.all(np.diff(view_x) >= 0)
+
+
+def test_decimated_source_sends_two_points_per_pixel(mock_pyjapc, qtbot):
+    """ The plot must receive at most the lowest and highest value of each completed pixel. """
+    source = DecimatedPointSource("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL", time_span=1.0, pixel_width=10,
+                                  flush_interval=60000)
+    source.close()
+    for i, value in enumerate((10.0, 50.0, 30.0, 20.0, 40.0)):
+        source._create_new_value("TEST_DEVICE/Acquisition#sin", value, {"acqStamp": 1000.0 + i * 0.04})
+
+    with qtbot.waitSignal(source.sig_new_data[CurveData]) as blocker:
+        source.flush()
+    # Pixels are 0.1 s wide: the first one holds the first three values, the last one is not complete yet
+    assert np.array_equal(blocker.args[0].y, [1.0, 5.0])
+
+
+def test_pyramid_query_from_first_sample_keeps_resolution():
+    """ A range starting at the very first point must be returned at the finest resolution that fits. """
+    pyramid = MinMaxPyramid(capacity=1024, factor=4, levels=6)
+    x = np.arange(100000) * 0.001
+    y = np.cos(x)
+    for start in range(0, len(x), 1000):
+        pyramid.extend(x[start:start + 1000], y[start:start + 1000])
+
+    view_x, _ = pyramid.query(x[0], x[-1], 1000)
+    assert len(view_x) <= 1000
+    # Buckets of 1024 points: consecutive extremes are at most two buckets apart
+    assert np.diff(view_x).max() <= 2 * 1.024
+
+
+def test_decimated_source_sends_history_when_view_widens(mock_pyjapc, qtbot):
+    """ Widening the view before the values sent must send the history, two per pixel at most, and only once. """
+    pyramid = MinMaxPyramid()
+    # 100 s of history, received before the source was created
+    pyramid.extend(900.0 + np.arange(1000) * 0.1, np.arange(1000) - 1000.0)
+    source = DecimatedPointSource("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL", time_span=1.0, pixel_width=10,
+                                  flush_interval=60000, pyramid=pyramid)
+    source.close()
+    sent = []
+    source.sig_new_data[CurveData].connect(lambda data: sent.append(data))
+    for i in range(1000):
+        source._create_new_value("TEST_DEVICE/Acquisition#sin", float(i), {"acqStamp": 1000.0 + i * 0.01})
+    source.flush()
+    assert min(data.x.min() for data in sent) >= 1000.0
+    live = len(sent)
+
+    # Zoom out twice, scroll forward, then zoom out again
+    source.set_view(950.0, 1010.0, 10)
+    assert len(sent) == live + 1 and len(sent[-1].x) <= 18
+    assert sent[-1].x.min() >= 950.0 and sent[-1].x.max() < 1000.0
+    source.set_view(900.0, 1010.0, 10)
+    assert len(sent) == live + 2 and sent[-1].x.max() < 950.0
+    assert sent[-1].y.min() == -1000.0
+    source.set_view(1005.0, 1015.0, 10)
+    source.set_view(920.0, 1015.0, 10)
+    assert len(sent) == live + 2
+
+    stamps = np.concatenate([data.x for data in sent])
+    assert len(np.unique(stamps)) == len(stamps)
+
+
+def test_source_statistics_measure_callbacks(mock_pyjapc, qtbot):
+    """ When enabled, the statistics must count the callbacks and the values emitted and painted. """
+    source_statistics.enable()
+    source_statistics.reset()
+    try:
+        source = BatchedPointSource("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL", flush_interval=60000)
+        source.close()
+        for stamp in range(3):
+            source._create_new_value("TEST_DEVICE/Acquisition#sin", 10.0, {"acqStamp": 1000.0 + stamp})
+        [before_flush] = source_statistics.snapshot()
+        source.flush()
+        source_statistics.painted([source.stats_name])
+        [after_paint] = source_statistics.snapshot()
+    finally:
+        source_statistics.disable()
+        source_statistics.reset()
+
+    assert before_flush["callbacks"] == 3 and before_flush["backlog"] == 3
+    assert after_paint["backlog"] == 0
+    assert after_paint["callback_to_emit_max_ms"] >= 0
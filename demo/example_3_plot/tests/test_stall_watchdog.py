@@ -0,0 +1,34 @@
+import time
+import logging
+
+from demo import stall_watchdog
+from demo.stall_watchdog import StallWatchdog
+
+
+def _block_event_loop(duration: float) -> None:
+    """ Keeps the GUI thread busy, like a slow synchronous call would. """
+    time.sleep(duration)
+
+
+def test_watchdog_logs_the_blocking_stack(qtbot, caplog):
+    """ Blocking the event loop must be reported once, with the stack of the blocking code, then its end. """
+    caplog.set_level(logging.WARNING)
+    watchdog = StallWatchdog(threshold=100)
+    try:
+        qtbot.wait(50)
+        _block_event_loop(0.4)
+        qtbot.waitUntil(lambda: "recovered" in caplog.text)
+    finally:
+        watchdog.stop()
+    assert watchdog.stall_count == 1
+    assert "_block_event_loop" in caplog.text
+
+
+def test_watchdog_ignores_invalid_threshold(qtbot, caplog):
+    """ An invalid threshold on the command line must fall back to the default one, not crash. """
+    watchdog = stall_watchdog.start_if_requested(["run-example-3", "--watchdog=abc"])
+    try:
+        assert watchdog.threshold == 0.2
+        assert "Invalid --watchdog threshold" in caplog.text
+    finally:
+        watchdog.stop()
@@ -1,11 +1,18 @@
 from typing import Callable
+from functools import partial
 import logging
 
+from PyQt5.QtCore import pyqtSlot
+from PyQt5.QtGui import QGuiApplication
 from PyQt5.QtWidgets import QWidget, QSpinBox
 from accwidgets.graph import TimeSpan, ScrollingPlotWidget
 
 # Import the models
-from demo.example_3_plot.models.models import JapcModel, DeviceTimingSource, SinglePointSource
+from demo.example_3_plot.models.models import AsyncJapcModel, DeviceTimingSource, DecimatedPointSource
+from demo.example_3_plot.models.instrumentation import PaintProbe, source_statistics
+from demo.example_3_plot.widgets.render_governor import RenderGovernor
+from demo.example_3_plot.widgets.stats_widget import SourceStatsWidget
+from demo.startup_profiling import profiler
 
 # Import the code generated from the view.ui file
 from demo.example_3_plot.resources.generated.ui_view import Ui_Form
@@ -33,27 +40,84 @@ class MainWidget(QWidget, Ui_Form):
         super(MainWidget, self).__init__(parent)
 
         # Instantiate the view
-        self.setupUi(self)
+        with profiler.span("setupUi"):
+            self.setupUi(self)
 
         # Instantiate the model
-        self.model = JapcModel()
+        with profiler.span("Create the model"):
+            self.model = AsyncJapcModel()
+        # Report the GETs and SETs that could not be performed
+        self.model.sig_get_failed.connect(self._japc_call_failed)
+        self.model.writer.sig_set_failed.connect(self._japc_call_failed)
+        # Keep track of the plot sources, to close them together with the widget
+        self.sources = []
+        # Redraw the plots at a bounded frame rate, however fast the data arrives
+        self.render_governor = RenderGovernor(max_fps=30, parent=self)
 
         # Setup the plots
         scrolling_plot = self.findChild(ScrollingPlotWidget, "scrolling_plot")
-        self._setup_plot(plot_widget=scrolling_plot, parameter="TEST_DEVICE/Acquisition#sin", selector="LHC.USER.ALL")
+        with profiler.span("Set up the plot and start the subscriptions"):
+            self._setup_plot(plot_widget=scrolling_plot, parameter="TEST_DEVICE/Acquisition#sin",
+                             selector="LHC.USER.ALL")
 
         # Setup the spinbox widgets
-        self._setup_spinbox(spinbox_name="amplitude_sin",
-                            initial_value=self.model.get_amplitude_sin(),
-                            connect_to=self.model.set_amplitude_sin)
-        self._setup_spinbox(spinbox_name="period_sin",
-                            initial_value=self.model.get_period_sin(),
-                            connect_to=self.model.set_period_sin)
+        self._setup_spinbox(spinbox_name="amplitude_sin", connect_to=self.model.set_amplitude_sin)
+        self._setup_spinbox(spinbox_name="period_sin", connect_to=self.model.set_period_sin)
+
+        # Read all the initial values of the spinboxes with a single GET, without waiting for it:
+        # the values are shown by _show_settings when they arrive
+        self.model.sig_settings_received.connect(self._show_settings)
+        self.settings_future = self.model.fetch_settings(["amplitude_sin", "period_sin"])
+
+        # Show the measurements of the plot sources, if enabled (see instrumentation.py)
+        if source_statistics.enabled:
+            self.verticalLayout.addWidget(SourceStatsWidget(self))
 
         # Log something to see it in the LogDisplay Widget
         logging.debug("This message won't be visible, because the default log level is INFO")
         logging.info("This is a message from the application.")
 
+    @pyqtSlot(str, str)
+    def _japc_call_failed(self, parameter_name: str, error: str) -> None:
+        """
+        Logs the GETs and SETs that failed, so that they appear in the LogDisplay Widget.
+        :param parameter_name: the parameter that could not be read or written
+        :param error: the error message
+        :return: None
+        """
+        logging.error("JAPC call on {} failed: {}".format(parameter_name, error))
+
+    def pause_updates(self) -> None:
+        """
+        Stops the plot sources, for example while the widget is hidden. Their JAPC subscriptions
+        are removed, unless other widgets use them.
+        :return: None
+        """
+        for source in self.sources:
+            source.pause()
+        self.render_governor.pause()
+
+    def resume_updates(self) -> None:
+        """
+        Restarts the plot sources stopped by ``pause_updates``.
+        :return: None
+        """
+        for source in self.sources:
+            source.resume()
+        self.render_governor.resume()
+
+    def closeEvent(self, event: 'QCloseEvent') -> None:
+        """
+        Releases the JAPC subscriptions and connectors used by this widget when it gets closed.
+        :param event: the close event
+        :return: None
+        """
+        for source in self.sources:
+            source.close()
+        self.sources.clear()
+        self.model.close()
+        super(MainWidget, self).closeEvent(event)
+
     def _setup_plot(self, plot_widget: 'PlotWidget', parameter: str, selector: str) -> None:
         """
         Sets up the plots by connecting the widgets on the View to their relative Models.
@@ -64,30 +128,67 @@ class MainWidget(QWidget, Ui_Form):
         """
         # Create timing source
         timing_source = DeviceTimingSource(parameter, selector)
-        # Connect the timing source to the plot
-        plot_widget.timing_source = timing_source
-
-        # Create the data source
-        data_source = SinglePointSource(parameter, selector)
-        # Add the data source as a curve in the plot
-        plot_widget.addCurve(data_source=data_source)
+        # Connect the timing source to the plot, through the render governor
+        plot_widget.timing_source = self.render_governor.govern(timing_source, plot_widget.viewport())
+        self.sources.append(timing_source)
+
+        # Create the data source. DecimatedPointSource sends its data to the plot once per frame, and at most
+        # two points per pixel: until the plot is shown, the screen width is the widest the plot can get.
+        # Use SinglePointSource instead to send each value as soon as it is received
+        data_source = DecimatedPointSource(parameter, selector, time_span=10.0,
+                                           pixel_width=QGuiApplication.primaryScreen().size().width())
+        # Add the data source as a curve in the plot, through the render governor
+        plot_widget.addCurve(data_source=self.render_governor.govern(data_source, plot_widget.viewport()))
+        self.sources.append(data_source)
+        # Keep the resolution of the data source in line with what the plot shows, when it's zoomed or resized
+        view_box = plot_widget.getPlotItem().getViewBox()
+        view_changed = partial(self._plot_view_changed, view_box, data_source)
+        view_box.sigXRangeChanged.connect(view_changed)
+        view_box.sigResized.connect(view_changed)
+
+        # Tell the sources statistics when the plot gets painted (see instrumentation.py)
+        plot_widget.viewport().installEventFilter(PaintProbe([timing_source.stats_name, data_source.stats_name],
+                                                             parent=plot_widget))
 
         # Setup other plot properties
         plot_widget.time_span = TimeSpan(10.0, 0.0),
         plot_widget.time_progress_line = True
 
-    def _setup_spinbox(self, spinbox_name: str, initial_value: int, connect_to: Callable) -> None:
+    @staticmethod
+    def _plot_view_changed(view_box: 'ViewBox', data_source: DecimatedPointSource, *args) -> None:
+        """
+        Tells a data source which time range the plot shows, and on how many pixels.
+        :param view_box: the view box of the plot
+        :param data_source: the data source of the plot
+        :param args: the arguments of the view box signal, unused
+        :return: None
         """
-        Sets up the spinbox by setting their initial values and then connecting them to the JAPC SET function
-        exposed by the ``ExampleModel`` class.
+        (x_min, x_max), _ = view_box.viewRange()
+        data_source.set_view(x_min, x_max, int(view_box.width()))
+
+    def _setup_spinbox(self, spinbox_name: str, connect_to: Callable) -> None:
+        """
+        Sets up the spinbox by connecting them to the JAPC SET function exposed by the ``ExampleModel`` class.
+        Their initial values are set by ``_show_settings``.
         :param spinbox_name: The name of the Spinbox widget on the View
-        :param initial_value: The initial value to display on the widget
         :param connect_to: the function that performs the SET when a new value is entered in the spinbox.
         :return: None
         """
         # Find the SpinBox by name in the View
         spinbox = self.findChild(QSpinBox, spinbox_name)
-        # Set its initial value
-        spinbox.setValue(initial_value)
         # Connect it to the control system to make it able to SET
-        spinbox.valueChanged.connect(connect_to)
\ No newline at end of file
+        spinbox.valueChanged.connect(connect_to)
+
+    @pyqtSlot(object)
+    def _show_settings(self, settings: dict) -> None:
+        """
+        Displays the values read from the control system in the spinboxes with the same name.
+        :param settings: a dictionary mapping field names to values
+        :return: None
+        """
+        for spinbox_name, value in settings.items():
+            spinbox = self.findChild(QSpinBox, spinbox_name)
+            # Don't let the spinbox SET back the value it just received
+            spinbox.blockSignals(True)
+            spinbox.setValue(value)
+            spinbox.blockSignals(False)
\ No newline at end of file
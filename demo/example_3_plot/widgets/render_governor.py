@@ -0,0 +1,154 @@
+import time
+from typing import List, Optional
+
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+from PyQt5.QtWidgets import QWidget
+from accwidgets.graph import UpdateSource, PointData, CurveData
+
+
+class _GovernedSource(UpdateSource):
+    """
+    Stands between a source and the plot: collects what the source emits, and re-emits it
+    only when the ``RenderGovernor`` draws a frame.
+    """
+    def __init__(self, source: UpdateSource, widget: Optional[QWidget] = None):
+        super().__init__()
+        self.source = source
+        # The widget painting the plot, repainted when a frame is drawn
+        self.widget = widget
+        self._timestamp: Optional[float] = None
+        self._x: List[np.ndarray] = []
+        self._y: List[np.ndarray] = []
+        source.sig_new_timestamp.connect(self._new_timestamp)
+        source.sig_new_data[PointData].connect(self._new_point)
+        source.sig_new_data[CurveData].connect(self._new_curve)
+
+    @property
+    def dirty(self) -> bool:
+        """ Whether something was received since the last frame. """
+        return self._timestamp is not None or bool(self._x)
+
+    @pyqtSlot(float)
+    def _new_timestamp(self, timestamp: float) -> None:
+        # Only the newest timestamp matters for the plot
+        self._timestamp = timestamp
+
+    @pyqtSlot(PointData)
+    def _new_point(self, point: PointData) -> None:
+        self._x.append(np.array([point.x]))
+        self._y.append(np.array([point.y]))
+
+    @pyqtSlot(CurveData)
+    def _new_curve(self, curve: CurveData) -> None:
+        self._x.append(np.asarray(curve.x))
+        self._y.append(np.asarray(curve.y))
+
+    def render(self) -> None:
+        """ Sends everything received since the last frame to the plot, in one signal per kind. """
+        if self._x:
+            x, y = np.concatenate(self._x), np.concatenate(self._y)
+            self._x.clear()
+            self._y.clear()
+            self.sig_new_data[CurveData].emit(CurveData(x=x, y=y))
+        if self._timestamp is not None:
+            timestamp, self._timestamp = self._timestamp, None
+            self.sig_new_timestamp.emit(timestamp)
+
+
+class RenderGovernor(QObject):
+    """
+    Limits how often the plots are redrawn, whatever the rate the data arrives at.
+
+    Sources are wrapped with ``govern()`` before being given to the plot. What they emit only marks
+    them as dirty: the governor redraws the dirty ones together, at most ``max_fps`` times per second.
+
+    The frame rate adapts to the load: when drawing a frame, including painting the plots, takes longer than
+    ``budget`` of the frame interval (or the frames start late, because the GUI thread is busy), the frame
+    rate is lowered, down to
+    ``min_fps``. When frames become cheap again, it's raised back slowly, up to ``max_fps``. This way the
+    GUI thread always keeps time for the user input.
+    """
+    # Emitted with the new frame rate when it adapts
+    sig_fps_changed = pyqtSignal(float)
+
+    def __init__(self, max_fps: float = 30.0, min_fps: float = 2.0, budget: float = 0.5,
+                 parent: Optional[QObject] = None):
+        """
+        :param max_fps: The highest frame rate, in frames per second
+        :param min_fps: The lowest frame rate the governor can go down to
+        :param budget: The fraction of the frame interval that drawing a frame may take
+        :param parent: The parent QObject
+        """
+        super().__init__(parent)
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.budget = budget
+        self.fps = max_fps
+        # Duration of the last frames, smoothed
+        self.frame_time = 0.0
+        self._sources: List[_GovernedSource] = []
+        self._last_frame: Optional[float] = None
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.render)
+        self._timer.start(self._interval_ms())
+
+    def govern(self, source: UpdateSource, widget: Optional[QWidget] = None) -> UpdateSource:
+        """
+        Wraps a timing or data source, so that the plot receives its updates only when a frame is drawn.
+        :param source: the source to govern
+        :param widget: the widget painting the plot (the viewport, for pyqtgraph-based plots). When given,
+            it's painted right away when a frame is drawn, so that the painting time counts in the frame time.
+        :return: the source to give to the plot instead
+        """
+        governed = _GovernedSource(source, widget)
+        self._sources.append(governed)
+        return governed
+
+    def _interval_ms(self) -> int:
+        return max(int(1000 / self.fps), 1)
+
+    def pause(self) -> None:
+        """ Stops drawing frames, for example while the plots are hidden. Updates keep being collected. """
+        self._timer.stop()
+        self._last_frame = None
+
+    def resume(self) -> None:
+        """ Starts drawing frames again. """
+        if not self._timer.isActive():
+            self._timer.start(self._interval_ms())
+
+    @pyqtSlot()
+    def render(self) -> None:
+        """
+        Draws a frame: sends their updates to the plots of the dirty sources, paints the plots,
+        then adapts the frame rate.
+        """
+        started = time.perf_counter()
+        interval = 1 / self.fps
+        # Starting late also means the GUI thread had no time left
+        lateness = max(started - self._last_frame - interval, 0.0) if self._last_frame is not None else 0.0
+        self._last_frame = started
+        dirty = [source for source in self._sources if source.dirty]
+        for source in dirty:
+            source.render()
+        if not dirty:
+            return
+        # Paint now instead of at the next paint event, to measure it. Hidden widgets are not painted.
+        for widget in {source.widget for source in dirty if source.widget is not None}:
+            widget.repaint()
+        self.frame_time = 0.8 * self.frame_time + 0.2 * (time.perf_counter() - started + lateness)
+        self._adapt(interval)
+
+    def _adapt(self, interval: float) -> None:
+        """ Lowers the frame rate quickly when frames are over budget, and raises it slowly when they are cheap. """
+        if self.frame_time > self.budget * interval:
+            fps = max(self.fps * 0.75, self.min_fps)
+        elif self.frame_time < 0.5 * self.budget * interval:
+            fps = min(self.fps + 1, self.max_fps)
+        else:
+            return
+        if fps != self.fps:
+            self.fps = fps
+            self._timer.setInterval(self._interval_ms())
+            self.sig_fps_changed.emit(fps)
@@ -0,0 +1,55 @@
+from typing import Optional
+
+from PyQt5.QtCore import QTimer, pyqtSlot
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QHeaderView
+
+from demo.example_3_plot.models.instrumentation import source_statistics
+
+
+class SourceStatsWidget(QWidget):
+    """
+    Small table showing the measurements of the plot sources (see ``instrumentation.py``),
+    refreshed every second, with a button writing them to the log.
+    """
+    COLUMNS = (
+        ("Source", "parameter", "{}"),
+        ("Callbacks", "callbacks", "{}"),
+        ("Rate (/s)", "rate", "{:.1f}"),
+        ("Callback→emit (ms)", "callback_to_emit_mean_ms", "{:.2f}"),
+        ("max", "callback_to_emit_max_ms", "{:.2f}"),
+        ("Emit→paint (ms)", "emit_to_paint_mean_ms", "{:.2f}"),
+        ("max", "emit_to_paint_max_ms", "{:.2f}"),
+        ("Backlog", "backlog", "{}"),
+        ("max", "max_backlog", "{}"),
+    )
+
+    def __init__(self, parent: Optional[QWidget] = None, refresh_interval: int = 1000):
+        """
+        :param parent: the parent widget
+        :param refresh_interval: how often (in milliseconds) the table is refreshed
+        """
+        super(SourceStatsWidget, self).__init__(parent)
+        self.table = QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels([title for title, _, _ in self.COLUMNS])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.verticalHeader().hide()
+        export_button = QPushButton("Export to log", self)
+        export_button.clicked.connect(lambda: source_statistics.export())
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.table)
+        layout.addWidget(export_button)
+
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(refresh_interval)
+
+    @pyqtSlot()
+    def refresh(self) -> None:
+        """ Shows the latest measurements. """
+        snapshots = source_statistics.snapshot()
+        self.table.setRowCount(len(snapshots))
+        for row, snapshot in enumerate(snapshots):
+            for column, (_, key, text_format) in enumerate(self.COLUMNS):
+                self.table.setItem(row, column, QTableWidgetItem(text_format.format(snapshot[key])))
@@ -0,0 +1,106 @@
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class _JapcTask(QRunnable):
+    """
+    Runs one PyJAPC call on a worker thread, completing its future with the outcome.
+    """
+    def __init__(self, function: Callable, args: tuple, future: Future):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.future = future
+
+    def run(self) -> None:
+        # The future might have been cancelled while waiting in the queue
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.function(*self.args)
+        except Exception as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+
+class AsyncJapc(QObject):
+    """
+    Non-blocking wrapper around a PyJAPC connector.
+
+    GETs and SETs are executed on the threads of a ``QThreadPool``. Every call returns
+    immediately a ``concurrent.futures.Future``, and its outcome is also emitted with
+    the signals below, so that slots on the GUI thread can react to it without waiting.
+
+    NOTE: with more than one thread, calls may complete in a different order than they
+    were issued. Use ``max_threads=1`` when the order matters (for example for SETs).
+    """
+    # Emitted with the parameter name and the value read
+    sig_get_done = pyqtSignal(str, object)
+    # Emitted with the parameter name and the value written
+    sig_set_done = pyqtSignal(str, object)
+    # Emitted with the parameter name and the error message, for both GETs and SETs
+    sig_failed = pyqtSignal(str, str)
+
+    def __init__(self, japc, max_threads: Optional[int] = None, parent: Optional[QObject] = None):
+        """
+        :param japc: The PyJAPC connector to use
+        :param max_threads: How many calls can run in parallel. If None, Qt's global thread pool is used.
+        :param parent: The parent QObject
+        """
+        super().__init__(parent)
+        self.japc = japc
+        if max_threads is None:
+            self._thread_pool = QThreadPool.globalInstance()
+        else:
+            self._thread_pool = QThreadPool(self)
+            self._thread_pool.setMaxThreadCount(max_threads)
+
+    def get(self, parameter_name: str) -> Future:
+        """
+        GETs a parameter in the background.
+        :param parameter_name: The parameter to GET (Device/Property or Device/Property#field)
+        :return: a Future that will hold the value read
+        """
+        future = self._submit(self.japc.getParam, parameter_name)
+        future.add_done_callback(lambda f: self._report(f, parameter_name, self.sig_get_done, None, True))
+        return future
+
+    def set(self, parameter_name: str, value: Any) -> Future:
+        """
+        SETs a parameter in the background.
+        :param parameter_name: The parameter to SET (Device/Property or Device/Property#field)
+        :param value: The value to write
+        :return: a Future that will complete when the SET is done
+        """
+        future = self._submit(self.japc.setParam, parameter_name, value)
+        future.add_done_callback(lambda f: self._report(f, parameter_name, self.sig_set_done, value, False))
+        return future
+
+    def wait_for_done(self, timeout: int = -1) -> bool:
+        """
+        Blocks until all the calls already started are completed.
+        :param timeout: How long to wait at most, in milliseconds (-1 waits forever)
+        :return: False if the timeout expired, True otherwise
+        """
+        return self._thread_pool.waitForDone(timeout)
+
+    def _submit(self, function: Callable, *args) -> Future:
+        future = Future()
+        self._thread_pool.start(_JapcTask(function, args, future))
+        return future
+
+    def _report(self, future: Future, parameter_name: str, done_signal, value: Any, emit_result: bool) -> None:
+        """
+        Emits the signal matching the outcome of a call (from the worker thread).
+        On success, ``done_signal`` carries either the result of the call or the given value.
+        """
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.sig_failed.emit(parameter_name, str(error))
+        else:
+            done_signal.emit(parameter_name, future.result() if emit_result else value)
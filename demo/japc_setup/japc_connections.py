@@ -0,0 +1,93 @@
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+import pyjapc
+
+
+class _PooledConnection:
+    """
+    A PyJAPC connector together with the number of its users.
+    """
+    def __init__(self, japc, key):
+        self.japc = japc
+        self.key = key
+        self.users = 0
+
+
+class JapcConnectionPool:
+    """
+    Pool of PyJAPC connectors, shared by all models and data sources.
+
+    Connectors are created lazily, one per selector, and reference counted:
+    every ``acquire()`` must be paired with a ``release()``, and the connector
+    is torn down when its last user releases it.
+
+    NOTE: pooled connectors are shared, so never call ``setSelector()`` on them:
+    acquire a connector for the selector you need instead.
+    """
+    def __init__(self):
+        self._connections: Dict[Tuple[object, str], _PooledConnection] = {}
+        self._lock = Lock()
+
+    def acquire(self, selector: str):
+        """
+        Returns the PyJAPC connector for the given selector, creating it if needed.
+        :param selector: The JAPC selector the connector has to use
+        :return: a PyJAPC instance
+        """
+        # pyjapc.PyJapc is part of the key, so monkey-patching it (with papc, for example)
+        # never gives back a connector created by the previous factory
+        key = (pyjapc.PyJapc, selector)
+        with self._lock:
+            connection = self._connections.get(key)
+            if connection is None:
+                # Create the PyJAPC connector
+                japc = pyjapc.PyJapc()
+                # Use the given selector
+                japc.setSelector(timingSelector=selector)
+                connection = self._connections[key] = _PooledConnection(japc, key)
+            connection.users += 1
+            return connection.japc
+
+    def release(self, japc) -> None:
+        """
+        Gives back a connector obtained with ``acquire()``. The last user tears it down.
+        :param japc: The PyJAPC instance returned by ``acquire()``
+        :return: None
+        """
+        with self._lock:
+            connection = self._find(japc)
+            if connection is None:
+                return
+            connection.users -= 1
+            if connection.users > 0:
+                return
+            del self._connections[connection.key]
+        self._teardown(connection.japc)
+
+    def connection_count(self) -> int:
+        """ Returns how many connectors are currently alive. """
+        return len(self._connections)
+
+    def clear(self) -> None:
+        """ Tears down all the connectors, regardless of their users. """
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            self._teardown(connection.japc)
+
+    def _find(self, japc) -> Optional[_PooledConnection]:
+        for connection in self._connections.values():
+            if connection.japc is japc:
+                return connection
+        return None
+
+    @staticmethod
+    def _teardown(japc) -> None:
+        japc.stopSubscriptions()
+        japc.clearSubscriptions()
+
+
+# The pool shared by all the models of the application
+connection_pool = JapcConnectionPool()
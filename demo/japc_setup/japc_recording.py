@@ -0,0 +1,398 @@
+"""
+Recording of live JAPC subscriptions, and a PyJAPC stand-in that replays them.
+
+Record some traffic with ``SubscriptionRecorder``, while the application is connected to the real control system::
+
+    recorder = SubscriptionRecorder()
+    recorder.record("TEST_DEVICE/Acquisition#sin", "LHC.USER.ALL")
+    ...
+    recorder.stop()
+    recorder.to_recording().save("traffic.npz")
+
+then replay it offline, exactly like the sandbox does with papc::
+
+    pyjapc.PyJapc = replay_factory("traffic.npz", speed=10)
+
+Recordings are NumPy ``.npz`` files with one array per column (stamp, parameter, selector, value...),
+and only support numeric values (scalars and arrays). The recorder keeps the samples in memory, up to a limit
+(see ``SubscriptionRecorder``): record a long capture in several parts.
+"""
+import time
+import logging
+from datetime import datetime, timezone
+from threading import Event, Lock, Thread, current_thread
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from demo.japc_setup.japc_subscriptions import acquisition_stamp, subscription_hub
+
+
+class Recording:
+    """
+    Samples of one or more JAPC subscriptions, stored column by column in NumPy arrays.
+
+    Parameter and selector names are stored once, and each sample refers to them by index.
+    The values of all samples are flattened one after the other into a single array: sample ``i``
+    takes ``values[offsets[i]:offsets[i + 1]]``, reshaped to ``shapes[i]`` (-1 marks unused dimensions,
+    so a scalar has shape (-1, -1) and a 1D array of length n has shape (n, -1)).
+    """
+    def __init__(self, parameters: List[str], selectors: List[str], stamps: np.ndarray,
+                 parameter_ids: np.ndarray, selector_ids: np.ndarray, shapes: np.ndarray, values: np.ndarray):
+        self.parameters = list(parameters)
+        self.selectors = list(selectors)
+        self.stamps = np.asarray(stamps, dtype=np.float64)
+        self.parameter_ids = np.asarray(parameter_ids, dtype=np.uint32)
+        self.selector_ids = np.asarray(selector_ids, dtype=np.uint32)
+        self.shapes = np.asarray(shapes, dtype=np.int64).reshape(-1, 2)
+        self.values = np.asarray(values, dtype=np.float64)
+        sizes = np.where(self.shapes < 0, 1, self.shapes).prod(axis=1)
+        self.offsets = np.concatenate(([0], np.cumsum(sizes)))
+
+    def __len__(self) -> int:
+        return len(self.stamps)
+
+    @property
+    def duration(self) -> float:
+        """ Time (in seconds) between the first and the last sample. """
+        return float(self.stamps[-1] - self.stamps[0]) if len(self) else 0.0
+
+    def sample(self, index: int) -> Tuple[str, str, float, object]:
+        """
+        :param index: the index of the sample
+        :return: the parameter name, the selector, the acquisition stamp and the value of the sample
+        """
+        shape = tuple(int(size) for size in self.shapes[index] if size >= 0)
+        value = self.values[self.offsets[index]:self.offsets[index + 1]]
+        value = value.reshape(shape) if shape else float(value[0])
+        return (self.parameters[self.parameter_ids[index]], self.selectors[self.selector_ids[index]],
+                float(self.stamps[index]), value)
+
+    def save(self, path: str, compress: bool = True) -> None:
+        """
+        Writes the recording to a ``.npz`` file.
+        :param path: the path of the file
+        :param compress: whether to compress the file (smaller, but slower to write and read)
+        :return: None
+        """
+        save = np.savez_compressed if compress else np.savez
+        save(path, parameters=np.array(self.parameters, dtype=str), selectors=np.array(self.selectors, dtype=str),
+             stamps=self.stamps, parameter_ids=self.parameter_ids, selector_ids=self.selector_ids,
+             shapes=self.shapes, values=self.values)
+
+    @classmethod
+    def load(cls, path: str) -> 'Recording':
+        """ Reads a recording written by ``save()``. """
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["parameters"].tolist(), data["selectors"].tolist(), data["stamps"],
+                       data["parameter_ids"], data["selector_ids"], data["shapes"], data["values"])
+
+
+class SubscriptionRecorder:
+    """
+    Records the updates of JAPC subscriptions, through the ``SubscriptionHub``: recording a parameter
+    that the application already displays doesn't add any JAPC subscription.
+
+    The samples are kept in memory until ``to_recording()``, so the recorder stores at most ``max_values`` numbers
+    (a scalar counts as one, an array as its size): the updates received after the limit is reached are dropped,
+    and counted in ``dropped``.
+    """
+    # 10 million numbers take 80 MB, plus a few dozen bytes per sample
+    DEFAULT_MAX_VALUES = 10_000_000
+
+    def __init__(self, hub=subscription_hub, max_values: int = DEFAULT_MAX_VALUES):
+        """
+        :param hub: where to subscribe to the parameters
+        :param max_values: how many numbers to store at most
+        """
+        self._hub = hub
+        self.max_values = max_values
+        self._value_count = 0
+        self._callbacks: Dict[Tuple[str, str], Callable] = {}
+        self._parameters: Dict[str, int] = {}
+        self._selectors: Dict[str, int] = {}
+        self._stamps: List[float] = []
+        self._parameter_ids: List[int] = []
+        self._selector_ids: List[int] = []
+        self._shapes: List[Tuple[int, int]] = []
+        self._values: List[np.ndarray] = []
+        # Updates that could not be recorded, because their value is not numeric
+        self.skipped = 0
+        # Updates that were not recorded, because the recorder was full
+        self.dropped = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._stamps)
+
+    def record(self, parameter_name: str, selector: str) -> None:
+        """
+        Starts recording the updates of the given parameter.
+        :param parameter_name: the JAPC parameter (Device/Property#field)
+        :param selector: the JAPC selector
+        :return: None
+        """
+        key = (parameter_name, selector)
+        if key in self._callbacks:
+            return
+        callback = self._callbacks[key] = lambda name, value, header: self._add(name, selector, value, header)
+        self._hub.subscribe(parameter_name, selector, callback)
+
+    def stop(self) -> None:
+        """ Stops recording all the parameters. The samples recorded so far are kept. """
+        for (parameter_name, selector), callback in self._callbacks.items():
+            self._hub.unsubscribe(parameter_name, selector, callback)
+        self._callbacks.clear()
+
+    def _add(self, parameter_name: str, selector: str, value, header: dict) -> None:
+        """ Stores one update. Called by the subscriptions, on the PyJAPC threads. """
+        try:
+            array = np.asarray(value, dtype=np.float64)
+        except (TypeError, ValueError):
+            array = None
+        if array is None or array.ndim > 2:
+            self.skipped += 1
+            return
+        shape = tuple(array.shape) + (-1, ) * (2 - array.ndim)
+        with self._lock:
+            if self._value_count + array.size > self.max_values:
+                if not self.dropped:
+                    logging.warning("The recorder is full ({} values): the next updates are dropped".format(
+                        self._value_count))
+                self.dropped += 1
+                return
+            self._value_count += array.size
+            self._stamps.append(acquisition_stamp(header))
+            self._parameter_ids.append(self._parameters.setdefault(parameter_name, len(self._parameters)))
+            self._selector_ids.append(self._selectors.setdefault(selector, len(self._selectors)))
+            self._shapes.append(shape)
+            self._values.append(array.ravel())
+
+    def to_recording(self) -> Recording:
+        """ Returns the samples recorded so far, in order of acquisition stamp. """
+        with self._lock:
+            order = np.argsort(self._stamps, kind="stable")
+            values = [self._values[i] for i in order]
+            return Recording(list(self._parameters), list(self._selectors),
+                             np.array(self._stamps)[order],
+                             np.array(self._parameter_ids, dtype=np.uint32)[order],
+                             np.array(self._selector_ids, dtype=np.uint32)[order],
+                             np.array(self._shapes, dtype=np.int64).reshape(-1, 2)[order],
+                             np.concatenate(values) if values else np.zeros(0))
+
+
+class _ReplaySubscription:
+    """ A subscription of a ``ReplayPyJapc`` connector. """
+    def __init__(self, callback: Callable, get_header: bool, unixtime: bool):
+        self.callback = callback
+        self.get_header = get_header
+        self.unixtime = unixtime
+        self.started = False
+        self.first_update = True
+
+
+class ReplayPyJapc:
+    """
+    PyJAPC-like connector that replays a ``Recording`` to its subscribers.
+
+    Playback starts with the first ``startSubscriptions()`` and follows the acquisition stamps of the recording,
+    ``speed`` times faster (``speed=None`` replays as fast as possible). Each started subscription receives the
+    samples of its parameter and selector, in the same order every time, so the results are reproducible.
+
+    ``getParam`` returns the last value replayed (or the first one recorded) of a parameter, and the last value
+    given to ``setParam``. Parameters that are not in the recording are forwarded to the ``fallback`` connector,
+    for example a papc one, or raise a ``KeyError`` if there is none.
+    """
+    def __init__(self, recording: Recording, speed: Optional[float] = 1.0, live_stamps: bool = True,
+                 fallback: Optional[Callable] = None, selector: str = "", *args, **kwargs):
+        """
+        :param recording: the samples to replay
+        :param speed: how many times faster than real time the samples are replayed, or None for maximum speed
+        :param live_stamps: if True, the acquisition stamps are replaced by the time each sample is replayed at,
+            so that the recording looks like it started when the playback started. Otherwise the recorded
+            stamps are kept.
+        :param fallback: a PyJAPC-like factory, creating the connector for the parameters not in the recording
+        :param selector: the default JAPC selector, like for PyJAPC
+        """
+        self.recording = recording
+        self.speed = speed
+        self.live_stamps = live_stamps
+        self.selector = selector
+        self._fallback_factory = fallback
+        self._fallback = None
+        # Like PyJAPC, one subscription for each parameter and selector
+        self._subscriptions: Dict[Tuple[str, str], _ReplaySubscription] = {}
+        self._last_values: Dict[Tuple[str, str], object] = {}
+        # Set to stop the playback thread. Each thread gets its own, as it may end after a new one started.
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    def _fallback_connector(self, parameter_name: str):
+        """ Returns the connector for a parameter that is not in the recording. """
+        if self._fallback_factory is None:
+            raise KeyError("Parameter {} is not in the recording".format(parameter_name))
+        if self._fallback is None:
+            self._fallback = self._fallback_factory()
+            self._fallback.setSelector(timingSelector=self.selector)
+        return self._fallback
+
+    def setSelector(self, timingSelector: str = "", *args, **kwargs):
+        self.selector = timingSelector
+        if self._fallback is not None:
+            self._fallback.setSelector(timingSelector, *args, **kwargs)
+
+    def getParam(self, parameterName: str, getHeader: bool = False, timingSelectorOverride: Optional[str] = None,
+                 **kwargs):
+        if parameterName not in self.recording.parameters:
+            return self._fallback_connector(parameterName).getParam(
+                parameterName, getHeader=getHeader, timingSelectorOverride=timingSelectorOverride, **kwargs)
+        selector = timingSelectorOverride if timingSelectorOverride is not None else self.selector
+        key = (parameterName, selector)
+        with self._lock:
+            if key not in self._last_values:
+                self._last_values[key] = self._first_value(parameterName, selector)
+            value = self._last_values[key]
+        return (value, {"selector": selector}) if getHeader else value
+
+    def setParam(self, parameterName: str, parameterValue, timingSelectorOverride: Optional[str] = None, **kwargs):
+        if parameterName not in self.recording.parameters:
+            return self._fallback_connector(parameterName).setParam(
+                parameterName, parameterValue, timingSelectorOverride=timingSelectorOverride, **kwargs)
+        selector = timingSelectorOverride if timingSelectorOverride is not None else self.selector
+        with self._lock:
+            self._last_values[(parameterName, selector)] = parameterValue
+
+    def subscribeParam(self, parameterName: str, onValueReceived: Callable, onException: Optional[Callable] = None,
+                       getHeader: bool = False, unixtime: bool = False, timingSelectorOverride: Optional[str] = None,
+                       **kwargs):
+        if parameterName not in self.recording.parameters:
+            return self._fallback_connector(parameterName).subscribeParam(
+                parameterName, onValueReceived, onException, getHeader=getHeader, unixtime=unixtime,
+                timingSelectorOverride=timingSelectorOverride, **kwargs)
+        selector = timingSelectorOverride if timingSelectorOverride is not None else self.selector
+        with self._lock:
+            self._subscriptions[(parameterName, selector)] = _ReplaySubscription(onValueReceived, getHeader, unixtime)
+
+    def startSubscriptions(self, parameterName: Optional[str] = None, *args, **kwargs):
+        self._set_started(True, parameterName, "startSubscriptions", *args, **kwargs)
+        with self._lock:
+            # Once the whole recording was replayed, starting again replays it from the beginning
+            if self._thread is None or not self._thread.is_alive():
+                self._stop = Event()
+                self._thread = Thread(target=self._play, args=(self._stop, ), name="ReplayPyJapc")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stopSubscriptions(self, parameterName: Optional[str] = None, *args, **kwargs):
+        self._set_started(False, parameterName, "stopSubscriptions", *args, **kwargs)
+
+    def clearSubscriptions(self, parameterName: Optional[str] = None, *args, **kwargs):
+        with self._lock:
+            for key in self._keys(parameterName):
+                del self._subscriptions[key]
+            # Nobody left to replay to: stop playing
+            thread = self._thread if not self._subscriptions else None
+            if thread is not None:
+                self._stop.set()
+                self._thread = None
+        if self._fallback is not None:
+            self._fallback.clearSubscriptions(parameterName, *args, **kwargs)
+        # A callback clearing the subscriptions runs in the playback thread, which stops after it returns
+        if thread is not None and thread is not current_thread():
+            thread.join()
+
+    def _set_started(self, started: bool, parameter_name: Optional[str], fallback_method: str, *args, **kwargs):
+        """ Starts or stops the given subscription, or all of them. """
+        with self._lock:
+            for key in self._keys(parameter_name):
+                self._subscriptions[key].started = started
+        if self._fallback is not None and (parameter_name is None or parameter_name not in self.recording.parameters):
+            getattr(self._fallback, fallback_method)(parameter_name, *args, **kwargs)
+
+    def _keys(self, parameter_name: Optional[str]) -> List[Tuple[str, str]]:
+        """ Returns the keys of the subscriptions to a parameter, or of all of them. Call it holding the lock. """
+        return [key for key in self._subscriptions if parameter_name is None or key[0] == parameter_name]
+
+    def wait_for_done(self, timeout: int = -1) -> bool:
+        """
+        Blocks until the whole recording has been replayed.
+        :param timeout: How long to wait at most, in milliseconds (-1 waits forever)
+        :return: False if the timeout expired, True otherwise
+        """
+        thread = self._thread
+        if thread is None:
+            return True
+        thread.join(timeout / 1000 if timeout >= 0 else None)
+        return not thread.is_alive()
+
+    def _first_value(self, parameter_name: str, selector: str):
+        """ Returns the first recorded value of the parameter. Call it holding the lock. """
+        parameter_id = self.recording.parameters.index(parameter_name)
+        matches = np.flatnonzero(self.recording.parameter_ids == parameter_id)
+        for index in matches:
+            _, sample_selector, _, value = self.recording.sample(index)
+            if sample_selector == selector:
+                return value
+        raise KeyError("Parameter {} has no samples for selector '{}'".format(parameter_name, selector))
+
+    def _play(self, stop: Event):
+        """
+        Delivers the samples of the recording to the started subscriptions, at the right time.
+        :param stop: set to stop playing
+        """
+        recording = self.recording
+        if not len(recording):
+            return
+        first_stamp = float(recording.stamps[0])
+        start = time.time()
+        for index in range(len(recording)):
+            if self.speed is not None:
+                delay = start + (recording.stamps[index] - first_stamp) / self.speed - time.time()
+                if delay > 0:
+                    stop.wait(delay)
+            if stop.is_set():
+                return
+            name, selector, stamp, value = recording.sample(index)
+            with self._lock:
+                subscription = self._subscriptions.get((name, selector))
+                if subscription is None or not subscription.started:
+                    continue
+                self._last_values[(name, selector)] = value
+            if self.live_stamps:
+                # When the sample is due in the playback, or right now at maximum speed
+                stamp = start + (stamp - first_stamp) / self.speed if self.speed is not None else time.time()
+            self._deliver(subscription, name, selector, stamp, value)
+
+    @staticmethod
+    def _deliver(subscription: _ReplaySubscription, name: str, selector: str, stamp: float, value) -> None:
+        """ Calls the callback of a subscription, the same way PyJAPC does. """
+        try:
+            if not subscription.get_header:
+                subscription.callback(name, value)
+                return
+            if not subscription.unixtime:
+                stamp = datetime.fromtimestamp(stamp, tz=timezone.utc)
+            header = {"acqStamp": stamp, "cycleStamp": stamp, "selector": selector,
+                      "isFirstUpdate": subscription.first_update}
+            subscription.first_update = False
+            subscription.callback(name, value, header)
+        except Exception:
+            logging.exception("Subscription callback for {} failed".format(name))
+
+
+def replay_factory(path: str, speed: Optional[float] = 1.0, live_stamps: bool = True,
+                   fallback: Optional[Callable] = None) -> Callable:
+    """
+    Creates a PyJAPC-like factory replaying a recording, to monkeypatch ``pyjapc.PyJapc``.
+    :param path: the recording, as saved by ``Recording.save()``
+    :param speed: how many times faster than real time the samples are replayed, or None for maximum speed
+    :param live_stamps: whether to shift the acquisition stamps to the time of the playback
+    :param fallback: a PyJAPC-like factory for the parameters that are not in the recording
+    :return: a callable creating ``ReplayPyJapc`` connectors, all sharing the same recording
+    """
+    recording = Recording.load(path)
+
+    def create(*args, **kwargs):
+        return ReplayPyJapc(recording, speed, live_stamps, fallback, *args, **kwargs)
+    return create
@@ -0,0 +1,126 @@
+import time
+import logging
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from demo.japc_setup.japc_connections import connection_pool
+
+# Offset between the monotonic clock and the Unix epoch, measured once
+_MONOTONIC_TO_UNIX = time.time() - time.monotonic()
+
+
+def acquisition_stamp(header: Optional[dict]) -> float:
+    """
+    Returns the acquisition timestamp of a JAPC value, as a Unix timestamp in seconds.
+    If the header carries no acquisition stamp, the current time is returned instead,
+    read from the monotonic clock (cheap, and immune to system clock adjustments).
+    :param header: the header received together with the value (subscribe with ``getHeader=True``)
+    :return: the timestamp
+    """
+    stamp = header.get("acqStamp") if header else None
+    if not stamp:
+        return time.monotonic() + _MONOTONIC_TO_UNIX
+    if isinstance(stamp, datetime):
+        return stamp.timestamp()
+    return float(stamp)
+
+
+class _Subscription:
+    """
+    One JAPC subscription to a (parameter, selector) pair, shared by all its consumers.
+    """
+    def __init__(self, parameter_name: str, selector: str):
+        self.parameter_name = parameter_name
+        self.selector = selector
+        self.consumers: List[Callable] = []
+        # Take the PyJAPC connector for this selector from the shared pool
+        self.japc = connection_pool.acquire(selector)
+        # Subscribe to the requested Device/Property#field, asking for the header to get the acquisition stamps
+        self.japc.subscribeParam(parameter_name, self._fan_out, getHeader=True, unixtime=True)
+        # Start receiving data (only for this parameter: the connector is shared)
+        self.japc.startSubscriptions(parameter_name)
+
+    def _fan_out(self, name: str, value, header: dict) -> None:
+        """ Forwards every update received from PyJAPC to all the consumers. """
+        # Iterate over a copy: consumers may be added or removed by other threads meanwhile
+        for consumer in tuple(self.consumers):
+            # A failing consumer must not deprive the next ones of the update
+            try:
+                consumer(name, value, header)
+            except Exception:
+                logging.exception("Consumer {} of {} failed".format(consumer, self.parameter_name))
+
+    def close(self) -> None:
+        """ Stops and removes the JAPC subscription, then gives the connector back to the pool. """
+        self.japc.stopSubscriptions(self.parameter_name)
+        self.japc.clearSubscriptions(self.parameter_name)
+        connection_pool.release(self.japc)
+
+
+class SubscriptionHub:
+    """
+    Process-wide register of JAPC subscriptions.
+
+    Each (parameter, selector) pair is subscribed only once, no matter how many
+    consumers (for example ``UpdateSource`` subclasses) are interested in it:
+    every update received from PyJAPC is then forwarded to all of them.
+    The JAPC subscription is removed when its last consumer unsubscribes.
+    """
+    def __init__(self):
+        self._subscriptions: Dict[Tuple[str, str], _Subscription] = {}
+        self._lock = Lock()
+
+    def subscribe(self, parameter_name: str, selector: str, callback: Callable) -> None:
+        """
+        Registers a consumer for the given parameter, subscribing to JAPC if nobody did it yet.
+        :param parameter_name: The JAPC parameter to subscribe to (Device/Property#field)
+        :param selector: The JAPC selector to use
+        :param callback: Function called as ``callback(name, value, header)`` at every update
+        :return: None
+        """
+        with self._lock:
+            key = (parameter_name, selector)
+            subscription = self._subscriptions.get(key)
+            if subscription is None:
+                subscription = self._subscriptions[key] = _Subscription(parameter_name, selector)
+            subscription.consumers.append(callback)
+
+    def unsubscribe(self, parameter_name: str, selector: str, callback: Callable) -> None:
+        """
+        Unregisters a consumer. If it was the last one, the JAPC subscription is removed.
+        :param parameter_name: The JAPC parameter given to ``subscribe()``
+        :param selector: The JAPC selector given to ``subscribe()``
+        :param callback: The callback given to ``subscribe()``
+        :return: None
+        """
+        with self._lock:
+            key = (parameter_name, selector)
+            subscription = self._subscriptions.get(key)
+            if subscription is None or callback not in subscription.consumers:
+                return
+            subscription.consumers.remove(callback)
+            if not subscription.consumers:
+                del self._subscriptions[key]
+                subscription.close()
+
+    def consumer_count(self, parameter_name: str, selector: str) -> int:
+        """ Returns how many consumers are receiving updates for the given parameter and selector. """
+        subscription = self._subscriptions.get((parameter_name, selector))
+        return len(subscription.consumers) if subscription is not None else 0
+
+    def clear(self) -> None:
+        """
+        Removes all the JAPC subscriptions. Useful when ``pyjapc.PyJapc`` gets
+        replaced (for example by the tests fixtures), as the existing subscriptions
+        would keep pointing to the old connectors.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+            self._subscriptions.clear()
+        for subscription in subscriptions:
+            subscription.close()
+
+
+# The hub shared by all the models of the application
+subscription_hub = SubscriptionHub()
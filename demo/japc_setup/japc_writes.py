@@ -0,0 +1,84 @@
+from typing import Any, Dict, Optional
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from demo.japc_setup.japc_async import AsyncJapc
+
+
+class CoalescingWriter(QObject):
+    """
+    Write pipeline that sits between the View and PyJAPC.
+
+    Values passed to ``set()`` are not written immediately: the first edit of a property
+    opens a time window, and all the edits of that property received during the window
+    are merged (the last value of each field wins). When the window closes, all the
+    pending fields of the property are written with a single SET.
+
+    SETs run on a worker thread, one at a time and in order, so the GUI never waits
+    for the control system. Their outcome is reported through the signals below.
+    """
+    # Emitted with the property name and the values written
+    sig_set_done = pyqtSignal(str, object)
+    # Emitted with the property name and the error message
+    sig_set_failed = pyqtSignal(str, str)
+
+    def __init__(self, japc, window: int = 100, parent: Optional[QObject] = None):
+        """
+        :param japc: The PyJAPC connector to use for the SETs
+        :param window: How long (in milliseconds) edits are collected before being written
+        :param parent: The parent QObject
+        """
+        super().__init__(parent)
+        self.japc = japc
+        self.window = window
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._timers: Dict[str, QTimer] = {}
+        # A single worker thread keeps the SETs in the same order as the edits
+        self._async_japc = AsyncJapc(japc, max_threads=1, parent=self)
+        self._async_japc.sig_set_done.connect(self.sig_set_done)
+        self._async_japc.sig_failed.connect(self.sig_set_failed)
+
+    def set(self, parameter_name: str, value: Any) -> None:
+        """
+        Schedules a SET. Must be called from the GUI thread.
+        :param parameter_name: The field to SET, in the form Device/Property#field
+        :param value: The new value of the field
+        :return: None
+        """
+        property_name, field_name = parameter_name.split("#")
+        self._pending.setdefault(property_name, {})[field_name] = value
+        timer = self._timers.get(property_name)
+        if timer is None:
+            timer = self._timers[property_name] = QTimer(self)
+            timer.setSingleShot(True)
+            timer.timeout.connect(lambda: self.flush(property_name))
+        # Don't restart a running window, or a continuous stream of edits would never be written
+        if not timer.isActive():
+            timer.start(self.window)
+
+    def flush(self, property_name: Optional[str] = None) -> None:
+        """
+        Writes the pending edits immediately, without waiting for their window to close.
+        :param property_name: The property to write (Device/Property). If None, all properties are written.
+        :return: None
+        """
+        property_names = [property_name] if property_name is not None else list(self._pending)
+        for name in property_names:
+            if name in self._timers:
+                self._timers[name].stop()
+            values = self._pending.pop(name, None)
+            if values:
+                self._async_japc.set(name, values)
+
+    def wait_for_done(self, timeout: int = -1) -> bool:
+        """
+        Blocks until all the SETs already started are completed.
+        :param timeout: How long to wait at most, in milliseconds (-1 waits forever)
+        :return: False if the timeout expired, True otherwise
+        """
+        return self._async_japc.wait_for_done(timeout)
+
+    def close(self) -> None:
+        """ Writes all the pending edits and waits for them to complete. """
+        self.flush()
+        self.wait_for_done()
@@ -0,0 +1,82 @@
+import logging
+from typing import Callable, Dict, Optional
+
+from PyQt5.QtCore import pyqtSlot
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QTabWidget, QWidget, QVBoxLayout, QLabel
+
+
+class LazyTabWidget(QTabWidget):
+    """
+    ``QTabWidget`` that creates the content of each tab only when the tab is shown for the first time.
+
+    Tabs are added with ``addLazyTab``, giving a function that creates their content instead of the content itself.
+    This way the application starts without building the tabs the user may never open, and without
+    starting their models and subscriptions.
+
+    When the user switches tab, the content of the tab being hidden is paused by calling its ``pause_updates()``
+    method, and the content of the tab being shown is resumed by calling its ``resume_updates()`` method.
+    Both methods are optional: widgets that don't define them are simply left alone.
+    """
+    def __init__(self, parent: Optional[QWidget] = None):
+        super(LazyTabWidget, self).__init__(parent)
+        # Maps each tab's container to the function creating its content, until the content is created
+        self._factories: Dict[QWidget, Callable[[], QWidget]] = {}
+        self._current_content: Optional[QWidget] = None
+        self.currentChanged.connect(self._current_tab_changed)
+
+    def addLazyTab(self, factory: Callable[[], QWidget], icon: QIcon, label: str) -> int:
+        """
+        Adds a tab whose content will be created the first time the tab is shown.
+        :param factory: a function with no arguments returning the content of the tab
+        :param icon: the icon of the tab
+        :param label: the label of the tab
+        :return: the index of the new tab
+        """
+        container = QWidget()
+        layout = QVBoxLayout(container)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self._factories[container] = factory
+        # NOTE: adding the first tab makes it current, so its content is created right away
+        return self.addTab(container, icon, label)
+
+    def tabContent(self, index: int) -> Optional[QWidget]:
+        """
+        :param index: the index of the tab
+        :return: the content of the tab, or None if it was not created yet
+        """
+        container = self.widget(index)
+        if container is None or container in self._factories or container.layout().count() == 0:
+            return None
+        return container.layout().itemAt(0).widget()
+
+    @pyqtSlot(int)
+    def _current_tab_changed(self, index: int) -> None:
+        """ Pauses the content of the tab that got hidden, creates or resumes the content of the tab shown. """
+        if self._current_content is not None and hasattr(self._current_content, "pause_updates"):
+            self._current_content.pause_updates()
+        self._current_content = None
+
+        container = self.widget(index)
+        if container is None:
+            return
+        factory = self._factories.pop(container, None)
+        if factory is not None:
+            self._create_content(container, factory)
+            # Newly created content is already running
+            self._current_content = self.tabContent(index)
+            return
+        self._current_content = self.tabContent(index)
+        if self._current_content is not None and hasattr(self._current_content, "resume_updates"):
+            self._current_content.resume_updates()
+
+    @staticmethod
+    def _create_content(container: QWidget, factory: Callable[[], QWidget]) -> None:
+        """ Creates the content of a tab. If it fails, an error message is shown in the tab instead. """
+        try:
+            content = factory()
+        except Exception as e:
+            logging.exception("Could not create the content of the tab")
+            content = QLabel("An Exception occurred while opening this tab:\n\n{}\n\n".format(e) +
+                             "See the logs for more information.")
+        container.layout().addWidget(content)
@@ -3,15 +3,33 @@ import sys
 import logging
 
 from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import QApplication, QMessageBox, QTabWidget
+from PyQt5.QtWidgets import QMessageBox, QWidget
 
-# Import the Presenters from the widgets folder of all the modules
-from demo.example_1_simple_form.widgets.main_widget import MainWidget as Example1Widget
-from demo.example_2_image.widgets.main_widget import MainWidget as Example2Widget
-from demo.example_3_plot.widgets.main_widget import MainWidget as Example3Widget
+# Import the tabs container that creates the tabs only when they are opened
+from demo.lazy_tab_widget import LazyTabWidget
 
 # Import the constants
 from demo.constants import APPLICATION_NAME, AUTHOR, EMAIL
+from demo.startup_profiling import profiler
+from demo.application import create_application
+
+
+# The Presenters from the widgets folder of all the modules are imported only when their tab is opened:
+# importing them can be expensive (for example, example 3 starts the papc simulation when imported)
+
+def create_example_1() -> QWidget:
+    from demo.example_1_simple_form.widgets.main_widget import MainWidget as Example1Widget
+    return Example1Widget()
+
+
+def create_example_2() -> QWidget:
+    from demo.example_2_image.widgets.main_widget import MainWidget as Example2Widget
+    return Example2Widget()
+
+
+def create_example_3() -> QWidget:
+    from demo.example_3_plot.widgets.main_widget import MainWidget as Example3Widget
+    return Example3Widget()
 
 
 def main():
@@ -20,24 +38,23 @@ def main():
         and the ApplicationFrame widgets, that will contain your GUI.
         Then loads your widgets into the main windows and shows it, entering the event loop.
     """
+    # Everything imported until now is part of the package import (see demo/startup_profiling.py)
+    profiler.end("Package import")
     logging.info("Starting up {}...".format(APPLICATION_NAME))
 
-    # Instantiate the QApplication
-    app = QApplication(sys.argv)
+    # Instantiate the QApplication (see demo/application.py)
+    app = create_application()
 
     # Create the tabs container
-    tabs = QTabWidget()
+    tabs = LazyTabWidget()
 
     try:
-        # Instantiate your GUIs (here all the widgets from the examples)
-        widget_1 = Example1Widget()
-        widget_2 = Example2Widget()
-        widget_3 = Example3Widget()
-
-        # Add the widgets to the window as tabs
-        tabs.addTab(widget_1, QIcon(), "Example 1 - Simple Form")
-        tabs.addTab(widget_2, QIcon(), "Example 2 - Image")
-        tabs.addTab(widget_3, QIcon(), "Example 3 - Plot")
+        # Add your GUIs to the window as tabs (here all the widgets from the examples).
+        # Each one is instantiated the first time its tab is opened.
+        with profiler.span("Create the tabs"):
+            tabs.addLazyTab(create_example_1, QIcon(), "Example 1 - Simple Form")
+            tabs.addLazyTab(create_example_2, QIcon(), "Example 2 - Image")
+            tabs.addLazyTab(create_example_3, QIcon(), "Example 3 - Plot")
 
         # Set the window title
         tabs.setWindowTitle(APPLICATION_NAME)
@@ -57,7 +74,10 @@ def main():
         return
 
     # Enter the event loop by showing the window
-    tabs.show()
+    with profiler.span("Show the window"):
+        tabs.show()
+    # Report the startup time, if requested with --profile-startup
+    profiler.finish()
 
     # Once left the event loop, terminates the application
     sys.exit(app.exec_())
@@ -0,0 +1,284 @@
+"""
+Declarative description of many simulated devices, created only when they are used.
+
+The simulated devices are listed in a data file, one row per field, with the columns:
+
+    device, property, kind, field, type, initial_value, equation, frequency, selector
+
+- ``kind`` is ``setting`` or ``acquisition``
+- ``equation`` (optional) computes the field from other fields, in the format of ``EquationFieldType``
+- ``frequency`` (optional, one row per device at most) updates the field with the current timestamp
+  at the given frequency, on the timing selector given in ``selector``, like ``IntervalUpdateDevice`` does
+
+Files can be CSV, JSON (a list of rows, as objects) or YAML (same as JSON). See ``devices.csv`` for an example.
+
+A device is instantiated only at the first GET, SET or subscription that targets it, so the devices
+that no panel uses never take memory nor timer ticks.
+"""
+import os
+import csv
+import json
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Sequence
+
+from papc.interfaces.pyjapc import SimulatedPyJapc
+from papc.system import System
+from papc.device import Device
+from papc.fieldtype import EquationFieldType, FieldType
+from papc.deviceproperty import Acquisition, Setting
+from papc.timingselector import TimingSelector
+
+from demo.papc_setup.papc_utils import IntervalUpdateDevice, track_subscriptions
+
+
+# The example catalogue: the TEST_DEVICE of create_my_devices() (see papc_devices.py), described as data
+DEFAULT_CATALOGUE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "devices.csv")
+
+# Timing selectors of all the devices of a catalogue, unless specified otherwise
+DEFAULT_TIMING_SELECTORS = ("", "LHC.USER.ALL")
+
+_PROPERTY_KINDS = {"setting": Setting, "acquisition": Acquisition}
+_VALUE_PARSERS = {"int": int, "float": float, "str": str, "bool": lambda value: value.lower() in ("1", "true", "yes")}
+
+
+def load_catalogue(path: str) -> Dict[str, List[dict]]:
+    """
+    Reads a catalogue file.
+    :param path: the path of a .csv, .json, .yml or .yaml file
+    :return: the rows of the catalogue, grouped by device name
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="") as catalogue_file:
+        if extension == ".csv":
+            rows = list(csv.DictReader(catalogue_file))
+        elif extension == ".json":
+            rows = json.load(catalogue_file)
+        elif extension in (".yml", ".yaml"):
+            # PyYAML is installed together with pyqt5ac, and imported only when needed
+            import yaml
+            rows = yaml.safe_load(catalogue_file)
+        else:
+            raise ValueError("Unknown catalogue format '{}': use a .csv, .json or .yaml file".format(path))
+
+    devices: Dict[str, List[dict]] = {}
+    for row in rows:
+        devices.setdefault(row["device"], []).append(row)
+    return devices
+
+
+def _initial_value(row: dict):
+    """ Converts the initial value of a row to the type of its field. CSV files only contain strings. """
+    value = row.get("initial_value")
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str):
+        return value
+    parser = _VALUE_PARSERS.get(row["type"])
+    return parser(value) if parser is not None else json.loads(value)
+
+
+def create_device(name: str, rows: List[dict], timing_selectors: Sequence[str] = DEFAULT_TIMING_SELECTORS) -> Device:
+    """
+    Instantiates a device from its rows of the catalogue.
+
+    Devices with a field updated at a given ``frequency`` are ``IntervalUpdateDevice``, whose equation fields
+    are computed together with all the devices ticking at the same frequency. The other devices are plain
+    ``Device``, and their equation fields are ``EquationFieldType``, computed at every read.
+    :param name: the name of the device
+    :param rows: the rows of the catalogue describing the device
+    :param timing_selectors: the timing selectors of the device
+    :return: the new device
+    """
+    ticking_rows = [row for row in rows if row.get("frequency")]
+    if len(ticking_rows) > 1:
+        raise ValueError("Device {} has more than one field with a frequency".format(name))
+
+    fields: Dict[str, List[FieldType]] = {}
+    kinds: Dict[str, type] = {}
+    equations: Dict[str, str] = {}
+    for row in rows:
+        kinds[row["property"]] = _PROPERTY_KINDS[row["kind"].lower()]
+        equation = row.get("equation")
+        if equation and not ticking_rows:
+            field = EquationFieldType(row["field"], row["type"], equation)
+        else:
+            if equation:
+                equations["{}#{}".format(row["property"], row["field"])] = equation
+            initial_value = _initial_value(row)
+            field = (FieldType(row["field"], row["type"], initial_value=initial_value) if initial_value is not None
+                     else FieldType(row["field"], row["type"]))
+        fields.setdefault(row["property"], []).append(field)
+
+    device_properties = tuple(kinds[property_name](property_name, tuple(property_fields))
+                              for property_name, property_fields in fields.items())
+    selectors = tuple(TimingSelector(selector) for selector in timing_selectors)
+    if not ticking_rows:
+        return Device(name=name, device_properties=device_properties, timing_selectors=selectors)
+
+    ticking_row = ticking_rows[0]
+    return IntervalUpdateDevice(
+        name=name,
+        device_properties=device_properties,
+        field_to_update="{}#{}".format(ticking_row["property"], ticking_row["field"]),
+        selector_to_update=TimingSelector(ticking_row.get("selector") or timing_selectors[-1]),
+        timing_selectors=selectors,
+        frequency=float(ticking_row["frequency"]),
+        equations=equations,
+    )
+
+
+class DeviceCatalogue:
+    """
+    Creates the devices of a catalogue the first time they are needed, each one in its own papc ``System``.
+
+    Like ``setup_papc_devices()``, the state of each device is saved right after its creation,
+    and ``restore()`` sets all the devices created so far back to it.
+    """
+    def __init__(self, rows: Dict[str, List[dict]], timing_selectors: Sequence[str] = DEFAULT_TIMING_SELECTORS):
+        """
+        :param rows: the rows of the catalogue, grouped by device name (see ``load_catalogue``)
+        :param timing_selectors: the timing selectors of all the devices
+        """
+        self._rows = rows
+        self.timing_selectors = tuple(timing_selectors)
+        self._systems: Dict[str, System] = {}
+        self._devices: Dict[str, Device] = {}
+        self._snapshots: Dict[str, dict] = {}
+        self._lock = Lock()
+
+    @classmethod
+    def from_file(cls, path: str, timing_selectors: Sequence[str] = DEFAULT_TIMING_SELECTORS) -> 'DeviceCatalogue':
+        """ Creates the catalogue described in the given file (see ``load_catalogue``). """
+        return cls(load_catalogue(path), timing_selectors)
+
+    def device_names(self) -> List[str]:
+        """ Returns the names of all the devices of the catalogue, created or not. """
+        return list(self._rows)
+
+    def created_devices(self) -> List[Device]:
+        """ Returns the devices created so far. """
+        return list(self._devices.values())
+
+    def system(self, device_name: str) -> System:
+        """
+        Returns the papc System simulating the given device, creating the device if needed.
+        :param device_name: the name of the device
+        :return: a System containing only that device
+        """
+        with self._lock:
+            system = self._systems.get(device_name)
+            if system is None:
+                if device_name not in self._rows:
+                    raise KeyError("Device {} is not in the catalogue".format(device_name))
+                device = create_device(device_name, self._rows[device_name], self.timing_selectors)
+                if isinstance(device, IntervalUpdateDevice):
+                    self._snapshots[device_name] = device.snapshot()
+                self._devices[device_name] = device
+                system = self._systems[device_name] = System(devices=[device])
+            return system
+
+    def restore(self) -> None:
+        """ Brings all the devices created so far back to their initial state. """
+        for device_name, snapshot in self._snapshots.items():
+            self._devices[device_name].restore(snapshot)
+
+    def stop(self) -> None:
+        """ Stops the timers of all the devices created so far, and forgets them. """
+        with self._lock:
+            for device in self._devices.values():
+                if isinstance(device, IntervalUpdateDevice):
+                    device.stop()
+            self._systems.clear()
+            self._devices.clear()
+            self._snapshots.clear()
+
+    def pyjapc_factory(self) -> Callable:
+        """
+        :return: a PyJAPC-like factory, to monkeypatch ``pyjapc.PyJapc``. Its connectors record their
+            subscriptions like the ones of ``setup_papc_devices()``.
+        """
+        return track_subscriptions(lambda *args, **kwargs: LazyPyJapc(self, *args, **kwargs))
+
+
+class LazyPyJapc:
+    """
+    PyJAPC-like connector to the devices of a ``DeviceCatalogue``.
+
+    It holds one ``SimulatedPyJapc`` per device, created (together with the device) at the first
+    call that targets the device, and forwards each call to the connector of the right device.
+    Calls that are not about one parameter, like ``setSelector()`` or ``stopSubscriptions()``
+    without a parameter name, are forwarded to all the connectors created so far.
+    """
+    def __init__(self, catalogue: DeviceCatalogue, *args, **kwargs):
+        self._catalogue = catalogue
+        # Arguments for the connectors of each device
+        self._args = args
+        self._kwargs = kwargs
+        self._selector_args: Optional[tuple] = None
+        self._connectors: Dict[str, SimulatedPyJapc] = {}
+
+    def _connector(self, parameter_name: str) -> SimulatedPyJapc:
+        """ Returns the connector of the device of the given Device/Property#field, creating it if needed. """
+        device_name = parameter_name.split("/")[0]
+        connector = self._connectors.get(device_name)
+        if connector is None:
+            system = self._catalogue.system(device_name)
+            connector = SimulatedPyJapc.from_simulation_factory(lambda: system, strict=False)(*self._args,
+                                                                                             **self._kwargs)
+            if self._selector_args is not None:
+                connector.setSelector(*self._selector_args[0], **self._selector_args[1])
+            self._connectors[device_name] = connector
+        return connector
+
+    def _forward(self, method_name: str, parameterName=None, *args, **kwargs):
+        """ Calls the given method on the connector of the parameter, or on all connectors if there is none. """
+        if parameterName is not None:
+            return getattr(self._connector(parameterName), method_name)(parameterName, *args, **kwargs)
+        for connector in list(self._connectors.values()):
+            getattr(connector, method_name)(*args, **kwargs)
+
+    def setSelector(self, *args, **kwargs):
+        self._selector_args = (args, kwargs)
+        for connector in self._connectors.values():
+            connector.setSelector(*args, **kwargs)
+
+    def getParam(self, parameterName, *args, **kwargs):
+        return self._connector(parameterName).getParam(parameterName, *args, **kwargs)
+
+    def setParam(self, parameterName, *args, **kwargs):
+        return self._connector(parameterName).setParam(parameterName, *args, **kwargs)
+
+    def subscribeParam(self, parameterName, *args, **kwargs):
+        return self._connector(parameterName).subscribeParam(parameterName, *args, **kwargs)
+
+    def startSubscriptions(self, parameterName=None, *args, **kwargs):
+        return self._forward("startSubscriptions", parameterName, *args, **kwargs)
+
+    def stopSubscriptions(self, parameterName=None, *args, **kwargs):
+        return self._forward("stopSubscriptions", parameterName, *args, **kwargs)
+
+    def clearSubscriptions(self, parameterName=None, *args, **kwargs):
+        return self._forward("clearSubscriptions", parameterName, *args, **kwargs)
+
+
+# The catalogues loaded by setup_papc_catalogue(), by path
+_catalogues: Dict[str, DeviceCatalogue] = {}
+
+
+def setup_papc_catalogue(path: str = DEFAULT_CATALOGUE, rebuild: bool = False) -> Callable:
+    """
+    Sets up the JAPC simulation environment with the devices listed in a catalogue file.
+    Works like ``setup_papc_devices()``, but the devices are created only when used.
+    :param path: the catalogue file (see ``load_catalogue``)
+    :param rebuild: if True, the devices created so far are stopped, and the catalogue is read again
+    :return: a PyJAPC-like factory, to monkeypatch ``pyjapc.PyJapc``
+    """
+    path = os.path.realpath(path)
+    if rebuild and path in _catalogues:
+        _catalogues.pop(path).stop()
+    catalogue = _catalogues.get(path)
+    if catalogue is None:
+        catalogue = _catalogues[path] = DeviceCatalogue.from_file(path)
+    else:
+        catalogue.restore()
+    return catalogue.pyjapc_factory()
@@ -1,33 +1,92 @@
-from typing import List
+from typing import Dict, List, Optional
 from papc.interfaces.pyjapc import SimulatedPyJapc
 from papc.system import System
 from papc.device import Device
-from papc.fieldtype import FieldType, EquationFieldType
+from papc.fieldtype import FieldType
 from papc.deviceproperty import Acquisition, Setting
 from papc.timingselector import TimingSelector
 
-from demo.papc_setup.papc_utils import IntervalUpdateDevice
+from demo.papc_setup.papc_utils import IntervalUpdateDevice, track_subscriptions
 
 
-def setup_papc_devices() -> SimulatedPyJapc:
+class _CachedSystem:
+    """
+    The papc System built by ``setup_papc_devices()``, together with the state of its devices right after
+    their creation. Building the devices is slow and starts their timers, so it's done once per process:
+    later calls only restore the saved state.
+    """
+    def __init__(self, devices: List[Device]):
+        self.devices = devices
+        self.system = System(devices=devices)
+        self.snapshots: Dict[Device, dict] = {device: device.snapshot() for device in devices
+                                              if isinstance(device, IntervalUpdateDevice)}
+
+    def restore(self) -> None:
+        """ Brings all the devices back to their initial state. """
+        for device, snapshot in self.snapshots.items():
+            device.restore(snapshot)
+
+    def stop(self) -> None:
+        """ Stops the timers of all the devices. """
+        for device in self.devices:
+            if isinstance(device, IntervalUpdateDevice):
+                device.stop()
+
+
+_cached_system: Optional[_CachedSystem] = None
+
+
+def setup_papc_devices(rebuild: bool = False) -> SimulatedPyJapc:
     """
     This function sets up the JAPC simulation environment using papc.
+
+    The simulated devices are created only the first time this function is called.
+    The following calls reuse them, after setting all their fields back to their initial values,
+    so each call (for example, one per test) starts from the same state.
+    :param rebuild: if True, the devices are created again, and the timers of the old ones are stopped
+    :return: a PyJAPC-like factory, to monkeypatch ``pyjapc.PyJapc``
     """
-    # Creates the hierarchy of simulated objects (devices, properties, fields, selectors...)
-    list_of_devices = create_my_devices()
+    global _cached_system
+    if rebuild and _cached_system is not None:
+        _cached_system.stop()
+        _cached_system = None
 
-    # Instantiates a papc System (interface for a group of devices)
-    my_system = System(devices=list_of_devices)
+    if _cached_system is None:
+        # Creates the hierarchy of simulated objects (devices, properties, fields, selectors...)
+        # and instantiates a papc System (interface for a group of devices)
+        _cached_system = _CachedSystem(create_my_devices())
+    else:
+        reset_papc_devices()
+    my_system = _cached_system.system
 
     # Create a JAPC-like interface for the System above.
     # This interface can be used to monkeypatch (replace at runtime) a JAPC instance.
-    return SimulatedPyJapc.from_simulation_factory(lambda: my_system, strict=False)
+    # Its subscriptions are tracked, so that devices nobody listens to can skip part of their updates.
+    return track_subscriptions(SimulatedPyJapc.from_simulation_factory(lambda: my_system, strict=False))
+
+
+def reset_papc_devices() -> None:
+    """ Brings the simulated devices back to their initial state, if they were created. """
+    if _cached_system is not None:
+        _cached_system.restore()
+
+
+def teardown_papc_devices() -> None:
+    """ Stops the timers of the simulated devices and forgets them. The next setup will create new ones. """
+    global _cached_system
+    if _cached_system is not None:
+        _cached_system.stop()
+        _cached_system = None
 
 
 def create_my_devices() -> List[Device]:
     """
     This function describes in detail how to simulate a JAPC device
     and instantiates the hierarchy of objects required for the simulation.
+
+    To simulate many devices, describe them in a data file instead, like ``devices.csv``,
+    and create them only when they are used with ``setup_papc_catalogue()`` (see ``papc_catalogue.py``).
+
     You can find more information regarding papc simulations
     on the Acc-Py wikis:
     https://wikis.cern.ch/display/ACCPY/papc+-+a+pure+Python+PyJapc+offline+simulator
@@ -43,11 +102,13 @@ def create_my_devices() -> List[Device]:
             FieldType("period_cos", "int", initial_value=50),
             FieldType("theta", "float", initial_value=0)
         )),
+        # The fields of this property depend on the Settings: their equations are given to the device below.
+        # For a few devices you can also use papc.fieldtype.EquationFieldType, like:
+        #   EquationFieldType('sin', 'float', 'sin({Settings#theta}/({Settings#period_sin}/30))*{Settings#amplitude_sin}')
+        # but its equation is evaluated separately at every read, for every field of every device.
         Acquisition('Acquisition', (
-            EquationFieldType('sin', 'float',
-                              'sin({Settings#theta}/({Settings#period_sin}/30))*{Settings#amplitude_sin}'),
-            EquationFieldType('cos', 'float',
-                              'cos({Settings#theta}/({Settings#period_cos}/30))*{Settings#amplitude_cos}'),
+            FieldType('sin', 'float', initial_value=0.0),
+            FieldType('cos', 'float', initial_value=0.0),
         )),
         # Next PAPC release will enable these fields too
         # Command('systemOn', (), start_the_device),
@@ -60,7 +121,12 @@ def create_my_devices() -> List[Device]:
                         field_to_update="Settings#theta",
                         selector_to_update=TimingSelector("LHC.USER.ALL"),
                         timing_selectors=(TimingSelector(""), TimingSelector("LHC.USER.ALL")),
-                        frequency=30
+                        frequency=30,
+                        # Computed at every tick, in one vectorized pass with all the devices ticking at 30Hz
+                        equations={
+                            'Acquisition#sin': 'sin({Settings#theta}/({Settings#period_sin}/30))*{Settings#amplitude_sin}',
+                            'Acquisition#cos': 'cos({Settings#theta}/({Settings#period_cos}/30))*{Settings#amplitude_cos}',
+                        }
                     )
     return [device]
 
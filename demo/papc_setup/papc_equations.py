@@ -0,0 +1,170 @@
+import re
+from threading import Lock
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from papc.device import Device
+
+
+# Placeholders look like {Property#field}
+_PLACEHOLDER = re.compile(r"\{([^{}]+)\}")
+
+# Names that equations can use, all working on whole NumPy arrays at once
+_EQUATION_NAMESPACE = {
+    "__builtins__": {},
+    "pi": np.pi, "e": np.e,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan,
+    "asin": np.arcsin, "acos": np.arccos, "atan": np.arctan, "atan2": np.arctan2,
+    "sinh": np.sinh, "cosh": np.cosh, "tanh": np.tanh,
+    "exp": np.exp, "log": np.log, "log10": np.log10, "sqrt": np.sqrt,
+    "abs": np.abs, "floor": np.floor, "ceil": np.ceil, "min": np.minimum, "max": np.maximum,
+}
+
+
+class CompiledEquation:
+    """
+    An equation in the format of papc's ``EquationFieldType``, for example
+    ``'sin({Settings#theta}/({Settings#period_sin}/30))*{Settings#amplitude_sin}'``,
+    parsed and compiled once into a NumPy expression.
+
+    ``evaluate`` takes one array per input field, so the equation is computed
+    for any number of devices in a single call.
+    """
+    def __init__(self, equation: str):
+        self.equation = equation
+        # The fields the equation depends on, each one listed once, in order of appearance
+        self.inputs: List[str] = list(dict.fromkeys(_PLACEHOLDER.findall(equation)))
+        expression = _PLACEHOLDER.sub(lambda match: "_in{}".format(self.inputs.index(match.group(1))), equation)
+        self._code = compile(expression, "<equation {}>".format(equation), "eval")
+
+    def evaluate(self, *inputs: np.ndarray) -> np.ndarray:
+        """
+        :param inputs: the values of the input fields, in the order of ``self.inputs``
+        :return: the values of the equation
+        """
+        variables = {"_in{}".format(i): np.asarray(values, dtype=float) for i, values in enumerate(inputs)}
+        return eval(self._code, _EQUATION_NAMESPACE, variables)
+
+
+class EquationBackend:
+    """
+    Computes the equation fields of many simulated devices together.
+
+    Instead of using ``EquationFieldType``, which evaluates its equation every time the field is read,
+    devices declare their equation fields as plain ``FieldType`` and register the equations here.
+    At each ``evaluate()``, every equation is computed once for all the devices using it, in a single
+    vectorized pass, and each device then receives all its new values with a single ``set_state``,
+    which notifies the subscribers as usual.
+    """
+    def __init__(self):
+        # Each equation is parsed once, however many devices use it
+        self._compiled: Dict[str, CompiledEquation] = {}
+        # (device, selector) -> {field: compiled equation}
+        self._devices: Dict[Tuple[Device, object], Dict[str, CompiledEquation]] = {}
+        # (device, selector) -> group
+        self._groups: Dict[Tuple[Device, object], Hashable] = {}
+        # The (device, selector) pairs skipped by the last evaluate(), whose fields are outdated
+        self._outdated = set()
+        self._lock = Lock()
+
+    def register(self, device: Device, selector, equations: Dict[str, str],
+                 group: Optional[Hashable] = None) -> None:
+        """
+        Registers the equation fields of a device.
+        :param device: the simulated device
+        :param selector: the ``TimingSelector`` the fields are computed for
+        :param equations: maps the equation fields (Property#field) to their equations
+        :param group: any label, to update only some of the devices with ``evaluate(group)``
+            (for example the devices updated at the same frequency)
+        :return: None
+        """
+        with self._lock:
+            self._groups[(device, selector)] = group
+            fields = self._devices.setdefault((device, selector), {})
+            for field_name, equation in equations.items():
+                if equation not in self._compiled:
+                    self._compiled[equation] = CompiledEquation(equation)
+                fields[field_name] = self._compiled[equation]
+
+    def unregister(self, device: Device) -> None:
+        """ Stops computing the equation fields of a device. """
+        with self._lock:
+            for key in [key for key in self._devices if key[0] is device]:
+                del self._devices[key]
+                del self._groups[key]
+                self._outdated.discard(key)
+
+    def device_count(self, group: Optional[Hashable] = None) -> int:
+        """ Returns how many devices are registered in the given group, or in total if group is None. """
+        with self._lock:
+            return len({device for (device, _), device_group in self._groups.items()
+                        if group is None or device_group == group})
+
+    def evaluate(self, group: Optional[Hashable] = None,
+                 skip: Optional[Callable[[Device, List[str]], bool]] = None) -> None:
+        """
+        Computes the equation fields of the registered devices and stores the results in the devices.
+        :param group: the group of devices to update, as given to ``register``. If None, all devices are updated.
+        :param skip: called as ``skip(device, field_names)``, returns True for the devices that don't need
+            to be updated now (for example, because nobody is subscribed to them). Their fields are updated
+            only when ``refresh`` is called.
+        :return: None
+        """
+        with self._lock:
+            entries = []
+            for key, fields in self._devices.items():
+                if group is not None and self._groups[key] != group:
+                    continue
+                if skip is not None and skip(key[0], list(fields)):
+                    self._outdated.add(key)
+                    continue
+                self._outdated.discard(key)
+                entries.append((key, fields))
+        self._evaluate(entries)
+
+    def refresh(self, device_name: str) -> None:
+        """
+        Updates the fields of the given device, if they were skipped by the last ``evaluate()``.
+        Call it before reading the fields of a device.
+        :param device_name: the name of the device
+        :return: None
+        """
+        with self._lock:
+            if not self._outdated:
+                return
+            entries = [(key, self._devices[key]) for key in self._outdated if key[0].name == device_name]
+            self._outdated.difference_update(key for key, _ in entries)
+        self._evaluate(entries)
+
+    @staticmethod
+    def _evaluate(entries: List[Tuple[Tuple[Device, object], Dict[str, CompiledEquation]]]) -> None:
+        """ Computes and stores the fields of the given (device, selector) pairs. """
+        if not entries:
+            return
+
+        # Read all the inputs of each device with a single call
+        states = []
+        for (device, selector), fields in entries:
+            input_names = {name for equation in fields.values() for name in equation.inputs}
+            states.append(device.get_state(list(input_names), selector))
+
+        # Group the devices by equation, and evaluate each equation once
+        users: Dict[CompiledEquation, List[Tuple[int, str]]] = {}
+        for index, (_, fields) in enumerate(entries):
+            for field_name, equation in fields.items():
+                users.setdefault(equation, []).append((index, field_name))
+        new_values: List[Dict[str, float]] = [{} for _ in entries]
+        for equation, equation_users in users.items():
+            inputs = [[states[index][name] for index, _ in equation_users] for name in equation.inputs]
+            results = np.broadcast_to(equation.evaluate(*inputs), (len(equation_users),))
+            for (index, field_name), result in zip(equation_users, results):
+                new_values[index][field_name] = float(result)
+
+        # Store all the new values of each device at once
+        for ((device, selector), _), values in zip(entries, new_values):
+            device.set_state(values, selector)
+
+
+# The backend shared by all the simulated devices
+equation_backend = EquationBackend()
@@ -1,56 +1,467 @@
 import time
-import datetime
-from threading import Event, Thread
+import heapq
+import bisect
+import logging
+import itertools
+from collections import Counter
+from threading import Condition, Lock, Thread
+from typing import Callable, Dict, List, Optional, Tuple
 
 from papc.device import Device
 
+from demo.papc_setup.papc_equations import equation_backend
+
 
 class IntervalUpdateDevice(Device):
     """
         Subclass of ``Device`` that updates one of its fields at a specified frequency.
         You can subclass ``Device`` to implement any behavior you might want to simulate.
+
+        Fields depending on other fields can be given as ``equations``, in the same format used by
+        ``EquationFieldType``: declare them as plain ``FieldType`` instead, and they will be recomputed
+        after every tick, together with the same fields of all the devices ticking at the same frequency.
     """
-    def __init__(self, field_to_update, selector_to_update, frequency=30, *args, **kwargs):
+    def __init__(self, field_to_update, selector_to_update, frequency=30, *args,
+                 equations: Optional[Dict[str, str]] = None, **kwargs):
         # Take out the `frequency` argument from the kwargs, or default to 30Hz
         self.field_to_update = field_to_update
         self.selector_to_update = selector_to_update
+        # Reused at every tick, instead of building a new dictionary each time
+        self._tick_state = {field_to_update: 0.0}
         super().__init__(*args, **kwargs)
-        # Start the internal timer (RepeatedTimer is defined below)
-        self.timer = RepeatedTimer(1 / frequency, self.time_tick)
+        # The fields and selectors saved by ``snapshot()``
+        self._snapshot_fields = ["{}#{}".format(device_property.name, field.name)
+                                 for device_property in kwargs.get("device_properties", ())
+                                 for field in device_property.fields]
+        self._snapshot_selectors = tuple(kwargs.get("timing_selectors", (selector_to_update, )))
+        # Start the internal timer (ScheduledTimer is defined below)
+        self.timer = ScheduledTimer(1 / frequency, self.time_tick)
+        # Compute the equation fields in a single vectorized pass for all the devices of this frequency
+        if equations:
+            equation_backend.register(self, selector_to_update, equations, group=self.timer.interval)
+            # Devices that nobody subscribed to are skipped, and updated only when read
+            tick_scheduler.add_hook(self.timer.interval, equation_backend.evaluate, self.timer.interval,
+                                    has_no_subscribers)
 
     def time_tick(self):
         """ Callback executed at each tick of the timer """
-        now = datetime.datetime.now()
-        t = time.mktime(now.timetuple()) + now.microsecond / 1e6
         # Set the given field with the current timestamp
-        self.set_state({self.field_to_update: t}, self.selector_to_update)
+        self._tick_state[self.field_to_update] = time.time()
+        self.set_state(self._tick_state, self.selector_to_update)
+
+    def snapshot(self) -> Dict[object, Dict[str, object]]:
+        """
+        Saves the values of all the fields of the device, to bring it back to this state later with ``restore()``.
+        :return: the values of the fields, for each timing selector
+        """
+        return {selector: dict(self.get_state(self._snapshot_fields, selector))
+                for selector in self._snapshot_selectors}
+
+    def restore(self, snapshot: Dict[object, Dict[str, object]]) -> None:
+        """
+        Sets all the fields of the device back to the values saved by ``snapshot()``.
+        :param snapshot: the value returned by ``snapshot()``
+        :return: None
+        """
+        for selector, values in snapshot.items():
+            self.set_state(values, selector)
+
+    def stop(self) -> None:
+        """ Stops updating the device for good: its timer is stopped and its equations are not computed anymore. """
+        self.timer.stop()
+        equation_backend.unregister(self)
+        if not equation_backend.device_count(group=self.timer.interval):
+            tick_scheduler.remove_hook(self.timer.interval, equation_backend.evaluate, self.timer.interval,
+                                       has_no_subscribers)
+
+
+class SubscriptionRegistry:
+    """
+    Keeps track of the device properties that have subscribers, so that simulated devices
+    can skip the work whose results nobody would receive. It is filled by the PyJAPC
+    connectors wrapped with ``track_subscriptions``.
+    """
+    def __init__(self):
+        # Number of subscriptions for each "Device/Property"
+        self._counts = Counter()
+        self._lock = Lock()
 
+    @staticmethod
+    def _property_of(parameter_name: str) -> str:
+        return parameter_name.split("#")[0]
 
-class RepeatedTimer:
+    def add(self, parameter_name: str) -> None:
+        """ Records a subscription to the given Device/Property or Device/Property#field. """
+        with self._lock:
+            self._counts[self._property_of(parameter_name)] += 1
+
+    def remove(self, parameter_name: str) -> None:
+        """ Records the removal of a subscription added with ``add``. """
+        with self._lock:
+            key = self._property_of(parameter_name)
+            self._counts[key] -= 1
+            if self._counts[key] <= 0:
+                del self._counts[key]
+
+    def is_subscribed(self, device_name: str, property_name: str) -> bool:
+        """ Returns whether anybody is subscribed to the given property (or to any of its fields). """
+        return "{}/{}".format(device_name, property_name) in self._counts
+
+
+# The registry of all the subscriptions to simulated devices
+subscription_registry = SubscriptionRegistry()
+
+
+def has_no_subscribers(device: Device, field_names: List[str]) -> bool:
+    """ Returns True if nobody is subscribed to any of the given fields (Property#field) of the device. """
+    return not any(subscription_registry.is_subscribed(device.name, field_name.split("#")[0])
+                   for field_name in field_names)
+
+
+def track_subscriptions(japc_factory: Callable) -> Callable:
+    """
+    Wraps a PyJAPC-like factory (like ``SimulatedPyJapc``) so that the connectors it creates
+    record their subscriptions in ``subscription_registry``, and bring the equation fields of
+    a device up to date before reading them.
+    :param japc_factory: the callable creating the PyJAPC-like connectors
+    :return: a callable creating the wrapped connectors
+    """
+    def create(*args, **kwargs):
+        japc = japc_factory(*args, **kwargs)
+        subscribe_param, clear_subscriptions, get_param = japc.subscribeParam, japc.clearSubscriptions, japc.getParam
+        subscribed: List[str] = []
+
+        def subscribeParam(parameterName, *subscribe_args, **subscribe_kwargs):
+            subscription_registry.add(parameterName)
+            subscribed.append(parameterName)
+            return subscribe_param(parameterName, *subscribe_args, **subscribe_kwargs)
+
+        def clearSubscriptions(parameterName=None, *clear_args, **clear_kwargs):
+            for name in [name for name in subscribed if parameterName is None or name == parameterName]:
+                subscription_registry.remove(name)
+                subscribed.remove(name)
+            return clear_subscriptions(parameterName, *clear_args, **clear_kwargs)
+
+        def getParam(parameterName, *get_args, **get_kwargs):
+            equation_backend.refresh(parameterName.split("/")[0])
+            return get_param(parameterName, *get_args, **get_kwargs)
+
+        japc.subscribeParam, japc.clearSubscriptions, japc.getParam = subscribeParam, clearSubscriptions, getParam
+        return japc
+    return create
+
+
+# What a timer does when its callback was too slow and some ticks could not run on time
+SKIP_MISSED_TICKS = "skip"          # Forget the missed ticks, and tick again at the next deadline
+CATCH_UP_MISSED_TICKS = "catch_up"  # Run the missed ticks back-to-back, until the timer is on time again
+
+
+class TimerStatistics:
+    """
+    Collects timing statistics about the ticks of a timer, and can be queried at any time with ``snapshot()``.
+
+    For each tick it records how late the callback started (jitter) and how long it ran. Ticks whose callback
+    ran longer than the timer interval are counted as overruns, and ticks that were dropped to catch up
+    with the schedule are counted as skipped. Callback durations are also counted in a histogram.
+    """
+    # Upper bounds (in seconds) of the buckets of the duration histogram. The last bucket has no upper bound.
+    DURATION_BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """ Forgets all the statistics collected so far. """
+        with self._lock:
+            self._ticks = 0
+            self._overruns = 0
+            self._skipped = 0
+            self._lateness_sum = 0.0
+            self._lateness_max = 0.0
+            self._duration_sum = 0.0
+            self._duration_max = 0.0
+            self._histogram = [0] * (len(self.DURATION_BUCKETS) + 1)
+
+    def record(self, lateness: float, duration: float, skipped: int = 0) -> None:
+        """
+        Records one tick.
+        :param lateness: how late (in seconds) the callback started, with respect to its deadline
+        :param duration: how long (in seconds) the callback ran
+        :param skipped: how many ticks were dropped before this one
+        :return: None
+        """
+        lateness = max(lateness, 0.0)
+        with self._lock:
+            self._ticks += 1
+            self._skipped += skipped
+            if duration > self.interval:
+                self._overruns += 1
+            self._lateness_sum += lateness
+            self._lateness_max = max(self._lateness_max, lateness)
+            self._duration_sum += duration
+            self._duration_max = max(self._duration_max, duration)
+            self._histogram[bisect.bisect_left(self.DURATION_BUCKETS, duration)] += 1
+
+    def snapshot(self) -> dict:
+        """
+        :return: a dictionary with the statistics collected so far. Times are in seconds, and the duration
+            histogram maps the upper bound of each bucket (None for the last one) to its number of ticks.
+        """
+        with self._lock:
+            ticks = max(self._ticks, 1)
+            return {
+                "interval": self.interval,
+                "ticks": self._ticks,
+                "overruns": self._overruns,
+                "skipped": self._skipped,
+                "mean_lateness": self._lateness_sum / ticks,
+                "max_lateness": self._lateness_max,
+                "mean_duration": self._duration_sum / ticks,
+                "max_duration": self._duration_max,
+                "duration_histogram": dict(zip(self.DURATION_BUCKETS + (None, ), self._histogram)),
+            }
+
+
+class _TickGroup:
+    """
+    All the timers of a ``TickScheduler`` sharing the same interval: they are ticked together.
+    Hooks are called once after each tick of the whole group.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.timers: List['ScheduledTimer'] = []
+        self.hooks: List[Tuple[Callable, tuple]] = []
+
+
+class TickScheduler:
+    """
+    Drives any number of recurrent timers from a single thread.
+
+    Timers with the same interval are grouped and ticked together. The next deadline of each
+    group is kept in a heap, and the thread sleeps until the earliest one. Deadlines are computed
+    from the start of the group, so ticks don't drift. Ticks missed because callbacks were too slow
+    are skipped or run back-to-back, according to the ``missed_ticks`` of each timer: when one timer
+    of a group catches up, the group runs its missed ticks back-to-back, and its timers that skip
+    missed ticks are only called once the group is on time again.
+    Each timer records its timing statistics in its ``statistics`` attribute.
+
+    In manual mode (see ``set_manual``) the thread stops ticking, and the timers tick only when
+    ``step()`` is called: tests use it to control the simulated time instead of waiting for the clock.
+    """
+    def __init__(self):
+        self.manual = False
+        self._groups: Dict[float, _TickGroup] = {}
+        # Entries are (deadline, insertion order, group): the insertion order avoids comparing groups
+        self._heap: List[Tuple[float, int, _TickGroup]] = []
+        self._counter = itertools.count()
+        self._condition = Condition()
+        # Held while ticking, so that the thread and step() never tick at the same time
+        self._tick_lock = Lock()
+        self._thread: Optional[Thread] = None
+
+    def add(self, timer: 'ScheduledTimer') -> None:
+        """ Starts ticking the given timer. """
+        with self._condition:
+            self._group(timer.interval).timers.append(timer)
+
+    def remove(self, timer: 'ScheduledTimer') -> None:
+        """ Stops ticking the given timer. """
+        with self._condition:
+            group = self._groups.get(timer.interval)
+            if group is None or timer not in group.timers:
+                return
+            group.timers.remove(timer)
+            self._forget_if_empty(group)
+
+    def add_hook(self, interval: float, function: Callable, *args) -> None:
+        """
+        Calls ``function(*args)`` after each tick of the timers with the given interval.
+        Adding the same hook twice has no effect.
+        """
+        with self._condition:
+            group = self._group(interval)
+            if (function, args) not in group.hooks:
+                group.hooks.append((function, args))
+
+    def remove_hook(self, interval: float, function: Callable, *args) -> None:
+        """ Removes a hook added with ``add_hook``. """
+        with self._condition:
+            group = self._groups.get(interval)
+            if group is None or (function, args) not in group.hooks:
+                return
+            group.hooks.remove((function, args))
+            self._forget_if_empty(group)
+
+    def _group(self, interval: float) -> _TickGroup:
+        """ Returns the group of the given interval, scheduling it if new. Call it holding the lock. """
+        group = self._groups.get(interval)
+        if group is None:
+            group = self._groups[interval] = _TickGroup(interval)
+            heapq.heappush(self._heap, (time.monotonic() + interval, next(self._counter), group))
+            self._condition.notify()
+        if self._thread is None:
+            self._thread = Thread(target=self._target, name="TickScheduler")
+            self._thread.daemon = True
+            self._thread.start()
+        return group
+
+    def _forget_if_empty(self, group: _TickGroup) -> None:
+        """ Removes a group with no timers and no hooks. Call it holding the lock. """
+        if not group.timers and not group.hooks:
+            # Its entry in the heap is dropped when it comes due
+            del self._groups[group.interval]
+
+    def timer_count(self) -> int:
+        """ Returns how many timers are being ticked. """
+        with self._condition:
+            return sum(len(group.timers) for group in self._groups.values())
+
+    def set_manual(self, manual: bool) -> None:
+        """
+        Switches the manual mode on or off. In manual mode, the timers tick only when ``step()`` is called.
+        When it's switched off, the timers start ticking again one interval later.
+        """
+        with self._condition:
+            self.manual = manual
+            if not manual:
+                now = time.monotonic()
+                self._heap = [(now + group.interval, next(self._counter), group) for group in self._groups.values()]
+                heapq.heapify(self._heap)
+            self._condition.notify()
+        # Returns once the tick in progress, if any, is over
+        with self._tick_lock:
+            pass
+
+    def step(self, ticks: int = 1, interval: Optional[float] = None, missed: int = 0) -> None:
+        """
+        Ticks the timers right away, in the calling thread, together with their hooks.
+        :param ticks: how many times to tick them
+        :param interval: if given, only the timers with this interval tick
+        :param missed: how many deadlines to consider missed before each tick, as if a callback had been
+            too slow: the timers skip them or catch them up, like they do when driven by the thread
+        :return: None
+        """
+        for _ in range(ticks):
+            with self._condition:
+                groups = [(group.interval, list(group.timers), list(group.hooks)) for group in self._groups.values()
+                          if interval is None or group.interval == interval]
+            with self._tick_lock:
+                for group_interval, timers, hooks in groups:
+                    now = time.monotonic()
+                    # A group catching up runs each missed tick on its own, the others run only the last one
+                    for behind in (range(missed, -1, -1) if self._catches_up(timers) else (missed, )):
+                        self._tick(now - behind * group_interval, behind, timers, hooks)
+
+    def _target(self):
+        while True:
+            deadline, skipped, timers, hooks = self._next_group()
+            with self._tick_lock:
+                # The manual mode may have been switched on while waiting for the lock
+                if not self.manual:
+                    self._tick(deadline, skipped, timers, hooks)
+
+    def _tick(self, deadline: float, behind: int, timers: List['ScheduledTimer'],
+              hooks: List[Tuple[Callable, tuple]]) -> None:
+        """
+        Calls the timers of a group, recording their statistics, then the hooks of the group.
+        :param deadline: when the tick was due
+        :param behind: how many more deadlines of the group have passed since then
+        :param timers: the timers of the group
+        :param hooks: the hooks of the group
+        :return: None
+        """
+        catching_up = self._catches_up(timers)
+        for timer in timers:
+            if timer.missed_ticks == SKIP_MISSED_TICKS:
+                if catching_up and behind > 0:
+                    # The group runs a late tick: this timer waits for the group to be on time again
+                    timer.skipped_ticks += 1
+                    continue
+                skipped = timer.skipped_ticks + (0 if catching_up else behind)
+                timer.skipped_ticks = 0
+            else:
+                skipped = 0
+            started = time.monotonic()
+            self._call(timer.function, timer.args, timer.kwargs)
+            finished = time.monotonic()
+            timer.statistics.record(started - deadline, finished - started, skipped=skipped)
+        for function, args in hooks:
+            self._call(function, args, {})
+
+    @staticmethod
+    def _catches_up(timers: List['ScheduledTimer']) -> bool:
+        """ Whether a group with the given timers runs its missed ticks back-to-back. """
+        return any(timer.missed_ticks == CATCH_UP_MISSED_TICKS for timer in timers)
+
+    @staticmethod
+    def _call(function: Callable, args: tuple, kwargs: dict) -> None:
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            logging.exception("Timer callback {} failed".format(function))
+
+    def _next_group(self) -> Tuple[float, int, List['ScheduledTimer'], List[Tuple[Callable, tuple]]]:
+        """
+        Waits for the earliest deadline and reschedules its group.
+        :return: the deadline, how many more deadlines have passed since then, the timers and the hooks to call
+        """
+        with self._condition:
+            while True:
+                if not self._heap or self.manual:
+                    self._condition.wait()
+                    continue
+                deadline, _, group = self._heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    # Wakes up earlier if a new group is added meanwhile
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                if self._groups.get(group.interval) is not group:
+                    # The group was emptied: forget it
+                    continue
+                behind = int((time.monotonic() - deadline) // group.interval)
+                # Next deadline on the group's grid: the next one in the past when catching up,
+                # otherwise the next one in the future
+                if self._catches_up(group.timers):
+                    next_deadline = deadline + group.interval
+                else:
+                    next_deadline = deadline + (behind + 1) * group.interval
+                heapq.heappush(self._heap, (next_deadline, next(self._counter), group))
+                return deadline, behind, list(group.timers), list(group.hooks)
+
+
+# The scheduler shared by all the simulated devices
+tick_scheduler = TickScheduler()
+
+
+class ScheduledTimer:
     """
     Implementation of a recurrent timer, that keeps calling a given function
     at a given frequency. Can be stopped, paused and resumed.
     Arguments can be passed to the target function by passing them
     as extra arguments to the ``__init__`` function of this timer.
+
+    All the timers are driven by the shared ``TickScheduler`` instead of a thread each,
+    so any number of devices can be simulated. When the function runs longer than the interval,
+    the ticks missed meanwhile are either skipped or run back-to-back, according to ``missed_ticks``
+    (``SKIP_MISSED_TICKS`` or ``CATCH_UP_MISSED_TICKS``).
+    Timing statistics are available in ``self.statistics`` (see ``TimerStatistics``).
+    Give a ``scheduler`` to be driven by another ``TickScheduler`` than the shared one, for example in tests.
     """
-    def __init__(self, interval, function, *args, **kwargs):
+    def __init__(self, interval, function, *args, missed_ticks=SKIP_MISSED_TICKS, scheduler=None, **kwargs):
         self.interval = interval
         self.function = self._orig_function = function
         self.args = args
         self.kwargs = kwargs
-        self.start = time.time()
-        self.event = Event()
-        self.thread = Thread(target=self._target)
-        self.thread.daemon = True
-        self.thread.start()
-
-    def _target(self):
-        while not self.event.wait(self._time):
-            self.function(*self.args, **self.kwargs)
-
-    @property
-    def _time(self):
-        return self.interval - ((time.time() - self.start) % self.interval)
+        self.missed_ticks = missed_ticks
+        # Ticks dropped since the last call, reported with the next one
+        self.skipped_ticks = 0
+        self.statistics = TimerStatistics(interval)
+        self.scheduler = scheduler if scheduler is not None else tick_scheduler
+        self.scheduler.add(self)
 
     def pause(self):
         self.function = lambda *args, **kwargs: None
@@ -59,5 +470,4 @@ class RepeatedTimer:
         self.function = self._orig_function
 
     def stop(self):
-        self.event.set()
-        self.thread.join()
+        self.scheduler.remove(self)
@@ -0,0 +1,106 @@
+"""
+Detection of the moments when the GUI thread stops processing events (the panel "freezes").
+
+Run any entry point with ``--watchdog`` (for example ``run-example-3 --watchdog``), or ``--watchdog=<ms>``
+to choose the threshold (200 ms by default). Whenever the event loop is blocked for longer than that,
+the Python stack of the GUI thread is logged as a warning, showing which code is blocking it,
+for example a synchronous GET to a slow device. When the event loop recovers, the total duration
+of the stall is logged too.
+"""
+import sys
+import time
+import logging
+import threading
+import traceback
+from typing import List, Optional
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSlot
+
+# Command line flag enabling the watchdog
+FLAG = "--watchdog"
+
+
+class StallWatchdog(QObject):
+    """
+    A timer of the GUI thread records a heartbeat at regular intervals, and a helper thread checks
+    that the heartbeats keep coming. If they stop for longer than ``threshold`` milliseconds, the helper
+    thread captures the current stack of the GUI thread and logs it.
+
+    Create it from the GUI thread, once the ``QApplication`` exists.
+    """
+    def __init__(self, threshold: int = 200, parent: Optional[QObject] = None):
+        """
+        :param threshold: how long (in milliseconds) the event loop must be blocked to be reported
+        :param parent: the parent QObject
+        """
+        super().__init__(parent)
+        self.threshold = threshold / 1000
+        # Number of stalls detected so far
+        self.stall_count = 0
+        self._gui_thread_id = threading.get_ident()
+        # Guards _last_beat and _stall_start, shared by the GUI thread and the helper thread
+        self._lock = threading.Lock()
+        self._last_beat = time.monotonic()
+        self._stall_start: Optional[float] = None
+        self._stop = threading.Event()
+        # Beat a few times per threshold, so that the heartbeats alone never look like a stall
+        self._heartbeat = QTimer(self)
+        self._heartbeat.timeout.connect(self._beat)
+        self._heartbeat.start(max(threshold // 4, 1))
+        self._thread = threading.Thread(target=self._watch, name="StallWatchdog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @pyqtSlot()
+    def _beat(self) -> None:
+        """ Called by the event loop: records that it's running, and reports the end of a stall. """
+        now = time.monotonic()
+        with self._lock:
+            stall_start, self._stall_start = self._stall_start, None
+            self._last_beat = now
+        if stall_start is not None:
+            logging.warning("GUI thread recovered after a stall of {:.0f} ms".format((now - stall_start) * 1000))
+
+    def _watch(self) -> None:
+        """ Runs on the helper thread: reports the stalls. """
+        while not self._stop.wait(self.threshold / 4):
+            with self._lock:
+                blocked = time.monotonic() - self._last_beat
+                if blocked <= self.threshold or self._stall_start is not None:
+                    continue
+                self._stall_start = self._last_beat
+                self.stall_count += 1
+            logging.warning("GUI thread blocked for {:.0f} ms, it's running:\n{}".format(
+                blocked * 1000, "".join(self.gui_thread_stack())))
+
+    def gui_thread_stack(self) -> List[str]:
+        """ Returns the current Python stack of the GUI thread, formatted like a traceback. """
+        frame = sys._current_frames().get(self._gui_thread_id)
+        return traceback.format_stack(frame) if frame is not None else []
+
+    def stop(self) -> None:
+        """ Stops watching. """
+        self._heartbeat.stop()
+        self._stop.set()
+        self._thread.join()
+
+
+def start_if_requested(argv: Optional[List[str]] = None, parent: Optional[QObject] = None) -> Optional[StallWatchdog]:
+    """
+    Starts a ``StallWatchdog`` if the command line contains ``--watchdog`` (or ``--watchdog=<ms>``).
+    Give it a parent, like the ``QApplication``, or keep the returned watchdog alive as long as the application runs.
+    :param argv: the command line arguments, by default ``sys.argv``
+    :param parent: the parent QObject of the watchdog
+    :return: the watchdog, or None if not requested
+    """
+    for argument in (argv if argv is not None else sys.argv)[1:]:
+        if argument == FLAG or argument.startswith(FLAG + "="):
+            threshold = argument.partition("=")[2]
+            if not threshold:
+                return StallWatchdog(parent=parent)
+            if not threshold.isdigit() or int(threshold) == 0:
+                logging.error("Invalid {} threshold '{}': give a number of milliseconds, like {}=200. "
+                              "Using the default one.".format(FLAG, threshold, FLAG))
+                return StallWatchdog(parent=parent)
+            return StallWatchdog(int(threshold), parent)
+    return None
@@ -0,0 +1,173 @@
+"""
+Measurement of the startup time of the demo applications.
+
+Run any entry point with ``--profile-startup`` (for example ``run-example-3 --profile-startup``)
+to record how long each phase of the startup takes, including every module imported.
+Just before entering the event loop, the report is logged and written to ``startup_profile.txt``,
+together with ``startup_profile.json``, a trace to open in ``chrome://tracing`` or https://ui.perfetto.dev.
+Use ``--profile-startup=<directory>`` to write them somewhere else than in the current directory.
+
+Phases are recorded with::
+
+    with profiler.span("Create the model"):
+        ...
+
+Spans opened inside other spans are nested in the report. When profiling is off, spans cost
+almost nothing, so they can stay in the code.
+
+This module is imported first thing by ``demo/__init__.py``, so it only uses the standard library.
+"""
+import os
+import sys
+import json
+import time
+import builtins
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+# Command line flag enabling the profiler
+FLAG = "--profile-startup"
+
+
+class _Span:
+    """ A timed phase of the startup. """
+    def __init__(self, name: str, category: str, start: float, depth: int):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end: Optional[float] = None
+        self.depth = depth
+
+
+class StartupProfiler:
+    """
+    Records nested, timed spans, and the time taken by each import.
+    Only the spans of the main thread are recorded: the startup happens there.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.output_directory = "."
+        self._origin = 0.0
+        self._spans: List[_Span] = []
+        self._stack: List[_Span] = []
+        self._original_import = None
+
+    def start(self, output_directory: str = ".") -> None:
+        """
+        Starts recording, including the imports.
+        :param output_directory: where ``finish()`` writes the report
+        :return: None
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+        self.output_directory = output_directory
+        self._origin = time.perf_counter()
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def begin(self, name: str, category: str = "phase") -> None:
+        """ Opens a span, to be closed by ``end()``. Prefer ``span()`` when the phase fits in a block. """
+        if not self.enabled or threading.current_thread() is not threading.main_thread():
+            return
+        span = _Span(name, category, time.perf_counter(), len(self._stack))
+        self._spans.append(span)
+        self._stack.append(span)
+
+    def end(self, name: str) -> None:
+        """ Closes the span with the given name, and the spans opened inside it and still open. """
+        if not self.enabled or threading.current_thread() is not threading.main_thread():
+            return
+        if not any(span.name == name for span in self._stack):
+            return
+        now = time.perf_counter()
+        while self._stack:
+            span = self._stack.pop()
+            span.end = now
+            if span.name == name:
+                return
+
+    @contextmanager
+    def span(self, name: str, category: str = "phase"):
+        """ Records the time taken by the block of code it surrounds. """
+        if not self.enabled:
+            yield
+            return
+        self.begin(name, category)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        """ Replaces ``__import__``, recording a span for each module imported for the first time. """
+        if level == 0 and name not in sys.modules and threading.current_thread() is threading.main_thread():
+            with self.span(name, "import"):
+                return self._original_import(name, globals, locals, fromlist, level)
+        return self._original_import(name, globals, locals, fromlist, level)
+
+    def stop(self) -> None:
+        """ Stops recording, and closes all the spans still open. """
+        if not self.enabled:
+            return
+        builtins.__import__ = self._original_import
+        now = time.perf_counter()
+        for span in self._stack:
+            span.end = now
+        self._stack.clear()
+        self.enabled = False
+
+    def text_report(self) -> str:
+        """ Returns the spans as an indented tree, with their duration in milliseconds. """
+        lines = ["Startup profile (ms, imports marked with *)"]
+        for span in self._spans:
+            duration = ((span.end if span.end is not None else time.perf_counter()) - span.start) * 1000
+            marker = "*" if span.category == "import" else " "
+            lines.append("{:10.1f} {}{}{}".format(duration, "  " * span.depth, marker, span.name))
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict:
+        """ Returns the spans in the Trace Event Format of chrome://tracing. """
+        events = [{
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": (span.start - self._origin) * 1e6,
+            "dur": ((span.end if span.end is not None else time.perf_counter()) - span.start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.main_thread().ident,
+        } for span in self._spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def finish(self) -> None:
+        """ Stops recording, logs the report and writes it to the output directory. Does nothing if not enabled. """
+        if not self.enabled:
+            return
+        self.stop()
+        report = self.text_report()
+        logging.info(report)
+        os.makedirs(self.output_directory, exist_ok=True)
+        with open(os.path.join(self.output_directory, "startup_profile.txt"), "w") as report_file:
+            report_file.write(report + "\n")
+        with open(os.path.join(self.output_directory, "startup_profile.json"), "w") as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+
+# The profiler of the application
+profiler = StartupProfiler()
+
+
+def start_if_requested(argv: Optional[List[str]] = None) -> None:
+    """
+    Starts the profiler if the command line contains ``--profile-startup`` (or ``--profile-startup=<directory>``),
+    opening the span of the package import, closed by the entry points.
+    :param argv: the command line arguments, by default ``sys.argv``
+    :return: None
+    """
+    for argument in (argv if argv is not None else sys.argv)[1:]:
+        if argument == FLAG or argument.startswith(FLAG + "="):
+            profiler.start(argument.partition("=")[2] or ".")
+            profiler.begin("Package import")
+            return
@@ -0,0 +1,124 @@
+"""
+Generation of the Python code for the .ui and .qrc files (Qt Designer files) of the demo.
+
+The code is normally generated once, when the package is built (see ``setup.py``), or by running::
+
+    demo-generate-ui [--force]
+
+Importing the package does nothing with them by default. While developing, set the environment variable
+``DEMO_DEV_UI=1``: at import time, ``demo/__init__.py`` then (re)generates the files that are missing,
+or older than their .ui and .qrc files.
+"""
+import os
+import sys
+import time
+import glob
+import zlib
+import tempfile
+from contextlib import contextmanager
+from typing import List, Tuple
+
+
+DEMO_DIR = os.path.dirname(os.path.realpath(__file__))
+CONFIG_FILE = os.path.join(DEMO_DIR, 'pyqt5ac.yml')
+# Created while a process generates the files. It lives in the temporary folder, as the package folder
+# may be read-only, and is named after the package folder, so that each checkout gets its own lock.
+LOCK_FILE = os.path.join(tempfile.gettempdir(),
+                         'demo-ui-generation-{:08x}.lock'.format(zlib.crc32(DEMO_DIR.encode())))
+
+# Environment variable enabling the generation at import
+DEV_FLAG = "DEMO_DEV_UI"
+
+
+def generated_files() -> List[Tuple[str, str]]:
+    """
+    Lists the Qt Designer files of the demo, together with the Python file generated from each of them,
+    following the paths given in ``pyqt5ac.yml``.
+    :return: a list of (source file, generated file) absolute paths
+    """
+    # PyYAML is installed together with pyqt5ac, and imported only when the check is needed
+    import yaml
+    with open(CONFIG_FILE) as config_file:
+        config = yaml.safe_load(config_file)
+
+    files = []
+    for source_pattern, target_pattern in config["ioPaths"]:
+        for source in glob.glob(os.path.join(DEMO_DIR, source_pattern)):
+            target = target_pattern.replace("%%DIRNAME%%", os.path.dirname(source))
+            target = target.replace("%%FILENAME%%", os.path.splitext(os.path.basename(source))[0])
+            files.append((source, os.path.normpath(target)))
+    return files
+
+
+def is_outdated(check_mtimes: bool = False) -> bool:
+    """
+    Checks whether the generated code needs to be (re)generated.
+    :param check_mtimes: if True, generated files older than their source are considered outdated.
+        Otherwise only missing generated files are.
+    :return: True if at least one file has to be generated
+    """
+    for source, target in generated_files():
+        if not os.path.exists(target):
+            return True
+        if check_mtimes and os.path.getmtime(source) > os.path.getmtime(target):
+            return True
+    return False
+
+
+def generate(force: bool = False) -> None:
+    """
+    Generates the code of all the .ui and .qrc files with ``pyqt5ac``.
+    :param force: if True, regenerates all files, even the ones that are up-to-date
+    :return: None
+    """
+    import pyqt5ac
+    pyqt5ac.main(config=CONFIG_FILE, force=force)
+
+
+@contextmanager
+def _generation_lock(timeout: float = 60.0):
+    """
+    Lets one process at a time generate the files, for example when the workers of ``pytest -n``
+    import the package together. If another process still holds the lock after ``timeout`` seconds
+    (or left it behind when crashing: then delete ``LOCK_FILE``), the files are generated anyway.
+    The lock is only released by the process that took it.
+    """
+    deadline = time.monotonic() + timeout
+    owned = False
+    while True:
+        try:
+            os.close(os.open(LOCK_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            owned = True
+            break
+        except FileExistsError:
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.1)
+        except OSError:
+            # The temporary folder can't be written: generate without the lock
+            break
+    try:
+        yield
+    finally:
+        if owned:
+            os.remove(LOCK_FILE)
+
+
+def ensure_generated() -> None:
+    """
+    Generates the missing and outdated files, only when the ``DEMO_DEV_UI`` environment variable is set.
+    Otherwise it does nothing: the files are generated when the package is built.
+    :return: None
+    """
+    if not os.environ.get(DEV_FLAG):
+        return
+    if is_outdated(check_mtimes=True):
+        with _generation_lock():
+            # Another process may have generated them while this one was waiting
+            if is_outdated(check_mtimes=True):
+                generate()
+
+
+def main():
+    """ Entry point of the ``demo-generate-ui`` command. """
+    generate(force="--force" in sys.argv[1:])
@@ -7,6 +7,7 @@ https://packaging.python.org/guides/distributing-packages-using-setuptools/
 """
 from pathlib import Path
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 
 HERE = Path(__file__).parent.absolute()
@@ -19,6 +20,7 @@ REQUIREMENTS: dict = {
         "pyqt5",
         "pyqt5ac @ git+https://:@gitlab.cern.ch:8443/szanzott/pyqt5ac.git",  # To automate the compilation of .ui and .qrc files
         "accwidgets",
+        "numpy",
         "pyjapc",
         "papc",  # For sandbox mode and tests
     ],
@@ -27,6 +29,10 @@ REQUIREMENTS: dict = {
         "pytest-qt",
         "pytest-cov",
         "pytest-random-order",
+        "pytest-xdist",  # To run the tests in parallel: python -m pytest -n auto
+    ],
+    'benchmark': [
+        "pytest-benchmark",
     ],
     'dev': [
     ],
@@ -37,6 +43,24 @@ REQUIREMENTS: dict = {
 }
 
 
+class BuildPyWithGeneratedUi(build_py):
+    """
+    Generates the Python code of the .ui and .qrc files before building,
+    so that the application doesn't need to do it at runtime.
+    pyqt5ac is listed in the build requirements of ``pyproject.toml``, so pip always installs it first.
+    """
+    def run(self):
+        try:
+            import pyqt5ac
+        except ImportError:
+            raise RuntimeError("pyqt5ac is needed to build the package: install it, "
+                               "or build with pip, that takes it from pyproject.toml") from None
+        pyqt5ac.main(config=str(HERE / 'demo' / 'pyqt5ac.yml'))
+        # The generated folders are new packages: make sure they get built too
+        self.packages = self.distribution.packages = find_packages()
+        super().run()
+
+
 setup(
     name='demo',
     version="0.0.1.dev0",
@@ -66,12 +90,16 @@ setup(
         # The 'all' extra is the union of all requirements.
         'all': [req for reqs in REQUIREMENTS.values() for req in reqs],
     },
+    cmdclass={
+        'build_py': BuildPyWithGeneratedUi,
+    },
     entry_points={
         'console_scripts': [
             'run-demo=demo.main:main',
             'run-example-1=demo.example_1_simple_form.main:main',
             'run-example-2=demo.example_2_image.main:main',
             'run-example-3=demo.example_3_plot.main:main',
+            'demo-generate-ui=demo.ui_generation:main',
         ],
     },
 )